@@ -0,0 +1,188 @@
+
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# Awaitable counterparts of the NiftyRec and NiftyReg wrappers, for asyncio applications. The calls run in an
+# executor (set_executor, or the 'executor' argument; default: the default executor of the event loop), hence
+# the event loop keeps serving I/O while the C library or the NumPy engine computes (ctypes releases the GIL).
+# The projectors are run in chunks (ranges of cameras for SPECT, ranges of locations for compressed PET):
+# cancelling the future stops the computation at the end of the current chunk.
+# The functions return asyncio futures (await them); they do not use the async syntax, so that this module can
+# be imported where asyncio does not exist (the calls then raise ImportError). asyncio (or trollius) is
+# imported on first use. NiftyPy runs on Python 2, where asyncio is not in the standard library: install
+# trollius to use this module (pip install NiftyPy[async]).
+
+import threading
+import numpy
+from numpy import float32
+from .Buffers import output_array
+from .NiftyRec import SPECT_project_parallelholes, SPECT_backproject_parallelholes, PET_project_compressed, PET_backproject_compressed
+from .NiftyRec.Compression import location_chunks, chunk_structure
+from .NiftyReg import resample_image_rigid
+
+__all__ = ['set_executor','get_executor','run_async','Cancelled',
+'SPECT_project_parallelholes_async','SPECT_backproject_parallelholes_async',
+'PET_project_compressed_async','PET_backproject_compressed_async','resample_image_rigid_async']
+
+SPECT_CHUNK = 16          # cameras per chunk
+PET_CHUNK   = 2**20       # locations per chunk
+
+_executor = None
+
+
+class Cancelled(Exception):
+    """Raised in the executor when the future of a chunked call has been cancelled. """
+    pass
+
+
+def set_executor(executor):
+    """Executor of the awaitable calls (e.g. a concurrent.futures.ThreadPoolExecutor); None: the default executor
+    of the event loop. Returns the previous executor. """
+    global _executor
+    previous = _executor
+    _executor = executor
+    return previous
+
+def get_executor():
+    return _executor
+
+
+def _asyncio():
+    try:
+        import asyncio
+    except ImportError:
+        import trollius as asyncio
+    return asyncio
+
+
+def _drive(steps, cancelled):
+    # Run the chunks of a call; the last value yielded by 'steps' is the result.
+    result = None
+    for result in steps:
+        if cancelled.is_set():
+            raise Cancelled()
+    return result
+
+
+def _submit(steps, executor, loop):
+    # Run the generator 'steps' in the executor; cancelling the future stops it between two chunks.
+    asyncio = _asyncio()
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    if executor is None:
+        executor = _executor
+    cancelled = threading.Event()
+    future = loop.run_in_executor(executor, _drive, steps, cancelled)
+    def done(f):
+        if f.cancelled():
+            cancelled.set()
+    future.add_done_callback(done)
+    return future
+
+
+def _single(function, args, kwargs):
+    yield function(*args, **kwargs)
+
+
+def run_async(function, *args, **kwargs):
+    """Run any wrapper, function(*args, **kwargs), in the executor; returns an asyncio future. 'executor' and
+    'loop' are taken from kwargs. The call cannot be interrupted once it has started. """
+    executor = kwargs.pop('executor', None)
+    loop = kwargs.pop('loop', None)
+    return _submit(_single(function, args, kwargs), executor, loop)
+
+
+def _ranges(N, chunk_size):
+    for start in range(0, N, int(chunk_size)):
+        yield start, min(start+int(chunk_size), N)
+
+
+#### NiftyRec: ####
+
+def _SPECT_project(activity, cameras, attenuation, psf, background, background_attenuation, use_gpu, truncate_negative_values, out, chunk_size):
+    projection = output_array((activity.shape[0],activity.shape[1],cameras.shape[0])+activity.shape[3:],float32,"F",out)
+    buffers = {}
+    for start, stop in _ranges(cameras.shape[0], chunk_size):
+        if projection.ndim == 3:
+            chunk = projection[:,:,start:stop]
+        else:
+            # the cameras of a stack of frames are not contiguous in the projection: project into a buffer
+            shape = projection[:,:,start:stop].shape
+            chunk = buffers.get(shape)
+            if chunk is None:
+                chunk = buffers[shape] = numpy.zeros(shape, dtype=float32, order="F")
+        SPECT_project_parallelholes(activity, cameras[start:stop], attenuation, psf, background, background_attenuation,
+                                    use_gpu, truncate_negative_values, out=chunk)
+        if projection.ndim != 3:
+            projection[:,:,start:stop] = chunk
+        yield None
+    yield projection
+
+def _SPECT_backproject(projection, cameras, attenuation, psf, background, background_attenuation, use_gpu, truncate_negative_values, out, chunk_size):
+    shape = (projection.shape[0],projection.shape[1],projection.shape[0])+projection.shape[3:]
+    backprojection = output_array(shape,float32,"F",out)
+    chunk = numpy.zeros(shape, dtype=float32, order="F")
+    for start, stop in _ranges(cameras.shape[0], chunk_size):
+        SPECT_backproject_parallelholes(projection[:,:,start:stop], cameras[start:stop], attenuation, psf, background,
+                                        background_attenuation, use_gpu, truncate_negative_values, out=chunk)
+        backprojection += chunk
+        yield None
+    yield backprojection
+
+def SPECT_project_parallelholes_async(activity, cameras, attenuation=None, psf=None, background=0.0, background_attenuation=0.0, use_gpu=1,
+                                      truncate_negative_values=0, out=None, chunk_size=SPECT_CHUNK, executor=None, loop=None):
+    """Awaitable SPECT_project_parallelholes, in chunks of chunk_size cameras. """
+    cameras = numpy.asfortranarray(cameras, dtype=float32)
+    return _submit(_SPECT_project(activity, cameras, attenuation, psf, background, background_attenuation, use_gpu,
+                                  truncate_negative_values, out, chunk_size), executor, loop)
+
+def SPECT_backproject_parallelholes_async(projection, cameras, attenuation=None, psf=None, background=0.0, background_attenuation=0.0, use_gpu=1,
+                                          truncate_negative_values=0, out=None, chunk_size=SPECT_CHUNK, executor=None, loop=None):
+    """Awaitable SPECT_backproject_parallelholes, in chunks of chunk_size cameras. """
+    cameras = numpy.asfortranarray(cameras, dtype=float32)
+    return _submit(_SPECT_backproject(projection, cameras, attenuation, psf, background, background_attenuation, use_gpu,
+                                      truncate_negative_values, out, chunk_size), executor, loop)
+
+
+def _PET_project(activity, out, chunk_size, parameters):
+    offsets, locations, active = parameters.pop('offsets'), parameters.pop('locations'), parameters.pop('active', None)
+    projection = output_array((locations.shape[1],),float32,"C",out)
+    for start, stop in location_chunks(offsets, locations.shape[1], chunk_size):
+        o, l, a = chunk_structure(offsets, locations, active, start, stop)
+        PET_project_compressed(activity, offsets=o, locations=l, active=a, out=projection[start:stop], **parameters)
+        yield None
+    yield projection
+
+def _PET_backproject(projection_data, out, chunk_size, parameters):
+    offsets, locations, active = parameters.pop('offsets'), parameters.pop('locations'), parameters.pop('active', None)
+    shape = (parameters['N_activity_x'],parameters['N_activity_y'],parameters['N_activity_z'])
+    backprojection = output_array(shape,float32,"F",out)
+    chunk = numpy.zeros(shape, dtype=float32, order="F")
+    projection_data = numpy.asarray(projection_data, dtype=float32).reshape(-1)
+    for start, stop in location_chunks(offsets, locations.shape[1], chunk_size):
+        o, l, a = chunk_structure(offsets, locations, active, start, stop)
+        PET_backproject_compressed(projection_data[start:stop], offsets=o, locations=l, active=a, out=chunk, **parameters)
+        backprojection += chunk
+        yield None
+    yield backprojection
+
+def PET_project_compressed_async(activity, out=None, chunk_size=PET_CHUNK, executor=None, loop=None, **parameters):
+    """Awaitable PET_project_compressed (keyword arguments), in chunks of about chunk_size locations. """
+    return _submit(_PET_project(activity, out, chunk_size, parameters), executor, loop)
+
+def PET_backproject_compressed_async(projection_data, out=None, chunk_size=PET_CHUNK, executor=None, loop=None, **parameters):
+    """Awaitable PET_backproject_compressed (keyword arguments), in chunks of about chunk_size locations. """
+    return _submit(_PET_backproject(projection_data, out, chunk_size, parameters), executor, loop)
+
+
+#### NiftyReg: ####
+
+def resample_image_rigid_async(image_data, translation, rotation, center_rotation, sform=None, use_gpu=1, executor=None, loop=None):
+    """Awaitable resample_image_rigid. """
+    return run_async(resample_image_rigid, image_data, translation, rotation, center_rotation, sform, use_gpu, executor=executor, loop=loop)
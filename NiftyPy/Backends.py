@@ -0,0 +1,221 @@
+
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# Registry of the implementations (backends) of the operations of NiftyRec and NiftyReg. Each operation (e.g.
+# 'SPECT_project_parallelholes') has one or more backends: 'gpu' (C library, use_gpu=1), 'c' (C library on the
+# CPU, use_gpu=0) and 'numpy' (NumPy engine). A call selects, among the available backends whose size range
+# holds the size of the problem (number of voxels), the one with the highest priority: the GPU for large
+# problems, the C library on the CPU otherwise, the NumPy engine when the C library is not available. Hence the
+# same pipeline runs on CPU-only and GPU hosts with the fastest available engine.
+# The selection can be forced per call (backend='numpy') or with the environment variables
+# NIFTYPY_BACKEND_<OPERATION> (e.g. NIFTYPY_BACKEND_SPECT_PROJECT_PARALLELHOLES=c) and NIFTYPY_BACKEND (all the
+# operations that have a backend with that name). New backends are added with register_backend.
+
+import os
+import inspect
+import threading
+import numpy
+
+__all__ = ['Backend','BackendRegistry','NoBackendAvailable','register_backend','select_backend','call_backend','list_backends','backends']
+
+GPU_MIN_VOXELS = 64**3     # below this size the transfers to the GPU cost more than the computation
+
+
+class NoBackendAvailable(Exception):
+    def __init__(self, msg):
+        self.msg = msg
+    def __str__(self):
+        return "No backend available: %s"%str(self.msg)
+
+
+class Backend(object):
+    """Implementation 'name' of an operation: function(*args, **kwargs), with the arguments of the wrapper (without
+    use_gpu). 'available' is a function that tells whether the backend can run on this host; the backend is
+    considered for problems of min_size to max_size voxels (None: no bound); higher 'priority' is preferred. """
+    def __init__(self, name, function, available=None, priority=0, min_size=0, max_size=None):
+        self.name = name
+        self.function = function
+        self._available = available
+        self.priority = priority
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def available(self):
+        return self._available is None or bool(self._available())
+
+    def accepts(self, size):
+        return size >= self.min_size and (self.max_size is None or size <= self.max_size)
+
+    def __repr__(self):
+        return "Backend(%r, priority=%r, min_size=%r, max_size=%r)"%(self.name, self.priority, self.min_size, self.max_size)
+
+
+class BackendRegistry(object):
+    """Backends of each operation. 'size' of an operation is a function of the arguments of a call that returns the
+    size of the problem (default: number of elements of the first argument). """
+    def __init__(self):
+        self._backends = {}
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def register(self, operation, name, function, available=None, priority=0, min_size=0, max_size=None, size=None):
+        """Register (or replace) the backend 'name' of 'operation'. """
+        with self._lock:
+            backends = self._backends.setdefault(operation, {})
+            backends[name] = Backend(name, function, available, priority, min_size, max_size)
+            if size is not None:
+                self._sizes[operation] = size
+        return backends[name]
+
+    def operations(self):
+        return sorted(self._backends.keys())
+
+    def backends(self, operation):
+        """Backends of 'operation', by decreasing priority. """
+        if operation not in self._backends:
+            raise KeyError("Unknown operation '%s'; the operations are: %s"%(operation, ", ".join(self.operations())))
+        return sorted(self._backends[operation].values(), key=lambda b: -b.priority)
+
+    def size(self, operation, args, kwargs):
+        size = self._sizes.get(operation)
+        if size is not None:
+            return size(*args, **kwargs)
+        return int(numpy.size(args[0])) if args else 0
+
+    def _forced(self, operation):
+        # backend forced by the environment: NIFTYPY_BACKEND_<OPERATION>, then NIFTYPY_BACKEND if the operation has it
+        name = os.environ.get('NIFTYPY_BACKEND_'+operation.upper())
+        if name:
+            return name
+        name = os.environ.get('NIFTYPY_BACKEND')
+        if name and name in self._backends.get(operation, {}):
+            return name
+        return None
+
+    def select(self, operation, size=0, backend=None):
+        """Backend for a problem of 'size' voxels: 'backend' if given (name), else the one forced by the environment,
+        else the available backend with the highest priority whose size range holds 'size'. A forced backend that is
+        not available raises NoBackendAvailable. """
+        backends = self.backends(operation)
+        name = backend if backend is not None else self._forced(operation)
+        if name is not None:
+            for b in backends:
+                if b.name == name:
+                    if not b.available():
+                        raise NoBackendAvailable("the backend '%s' of '%s' cannot run on this host. "%(name, operation))
+                    return b
+            raise NoBackendAvailable("'%s' is not a backend of '%s'; the backends are: %s"%(name, operation, ", ".join([b.name for b in backends])))
+        candidates = [b for b in backends if b.available()]
+        if not candidates:
+            raise NoBackendAvailable("none of the backends of '%s' (%s) can run on this host. "%(operation, ", ".join([b.name for b in backends])))
+        for b in candidates:
+            if b.accepts(size):
+                return b
+        return candidates[0]
+
+    def call(self, operation, *args, **kwargs):
+        """Run 'operation' with the selected backend; kwargs 'backend' forces a backend by name. """
+        backend = kwargs.pop('backend', None)
+        size = self.size(operation, args, kwargs) if backend is None else 0
+        return self.select(operation, size, backend).function(*args, **kwargs)
+
+
+backends = BackendRegistry()
+
+def register_backend(operation, name, function, available=None, priority=0, min_size=0, max_size=None, size=None):
+    """Register a backend of an operation in the registry of NiftyPy. See BackendRegistry.register. """
+    return backends.register(operation, name, function, available, priority, min_size, max_size, size)
+
+def select_backend(operation, size=0, backend=None):
+    """Backend of 'operation' for a problem of 'size' voxels. See BackendRegistry.select. """
+    return backends.select(operation, size, backend)
+
+def call_backend(operation, *args, **kwargs):
+    """Run 'operation' (e.g. 'SPECT_project_parallelholes') with the fastest available backend, or with the one
+    given by the keyword argument 'backend'. The arguments are those of the wrapper without use_gpu, by position
+    or by name; every backend accepts the same call. """
+    return backends.call(operation, *args, **kwargs)
+
+def list_backends(operation=None):
+    """Names of the backends of an operation (of all the operations if None), by decreasing priority. """
+    if operation is None:
+        return dict([(o, [b.name for b in backends.backends(o)]) for o in backends.operations()])
+    return [b.name for b in backends.backends(operation)]
+
+
+#### Backends of NiftyRec and NiftyReg: ####
+
+def _arguments(names, args, kwargs):
+    # arguments of a call by name; 'names' are the parameters of the wrapper without use_gpu
+    if len(args) > len(names):
+        raise TypeError("takes at most %d arguments without use_gpu (%d given)"%(len(names), len(args)))
+    kwargs = dict(kwargs)
+    for name, value in zip(names, args):
+        if name in kwargs:
+            raise TypeError("got multiple values for keyword argument '%s'"%name)
+        kwargs[name] = value
+    return kwargs
+
+def _parameters(function):
+    return [name for name in inspect.getargspec(function).args if name != 'use_gpu']
+
+def _engine(function, names, use_gpu):
+    # 'function' called with the arguments of the wrapper ('names'), by name, and with use_gpu if it takes it
+    takes_gpu = 'use_gpu' in inspect.getargspec(function).args
+    def call(*args, **kwargs):
+        kwargs = _arguments(names, args, kwargs)
+        if takes_gpu:
+            kwargs['use_gpu'] = use_gpu
+        else:
+            kwargs.pop('use_gpu', None)
+        return function(**kwargs)
+    return call
+
+def _size(size, names):
+    # size of the problem of a call, from the arguments by name
+    return lambda *args, **kwargs: size(_arguments(names, args, kwargs))
+
+def _register_defaults():
+    from .NiftyRec import NiftyRec
+    from .NiftyReg import NiftyReg
+    from .NiftyRec.SPECT_cpu import SPECT_project_parallelholes_cpu, SPECT_backproject_parallelholes_cpu
+    from .NiftyRec.PET_cpu import PET_project_compressed_cpu, PET_backproject_compressed_cpu
+    from .NiftyRec.TR_cpu import TR_resample_grid_cpu
+
+    niftyrec_available = lambda: NiftyRec.niftyrec_c.available()
+    niftyreg_available = lambda: NiftyReg.niftyreg_c.available()
+    def gpu_available():
+        if not niftyrec_available():
+            return False
+        try:
+            return len(NiftyRec.gpu_list()) > 0
+        except Exception:
+            return False
+
+    def volume_size(name):
+        return lambda a: int(numpy.size(a[name]))
+
+    SPECT_backproject_size = lambda a: int(a['projection'].shape[0])**2 * int(a['projection'].shape[1])
+    PET_backproject_size = lambda a: int(a['N_activity_x']) * int(a['N_activity_y']) * int(a['N_activity_z'])
+
+    for operation, wrapper, numpy_engine, available, size in [
+        ('SPECT_project_parallelholes',     NiftyRec.SPECT_project_parallelholes,     SPECT_project_parallelholes_cpu,     niftyrec_available, volume_size('activity')),
+        ('SPECT_backproject_parallelholes', NiftyRec.SPECT_backproject_parallelholes, SPECT_backproject_parallelholes_cpu, niftyrec_available, SPECT_backproject_size),
+        ('PET_project_compressed',          NiftyRec.PET_project_compressed,          PET_project_compressed_cpu,          niftyrec_available, volume_size('activity')),
+        ('PET_backproject_compressed',      NiftyRec.PET_backproject_compressed,      PET_backproject_compressed_cpu,      niftyrec_available, PET_backproject_size),
+        ('TR_resample_grid',                NiftyRec.TR_resample_grid,                TR_resample_grid_cpu,                niftyrec_available, volume_size('image_array')),
+        ('resample_image_rigid',            NiftyReg.resample_image_rigid,            None,                                niftyreg_available, volume_size('image_data')), ]:
+        names = _parameters(wrapper)
+        register_backend(operation, 'gpu', _engine(wrapper, names, 1), gpu_available, priority=20, min_size=GPU_MIN_VOXELS, size=_size(size, names))
+        register_backend(operation, 'c', _engine(wrapper, names, 0), available, priority=10)
+        if numpy_engine is not None:
+            register_backend(operation, 'numpy', _engine(numpy_engine, names, 0), None, priority=0)
+
+_register_defaults()
@@ -0,0 +1,113 @@
+
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Dec. 2013, Boston
+
+# Output buffers of the wrappers. The projectors and the resampling functions accept an 'out' array;
+# when it is not given, the output is taken from the active BufferPool (if any) instead of being allocated.
+
+from collections import OrderedDict
+import threading
+import sys
+import numpy
+
+__all__ = ['BufferPool','set_buffer_pool','get_buffer_pool','output_array']
+
+
+def _is_free(buffers, index):
+    # Only the list of the pool refers to the buffer (the second reference is the argument of getrefcount).
+    # Views of the buffer refer to it as their base, so a buffer is not free while a view is alive.
+    return sys.getrefcount(buffers[index]) == 2
+
+
+class BufferPool(object):
+    """Bounded pool of output arrays, keyed by (shape, dtype, order). A buffer is handed out again only when
+    nobody but the pool holds a reference to it, so results returned by the wrappers are never overwritten while in use.
+    When the total size exceeds 'max_bytes', the least recently used free buffers are evicted. """
+    def __init__(self, max_bytes=1024**3):
+        self.max_bytes = max_bytes
+        self.nbytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+        self._buffers  = OrderedDict()
+        self._lock     = threading.Lock()
+
+    def get(self, shape, dtype=numpy.float32, order='C'):
+        """Return a zeroed array of the given shape, dtype and order. """
+        key = (tuple(shape), numpy.dtype(dtype).str, order)
+        with self._lock:
+            buffers = self._buffers.pop(key, [])
+            self._buffers[key] = buffers   # most recently used
+            for i in range(len(buffers)):
+                if _is_free(buffers, i):
+                    self.hits += 1
+                    buf = buffers[i]
+                    buf.fill(0)
+                    return buf
+            self.misses += 1
+            buf = numpy.zeros(key[0], dtype=dtype, order=order)
+            buffers.append(buf)
+            self.nbytes += buf.nbytes
+            self._evict()
+            return buf
+
+    def _evict(self):
+        for key in list(self._buffers.keys()):
+            if self.nbytes <= self.max_bytes:
+                break
+            buffers = self._buffers[key]
+            for i in range(len(buffers)-1,-1,-1):
+                if _is_free(buffers, i):
+                    self.nbytes -= buffers.pop(i).nbytes
+                    if self.nbytes <= self.max_bytes:
+                        break
+            if not buffers:
+                del self._buffers[key]
+
+    def clear(self):
+        """Drop all the buffers. Arrays still referenced by the caller are not affected. """
+        with self._lock:
+            self._buffers.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {'nbytes':self.nbytes, 'max_bytes':self.max_bytes, 'hits':self.hits, 'misses':self.misses,
+                'buffers':sum([len(b) for b in self._buffers.values()])}
+
+
+_pool = None
+
+def set_buffer_pool(pool):
+    """Activate a BufferPool for the outputs of the wrappers; None deactivates pooling. Returns the previous pool. """
+    global _pool
+    previous = _pool
+    _pool = pool
+    return previous
+
+def get_buffer_pool():
+    """Return the active BufferPool (None if pooling is not active). """
+    return _pool
+
+
+def output_array(shape, dtype=numpy.float32, order='C', out=None):
+    """Output array of a wrapper: 'out' if given (after checking it and setting it to zero),
+    else a buffer from the active pool, else a new array. """
+    shape = tuple([int(s) for s in shape])
+    if out is not None:
+        if not isinstance(out, numpy.ndarray) or out.shape != shape or out.dtype != numpy.dtype(dtype):
+            raise ValueError("'out' must be an array of shape %s and dtype %s. "%(str(shape),numpy.dtype(dtype).name))
+        if (order == 'F' and not out.flags.f_contiguous) or (order == 'C' and not out.flags.c_contiguous):
+            raise ValueError("'out' must be a contiguous array with order '%s'. "%order)
+        if not out.flags.writeable:
+            raise ValueError("'out' must be writeable. ")
+        out.fill(0)
+        return out
+    pool = _pool
+    if pool is not None:
+        return pool.get(shape, dtype, order)
+    return numpy.zeros(shape, dtype=dtype, order=order)
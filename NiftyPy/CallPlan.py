@@ -0,0 +1,195 @@
+
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Dec. 2013, Boston
+
+# Precompiled calling sequences for the functions of the NiftyRec and NiftyReg C libraries.
+# simplewrap.call_c_function parses a descriptor (a list of dictionaries) and sets the ctypes argtypes
+# on every call. A CallPlan parses the same kind of descriptor (without the 'value' entries) only once,
+# when the library is loaded; at call time the values are bound by name and arrays are passed by pointer,
+# after normalizing their dtype and memory order (see Layout).
+
+from ctypes import c_int, c_int32, c_uint32, c_longlong, c_float, c_void_p, c_char_p, POINTER, byref
+from simplewrap.exceptions import DescriptorError, UnknownType
+from .Layout import normalize_array
+from .Library import Library
+from timeit import default_timer as clock
+import numpy
+
+__all__ = ['CallPlan','CallResult','StatusTable','LibraryNotFound','set_profiler']
+
+
+_scalar_ctypes = {'int':c_int32, 'uint':c_uint32, 'long':c_longlong, 'float':c_float}
+
+ARRAY  = 0
+SCALAR = 1
+STRING = 2
+
+
+# Profiler of the calls (see Profiling); None: the calls are not instrumented.
+_profiler = None
+
+def set_profiler(profiler):
+    """Record the calls of all the CallPlans with 'profiler' (None: stop recording). Returns the previous profiler. """
+    global _profiler
+    previous = _profiler
+    _profiler = profiler
+    return previous
+
+
+class LibraryNotFound(Exception): 
+    def __init__(self,msg): 
+        self.msg = msg 
+    def __str__(self): 
+        return "Library cannot be found: %s"%str(self.msg) 
+
+
+class CallResult(object):
+    """Outcome of a call through a CallPlan. Same interface as the object returned by simplewrap.call_c_function:
+    the bound parameters are available as attributes and in 'dictionary', the return value of the C function in 'status'. """
+    def __init__(self, status, dictionary):
+        self.status = status
+        self.dictionary = dictionary
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['dictionary'][name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class CallPlan(object):
+    """Calling sequence of a C function, resolved once from a descriptor. The descriptor has the same format
+    as the one of simplewrap.call_c_function, without 'value': 'name', 'type' and, for arrays, optional 'dtype' and 'order'.
+    Output arrays must be allocated by the caller and passed like the input arrays. """
+    def __init__(self, library, function_name, descriptor):
+        self.function_name = function_name
+        self.layout = []
+        argtypes = []
+        for d in descriptor:
+            if d['name'] == 'status':
+                raise DescriptorError("variable name 'status' is reserved. ")
+            argtype = d['type']
+            if argtype == 'array':
+                self.layout.append( (d['name'], ARRAY, d.get('dtype',None), d.get('order',None)) )
+                argtypes.append(c_void_p)
+            elif argtype in _scalar_ctypes:
+                ctype = _scalar_ctypes[argtype]
+                self.layout.append( (d['name'], SCALAR, ctype, None) )
+                argtypes.append(POINTER(ctype))
+            elif argtype == 'string':
+                self.layout.append( (d['name'], STRING, None, None) )
+                argtypes.append(c_char_p)
+            else:
+                raise UnknownType("Type %s is not supported. "%str(argtype))
+        self.argtypes = argtypes
+        self.library = library
+        self.c_function = None
+
+    def resolve(self):
+        """Obtain the function pointer from the library. This is done at the first call, so that declaring a plan
+        for a function that is missing from the library does not fail at import time. """
+        library = self.library
+        if isinstance(library, Library):
+            library = library.load()
+        if library is None:
+            raise LibraryNotFound("the C function '%s' cannot be called. "%self.function_name)
+        # Use a private function pointer, so that the argtypes cannot be overwritten by simplewrap.call_c_function
+        c_function = library[self.function_name]
+        c_function.restype  = c_int
+        c_function.argtypes = self.argtypes
+        self.c_function = c_function
+        return c_function
+
+    def _marshal(self, values):
+        # Arguments of the C function; the normalized arrays replace the given ones in 'values'.
+        args_c  = []
+        scalars = []
+        for name, kind, kind_type, order in self.layout:
+            value = values.get(name,None)
+            if kind == ARRAY:
+                if value is None:
+                    raise DescriptorError("array '%s' of '%s' must be given (output arrays are allocated by the caller). "%(name,self.function_name))
+                value = normalize_array(value, kind_type, order, self.function_name)
+                values[name] = value
+                args_c.append(value.ctypes.data)
+            elif kind == SCALAR:
+                if value is None:
+                    value = 0
+                value = kind_type(value)
+                scalars.append((name,value))
+                args_c.append(byref(value))
+            else:
+                args_c.append(value)
+        return args_c, scalars
+
+    def __call__(self, **values):
+        profiler = _profiler
+        if profiler is not None:
+            return self._profiled_call(profiler, values)
+        c_function = self.c_function
+        if c_function is None:
+            c_function = self.resolve()
+        args_c, scalars = self._marshal(values)
+        status = c_function(*args_c)
+        for name, value in scalars:
+            values[name] = value.value
+        return CallResult(status, values)
+
+    def _profiled_call(self, profiler, values):
+        # Same as __call__, timing each phase; see Profiling.
+        t0 = clock()
+        c_function = self.c_function
+        if c_function is None:
+            c_function = self.resolve()
+        t1 = clock()
+        given = dict([(name, values.get(name)) for name, kind, kind_type, order in self.layout if kind == ARRAY])
+        args_c, scalars = self._marshal(values)
+        nbytes = 0
+        copied = 0
+        for name, value in given.items():
+            nbytes += values[name].nbytes
+            if values[name] is not value:
+                copied += values[name].nbytes
+        t2 = clock()
+        status = c_function(*args_c)
+        t3 = clock()
+        for name, value in scalars:
+            values[name] = value.value
+        t4 = clock()
+        profiler.record(self.function_name, [('resolve',t0,t1), ('marshal',t1,t2), ('c_call',t2,t3), ('unmarshal',t3,t4)], nbytes, copied)
+        return CallResult(status, values)
+
+
+class StatusTable(object):
+    """Return codes of a NiftyRec or NiftyReg C library. The codes are queried once, at the first access
+    (the library is not loaded when the table is created). """
+    _names = ('success','io_error','initialisation_error','parameter_error','unhandled_error')
+
+    def __init__(self, library):
+        self.library = library
+
+    def __getattr__(self, name):
+        if name not in StatusTable._names:
+            raise AttributeError(name)
+        descriptor = [{'name':'return_value',  'type':'uint'}]
+        for code in StatusTable._names:
+            self.__dict__[code] = CallPlan(self.library, 'status_'+code, descriptor)().return_value
+        return self.__dict__[name]
+
+    def message(self, status):
+        """Human readable description of a return code. """
+        if status == self.io_error:
+            return "IO Error"
+        elif status == self.initialisation_error:
+            return "Error with the initialisation of the C library"
+        elif status == self.parameter_error:
+            return "One or more of the specified parameters are not right"
+        elif status == self.unhandled_error:
+            return "Unhandled error, likely a bug. "
+        return "Unspecified Error"
+
@@ -0,0 +1,183 @@
+
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Dec. 2013, Boston
+
+# Persistent cache of arrays that depend only on their inputs (e.g. sensitivity images, which depend on the
+# geometry, the attenuation and the psf). The key of an entry is a hash of the inputs; the arrays are stored
+# as .npy files and returned as read-only memory-mapped arrays, so that the processes that use the same entry
+# share one physical copy through the page cache. The size of the cache is bounded: when it exceeds max_bytes,
+# the least recently used entries are deleted. Files are written to a temporary name and renamed, hence
+# several processes can share a cache directory.
+# The cache is not active by default: activate it with set_disk_cache() or with the environment variable
+# NIFTYPY_CACHE_DIR.
+
+import os
+import hashlib
+import tempfile
+import threading
+import numpy
+
+__all__ = ['DiskCache','set_disk_cache','get_disk_cache']
+
+DEFAULT_MAX_BYTES = 4*1024**3
+
+
+def _update(digest, value):
+    # Feed a value (array, scalar, string, tuple/list, dict or None) to the hash, with its type and shape.
+    if isinstance(value, numpy.ndarray):
+        value = numpy.ascontiguousarray(value)
+        digest.update(("array%s%s"%(value.dtype.str,str(value.shape))).encode('ascii'))
+        digest.update(value.view(numpy.uint8).ravel())
+    elif isinstance(value, (tuple,list)):
+        digest.update(("seq%d"%len(value)).encode('ascii'))
+        for v in value:
+            _update(digest, v)
+    elif isinstance(value, dict):
+        digest.update(("dict%d"%len(value)).encode('ascii'))
+        for k in sorted(value.keys()):
+            _update(digest, k)
+            _update(digest, value[k])
+    else:
+        if isinstance(value, numpy.generic):
+            value = value.item()
+        digest.update(("%s:%r"%(type(value).__name__,value)).encode('utf-8'))
+
+
+def _read_only_view(array):
+    array = array.view()
+    array.flags.writeable = False
+    return array
+
+
+class DiskCache(object):
+    """Content-addressed cache of arrays in 'directory' (default: $NIFTYPY_CACHE_DIR or ~/.cache/niftypy),
+    bounded to max_bytes with least-recently-used eviction. """
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        if directory is None:
+            directory = os.environ.get('NIFTYPY_CACHE_DIR', os.path.join(os.path.expanduser('~'),'.cache','niftypy'))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits      = 0
+        self.misses    = 0
+        self._lock     = threading.Lock()
+
+    def key(self, *parts):
+        """Hash of the given inputs (arrays, scalars, strings and sequences of them). """
+        digest = hashlib.sha1()
+        _update(digest, parts)
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key+'.npy')
+
+    def get(self, key):
+        """Return the array stored under 'key', memory-mapped read-only, or None. """
+        path = self._path(key)
+        try:
+            array = numpy.load(path, mmap_mode='r')
+            os.utime(path, None)   # most recently used
+        except (IOError, OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return array
+
+    def put(self, key, array):
+        """Store 'array' under 'key'; returns the stored array, memory-mapped read-only. An array larger than
+        max_bytes is not stored: it is returned as a read-only view. """
+        array = numpy.asarray(array)
+        if array.nbytes > self.max_bytes:
+            return _read_only_view(array)
+        handle, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                numpy.save(f, array)
+            os.rename(temporary, self._path(key))
+        except:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self.evict(keep=self._path(key))
+        try:
+            return numpy.load(self._path(key), mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return _read_only_view(array)   # evicted meanwhile by another process
+
+    def get_or_compute(self, key, function):
+        """Return the array stored under 'key'; on a miss, compute it with function() and store it. """
+        array = self.get(key)
+        if array is None:
+            array = self.put(key, function())
+        return array
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                s = os.stat(path)
+            except OSError:
+                continue   # deleted by another process
+            entries.append((s.st_mtime, s.st_size, path))
+        return entries
+
+    def evict(self, keep=None):
+        """Delete the least recently used entries until the size of the cache is within max_bytes. The entry
+        at path 'keep' (e.g. the one just stored) is not deleted. """
+        entries = sorted(self._entries())
+        nbytes = sum([e[1] for e in entries])
+        for mtime, size, path in entries:
+            if nbytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            nbytes -= size
+
+    def clear(self):
+        """Delete all the entries. """
+        for mtime, size, path in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        entries = self._entries()
+        return {'directory':self.directory, 'entries':len(entries), 'nbytes':sum([e[1] for e in entries]),
+                'max_bytes':self.max_bytes, 'hits':self.hits, 'misses':self.misses}
+
+
+_cache = None
+if os.environ.get('NIFTYPY_CACHE_DIR'):
+    try:
+        _cache = DiskCache()
+    except (IOError, OSError):
+        _cache = None
+
+def set_disk_cache(cache):
+    """Activate a DiskCache for the cached functions (e.g. the sensitivity images); None deactivates it.
+    Returns the previous cache. """
+    global _cache
+    previous = _cache
+    _cache = cache
+    return previous
+
+def get_disk_cache():
+    """Return the active DiskCache (None if the disk cache is not active). """
+    return _cache
@@ -0,0 +1,124 @@
+
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Dec. 2013, Boston
+
+# Input contract of the C functions. Every array is passed to C by pointer, with the dtype and the memory order
+# declared in the call plan. normalize_array() passes through the arrays that already comply (including numpy.memmap
+# arrays, which are not read into memory) and converts the others. The conversions are counted per C function, so that
+# hidden copies can be found, and the converted copies of read-only arrays are cached: a read-only array cannot change,
+# hence e.g. the attenuation map or the psf are converted once and not at every iteration.
+
+import threading
+import weakref
+import numpy
+
+__all__ = ['normalize_array','copy_stats','reset_copy_stats','clear_layout_cache']
+
+
+_lock   = threading.Lock()
+_stats  = {}
+_cache  = {}
+
+
+def _complies(value, dtype, order):
+    if dtype is not None and value.dtype != dtype:
+        return False
+    if order == 'F':
+        return value.flags.f_contiguous
+    elif order == 'C':
+        return value.flags.c_contiguous
+    return True
+
+
+def _is_immutable(value):
+    # A read-only view of a writeable array can still change: every array in the chain of bases must be read-only.
+    while isinstance(value, numpy.ndarray):
+        if value.flags.writeable:
+            return False
+        value = value.base
+    return True
+
+
+def _signature(value):
+    # Identity of the memory seen by the array: if any of these changes, the cached copy is not valid.
+    return (value.__array_interface__['data'][0], value.shape, value.strides, value.dtype.str)
+
+
+def _convert(value, dtype, order):
+    if dtype is not None and value.dtype != dtype:
+        value = value.astype(dtype, order=order if order is not None else 'K')
+    if order == 'F' and not value.flags.f_contiguous:
+        value = numpy.asfortranarray(value)
+    elif order == 'C' and not value.flags.c_contiguous:
+        value = numpy.ascontiguousarray(value)
+    return value
+
+
+def _count(owner, nbytes, cached):
+    with _lock:
+        stats = _stats.get(owner)
+        if stats is None:
+            stats = _stats[owner] = {'copies':0, 'bytes_copied':0, 'cache_hits':0}
+        if cached:
+            stats['cache_hits'] += 1
+        else:
+            stats['copies'] += 1
+            stats['bytes_copied'] += nbytes
+
+
+def _forget(key):
+    with _lock:
+        _cache.pop(key, None)
+
+
+def normalize_array(value, dtype=None, order=None, owner=None):
+    """Return 'value' as an array with the given dtype and memory order ('C', 'F' or None for any order).
+    No copy is made if 'value' already complies. 'owner' is the name under which the conversion is counted. """
+    if not isinstance(value, numpy.ndarray):
+        # lists, tuples and scalars (e.g. the sizes built by the wrappers) are not counted as copies
+        return numpy.array(value, dtype=dtype, order=order if order is not None else 'K')
+    if _complies(value, dtype, order):
+        return value
+    if not _is_immutable(value):
+        # the content of a writeable array may change between calls: convert it every time
+        converted = _convert(value, dtype, order)
+        _count(owner, converted.nbytes, False)
+        return converted
+    key = id(value)
+    signature = _signature(value)
+    with _lock:
+        entry = _cache.get(key)
+    if entry is not None:
+        ref, entry_signature, entry_dtype, entry_order, converted = entry
+        if ref() is value and entry_signature == signature and entry_dtype == dtype and entry_order == order:
+            _count(owner, converted.nbytes, True)
+            return converted
+    converted = _convert(value, dtype, order)
+    converted.flags.writeable = False
+    ref = weakref.ref(value, lambda r, key=key: _forget(key))
+    with _lock:
+        _cache[key] = (ref, signature, dtype, order, converted)
+    _count(owner, converted.nbytes, False)
+    return converted
+
+
+def copy_stats():
+    """Conversions of the input arrays, per C function: number of copies, bytes copied and cache hits. """
+    with _lock:
+        return dict([(owner, dict(stats)) for owner, stats in _stats.items()])
+
+def reset_copy_stats():
+    """Reset the counters of copy_stats(). """
+    with _lock:
+        _stats.clear()
+
+def clear_layout_cache():
+    """Drop the cached conversions of read-only arrays. """
+    with _lock:
+        _cache.clear()
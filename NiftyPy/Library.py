@@ -0,0 +1,151 @@
+
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# Lazy loading of the NiftyRec and NiftyReg C libraries. The search of a library (the locations of the package
+# and the directories in LD_LIBRARY_PATH, DYLD_LIBRARY_PATH and PATH) is done at the first call to a C function,
+# not when NiftyPy is imported; the import succeeds when a library is missing (the NumPy engines stay usable
+# and the C functions raise LibraryNotFound). The path of the library that is found is stored on disk
+# (libraries.json in $NIFTYPY_CACHE_DIR or ~/.cache/niftypy), with the list of the searched directories and
+# the modification time of the library, so that the next processes load it without searching; the entry is
+# discarded when the library file changes or the search path changes.
+
+import os
+import json
+import hashlib
+import platform
+import tempfile
+import threading
+from simplewrap import find_c_library, load_c_library, NOT_FOUND, FOUND_NOT_LOADABLE
+
+__all__ = ['Library','library_path_cache']
+
+ENVIRONMENT = ['LD_LIBRARY_PATH','DYLD_LIBRARY_PATH','PATH']
+
+
+def library_path_cache():
+    """File of the resolved library paths. """
+    directory = os.environ.get('NIFTYPY_CACHE_DIR', os.path.join(os.path.expanduser('~'),'.cache','niftypy'))
+    return os.path.join(directory, 'libraries.json')
+
+def _read_cache(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+def _write_cache(filename, entries):
+    # Write to a temporary file and rename: concurrent processes never read a partial file. The cache is an
+    # optimization, failures are ignored.
+    try:
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        handle, temporary = tempfile.mkstemp(suffix='.tmp', dir=directory)
+        with os.fdopen(handle, 'w') as f:
+            json.dump(entries, f)
+        os.rename(temporary, filename)
+    except (IOError, OSError):
+        pass
+
+
+def _instructions(package):
+    print "1) Before launching Python, type the following in the terminal (the same terminal): "
+    path = "'path to the %s libraries'"%package.lower()
+    if platform.system()=='Linux':
+        print "export LD_LIBRARY_PATH=%s"%path
+    elif platform.system()=='Darwin':
+        print "export DYLD_LIBRARY_PATH=%s"%path
+    elif platform.system()=='Windows':
+        print "Add %s to the system PATH using Control Panel -> Advanced Settings -> System -> .."%path
+
+
+class Library(object):
+    """C library 'name' (e.g. '_et_array_interface' of 'NiftyRec'), searched in 'paths' and in the directories of the
+    environment variables, loaded at the first call of load(). """
+    def __init__(self, name, paths, package):
+        self.name = name
+        self.paths = list(paths)
+        self.package = package
+        self.fullpath = None
+        self._library = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def search_paths(self):
+        """Directories where the library is searched, in order. """
+        sep = ";" if platform.system()=='Windows' else ":"
+        paths = list(self.paths)
+        for variable in ENVIRONMENT:
+            if variable in os.environ:
+                paths = paths + os.environ[variable].split(sep)
+        return paths
+
+    def _key(self, paths):
+        return self.name + ':' + hashlib.sha1("\n".join(paths).encode('utf-8')).hexdigest()
+
+    def resolve(self):
+        """Full path of the library (None if it cannot be found), from the cache of the resolved paths if valid. """
+        paths = self.search_paths()
+        key = self._key(paths)
+        filename = library_path_cache()
+        entries = _read_cache(filename)
+        entry = entries.get(key)
+        if entry is not None:
+            try:
+                if os.path.getmtime(entry['path']) == entry['mtime']:
+                    return entry['path']
+            except (OSError, KeyError, TypeError):
+                pass
+        # find_c_library lists the content of the paths: skip the ones that do not exist
+        (found,fullpath,path) = find_c_library(self.name, [p for p in paths if os.path.isdir(p)])
+        if found == NOT_FOUND:
+            print "The library %s cannot be FOUND, please make sure that the path to the %s libraries has been exported. "%(self.name,self.package)
+            _instructions(self.package)
+            return None
+        elif found == FOUND_NOT_LOADABLE:
+            print "The library %s cannot be LOADED, please make sure that the path to the %s libraries has been exported. "%(fullpath,self.package)
+            _instructions(self.package)
+            return None
+        entries = _read_cache(filename)
+        entries[key] = {'path':fullpath, 'mtime':os.path.getmtime(fullpath)}
+        _write_cache(filename, entries)
+        return fullpath
+
+    def load(self):
+        """The ctypes library, loaded at the first call; None if it is not available. """
+        if self._loaded:
+            return self._library
+        with self._lock:
+            if not self._loaded:
+                self.fullpath = self.resolve()
+                if self.fullpath is not None:
+                    self._library = load_c_library(self.fullpath)
+                self._loaded = True
+        return self._library
+
+    def set_path(self, fullpath):
+        """Load the library from 'fullpath' instead of searching it (e.g. a stand-in for the benchmarks). Call it
+        before the first call to a C function of the library. """
+        with self._lock:
+            self.fullpath = fullpath
+            self._library = load_c_library(fullpath)
+            self._loaded = True
+        return self._library
+
+    def available(self):
+        """Whether the library can be loaded (loads it). """
+        return self.load() is not None
+
+    def __getitem__(self, function_name):
+        library = self.load()
+        if library is None:
+            raise KeyError(function_name)
+        return library[function_name]
@@ -0,0 +1,212 @@
+
+# NiftyRec - Ray-tracing tools
+# Stefano Pedemonte
+# Center for Medical Image Computing (CMIC), University College Lonson (UCL)
+# 2009-2012, London
+# Aalto University, School of Science
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH
+# Jan. 2014, Boston
+
+# NumPy implementation of the transmission (CT) projectors.
+#
+# Parallel-beam: same geometry as the SPECT parallel-holes projector. For each camera the attenuation
+# volume is rotated about its center and integrated along z; the projection has shape (Nx,Ny,N_cameras)
+# and holds the line integrals of the attenuation (in voxel units). Instead of looping over the rays,
+# the rotated volume is sampled in slabs of planes, for a batch of cameras at a time, so that the memory
+# is bounded by 'batch_voxels' whatever the size of the volume.
+# The backprojector is the exact adjoint of the projector.
+#
+# Cone-beam: ray-driven projector of the Joseph type. Coordinates are in voxels, with the origin at the center
+# of the volume. For view n the rays go from source_trajectory[n] (3 coordinates) to the pixels of a flat
+# detector. camera_trajectory[n] is either the center of the detector (3 coordinates; the detector is then
+# perpendicular to the line from the source to its center, its v axis is the projection of the z axis and
+# its pixels have size 'pixel_size') or the center followed by the u and v pixel vectors (9 coordinates).
+# Each ray is sampled once per plane along its dominant axis, with bilinear interpolation in the plane,
+# and each sample is weighted by the length of the ray between two planes. The rays of a view are
+# processed in batches of 'ray_batch' rays, so that no per-ray Python object is created.
+# The backprojector is the exact adjoint of the projector.
+
+import numpy
+from .Interpolation import affine_coordinates, trilinear_gather, trilinear_scatter
+from .SPECT_cpu import camera_rotations, BATCH_VOXELS
+
+__all__ = ['CT_project_parallelbeam_cpu','CT_backproject_parallelbeam_cpu','CT_project_conebeam_cpu','CT_backproject_conebeam_cpu']
+
+RAY_BATCH = 4096
+
+
+def _slabs(N_cameras, shape, batch_voxels):
+    # Batches of cameras and slabs of planes (along z) with at most batch_voxels samples each.
+    plane = int(shape[0]) * int(shape[1])
+    N_planes = max(1, int(batch_voxels) // max(1,plane))
+    if N_planes >= shape[2]:
+        batch = max(1, N_planes // max(1,int(shape[2])))
+        for start in range(0, N_cameras, batch):
+            yield start, min(start+batch, N_cameras), 0, int(shape[2])
+    else:
+        for start in range(N_cameras):
+            for z0 in range(0, int(shape[2]), N_planes):
+                yield start, start+1, z0, min(z0+N_planes, int(shape[2]))
+
+
+def _slab_coordinates(rotations, shape, z0, z1):
+    # Voxel indexes, in the unrotated volume, of the planes [z0,z1) of the rotated volumes:
+    # the rotated volume at p is the volume at R^T (p-c) + c, c the center of the volume.
+    center = (numpy.asarray(shape, dtype=numpy.float64) - 1) / 2.0
+    matrices = numpy.asarray([R.T for R in rotations], dtype=numpy.float32)
+    offsets  = numpy.asarray([center - numpy.dot(R.T, center) for R in rotations], dtype=numpy.float32)
+    return affine_coordinates((shape[0], shape[1], z1-z0), matrices, offsets + matrices[:,:,2]*z0)
+
+
+def CT_project_parallelbeam_cpu(attenuation, cameras, out=None, batch_voxels=BATCH_VOXELS):
+    """Transmission imaging projection; parallel-beam geometry; NumPy engine. 'cameras' has shape (N_cameras,1),
+    rotation about the x axis, or (N_cameras,3), rotations about x, y and z (radians). Returns the line integrals
+    of the attenuation, shape (Nx,Ny,N_cameras). 'batch_voxels' bounds the number of samples processed at once. """
+    attenuation = numpy.asarray(attenuation, dtype=numpy.float32)
+    shape = attenuation.shape
+    rotations = camera_rotations(cameras)
+    N_cameras = len(rotations)
+    if out is None:
+        out = numpy.zeros((shape[0],shape[1],N_cameras), dtype=numpy.float32, order="F")
+    else:
+        out[...] = 0
+    for start, stop, z0, z1 in _slabs(N_cameras, shape, batch_voxels):
+        coordinates = _slab_coordinates(rotations[start:stop], shape, z0, z1)
+        samples = trilinear_gather(attenuation, coordinates[0], coordinates[1], coordinates[2])
+        out[:,:,start:stop] += samples.sum(axis=3).transpose(1,2,0)
+    return out
+
+
+def CT_backproject_parallelbeam_cpu(projection, cameras, shape=None, out=None, batch_voxels=BATCH_VOXELS):
+    """Transmission imaging back-projection; parallel-beam geometry; NumPy engine. Adjoint of CT_project_parallelbeam_cpu.
+    The back-projection has the given shape (default (Nx,Ny,Nx)) and is accumulated in 'out', if given. """
+    projection = numpy.asarray(projection, dtype=numpy.float32)
+    if out is not None:
+        shape = out.shape
+    if shape is None:
+        shape = (projection.shape[0], projection.shape[1], projection.shape[0])
+    shape = tuple([int(s) for s in shape])
+    if (projection.shape[0],projection.shape[1]) != shape[0:2]:
+        raise ValueError("The projection (%dx%d) does not match the volume %s. "%(projection.shape[0],projection.shape[1],str(shape)))
+    rotations = camera_rotations(cameras)
+    N_cameras = len(rotations)
+    if projection.shape[2] != N_cameras:
+        raise ValueError("The projection has %d views but %d cameras were given. "%(projection.shape[2],N_cameras))
+    if out is None:
+        out = numpy.zeros(shape, dtype=numpy.float32, order="F")
+    for start, stop, z0, z1 in _slabs(N_cameras, shape, batch_voxels):
+        coordinates = _slab_coordinates(rotations[start:stop], shape, z0, z1)
+        samples = numpy.empty(coordinates[0].shape, dtype=numpy.float32)
+        samples[...] = projection[:,:,start:stop].transpose(2,0,1)[:,:,:,None]
+        trilinear_scatter(samples, coordinates[0], coordinates[1], coordinates[2], shape, out=out)
+    return out
+
+
+#### Cone-beam: ####
+
+def detector_geometry(camera_trajectory, source_trajectory, pixel_size=1.0):
+    """Sources, detector centers and pixel vectors u and v of the views, each an array of shape (N_views,3). """
+    sources = numpy.asarray(source_trajectory, dtype=numpy.float64).reshape((-1,3))
+    cameras = numpy.asarray(camera_trajectory, dtype=numpy.float64)
+    cameras = cameras.reshape((sources.shape[0],-1))
+    if cameras.shape[1] == 9:
+        return sources, cameras[:,0:3], cameras[:,3:6], cameras[:,6:9]
+    if cameras.shape[1] != 3:
+        raise ValueError("'camera_trajectory' must have shape (N_views,3) or (N_views,9), not %s. "%str(cameras.shape))
+    w = cameras - sources
+    w /= numpy.sqrt((w**2).sum(axis=1))[:,None]
+    u = numpy.cross(numpy.asarray([0.0,0.0,1.0]), w)
+    norm = numpy.sqrt((u**2).sum(axis=1))
+    # detector facing along z: take the x axis as reference instead
+    axial = norm < 1e-6
+    u[axial] = numpy.cross(numpy.asarray([1.0,0.0,0.0]), w[axial])
+    u /= numpy.sqrt((u**2).sum(axis=1))[:,None]
+    v = numpy.cross(w, u)
+    return sources, cameras, u*pixel_size, v*pixel_size
+
+
+def _ray_batches(detector_shape, ray_batch):
+    N_pixels = int(detector_shape[0]) * int(detector_shape[1])
+    for start in range(0, N_pixels, int(ray_batch)):
+        yield start, min(start+int(ray_batch), N_pixels)
+
+
+def _joseph_samples(source, center, u, v, detector_shape, shape, start, stop):
+    # For the rays of the pixels [start,stop) (Fortran order) of one view, yields per dominant axis:
+    # index of the rays in the batch, sample coordinates (3 arrays of shape (rays,planes)) and sample weights.
+    pixels = numpy.arange(start, stop)
+    iu = pixels % detector_shape[0] - (detector_shape[0]-1)/2.0
+    iv = pixels // detector_shape[0] - (detector_shape[1]-1)/2.0
+    targets = center[None,:] + iu[:,None]*u[None,:] + iv[:,None]*v[None,:]
+    directions = targets - source[None,:]
+    dominant = numpy.argmax(numpy.abs(directions), axis=1)
+    half = (numpy.asarray(shape, dtype=numpy.float64) - 1) / 2.0
+    for axis in range(3):
+        rays = numpy.nonzero(dominant == axis)[0]
+        if len(rays) == 0:
+            continue
+        d = directions[rays]
+        planes = numpy.arange(shape[axis], dtype=numpy.float64) - half[axis]
+        t = (planes[None,:] - source[axis]) / d[:,axis,None]
+        # only the segment between the source and the detector
+        inside = (t >= 0) & (t <= 1)
+        coordinates = [(source[k] + t*d[:,k,None] + half[k]).astype(numpy.float32) for k in range(3)]
+        length = numpy.sqrt((d**2).sum(axis=1)) / numpy.abs(d[:,axis])
+        weights = (inside * length[:,None]).astype(numpy.float32)
+        yield rays, coordinates, weights
+
+
+def CT_project_conebeam_cpu(attenuation, camera_trajectory, source_trajectory, detector_shape=None, pixel_size=1.0, out=None, ray_batch=RAY_BATCH):
+    """Transmission imaging projection; cone-beam geometry; NumPy engine. Returns the line integrals of the attenuation
+    (in voxel units) along the rays from the sources to the detector pixels, shape detector_shape+(N_views,).
+    'detector_shape' defaults to (max(Nx,Ny),Nz). 'ray_batch' is the number of rays processed at once. """
+    attenuation = numpy.asarray(attenuation, dtype=numpy.float32)
+    shape = attenuation.shape
+    if detector_shape is None:
+        detector_shape = (max(shape[0],shape[1]), shape[2])
+    detector_shape = (int(detector_shape[0]), int(detector_shape[1]))
+    sources, centers, us, vs = detector_geometry(camera_trajectory, source_trajectory, pixel_size)
+    N_views = sources.shape[0]
+    if out is None:
+        out = numpy.zeros(detector_shape+(N_views,), dtype=numpy.float32, order="F")
+    flat = out.reshape((detector_shape[0]*detector_shape[1],N_views), order="F")
+    for n in range(N_views):
+        for start, stop in _ray_batches(detector_shape, ray_batch):
+            values = numpy.zeros(stop-start, dtype=numpy.float32)
+            for rays, c, weights in _joseph_samples(sources[n], centers[n], us[n], vs[n], detector_shape, shape, start, stop):
+                values[rays] = (trilinear_gather(attenuation, c[0], c[1], c[2]) * weights).sum(axis=1)
+            flat[start:stop,n] = values
+    if not numpy.may_share_memory(flat, out):
+        out[...] = flat.reshape(out.shape, order="F")
+    return out
+
+
+def CT_backproject_conebeam_cpu(projection, camera_trajectory, source_trajectory, shape=None, pixel_size=1.0, out=None, ray_batch=RAY_BATCH):
+    """Transmission imaging back-projection; cone-beam geometry; NumPy engine. Adjoint of CT_project_conebeam_cpu.
+    The back-projection has the given shape (default (Nu,Nu,Nv)) and is accumulated in 'out', if given:
+    the views of a scan can be back-projected in several calls into the same volume. """
+    projection = numpy.asarray(projection, dtype=numpy.float32)
+    if projection.ndim == 2:
+        projection = projection[:,:,None]
+    detector_shape = projection.shape[0:2]
+    if out is not None:
+        shape = out.shape
+    if shape is None:
+        shape = (detector_shape[0], detector_shape[0], detector_shape[1])
+    shape = tuple([int(s) for s in shape])
+    sources, centers, us, vs = detector_geometry(camera_trajectory, source_trajectory, pixel_size)
+    N_views = sources.shape[0]
+    if projection.shape[2] != N_views:
+        raise ValueError("The projection has %d views but %d sources were given. "%(projection.shape[2],N_views))
+    if out is None:
+        out = numpy.zeros(shape, dtype=numpy.float32, order="F")
+    flat = projection.reshape((detector_shape[0]*detector_shape[1],N_views), order="F")
+    for n in range(N_views):
+        for start, stop in _ray_batches(detector_shape, ray_batch):
+            values = flat[start:stop,n]
+            if not numpy.any(values):
+                continue
+            for rays, c, weights in _joseph_samples(sources[n], centers[n], us[n], vs[n], detector_shape, shape, start, stop):
+                trilinear_scatter(weights * values[rays,None], c[0], c[1], c[2], shape, out=out)
+    return out
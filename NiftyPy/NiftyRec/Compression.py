@@ -0,0 +1,229 @@
+
+# NiftyRec - Ray-tracing tools
+# Stefano Pedemonte
+# Center for Medical Image Computing (CMIC), University College Lonson (UCL)
+# 2009-2012, London
+# Aalto University, School of Science
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH
+# Jan. 2014, Boston
+
+# NumPy implementation of the compression of PET projection data. The compressed data lists the bins of the
+# fully sampled projection at 'locations' (rows u and v), grouped by pair of angles; the bins of the pair
+# (azimuthal,axial) start at offsets[azimuthal,axial]. The fully sampled projection is a flat array of
+# N_axial*N_azimuthal*N_u*N_v bins, indexed as a C-ordered array of shape (N_axial,N_azimuthal,N_u,N_v).
+# Compression and uncompression are a gather and a scatter through the flat index of each location, which
+# is computed once per structure (CompressionIndex) and reused.
+# The fully sampled projection can also be produced block by block (one or more angle pairs at a time) by the
+# generators PET_uncompress_blocks and PET_uncompress_sinograms, which read the locations of each angle pair (a
+# contiguous range of the structure) without computing the index of the whole structure: the peak memory is one block.
+# scipy is optional: it is imported only by the conversions to and from scipy.sparse.
+
+import threading
+import weakref
+import numpy
+from numpy import float32
+from ..Buffers import output_array
+
+__all__ = ['CompressionIndex','compression_index','PET_compress_projection_cpu','PET_uncompress_projection_cpu',
+'PET_initialize_compression_structure_cpu','PET_compressed_to_sparse','PET_sparse_to_compressed',
+'PET_uncompress_blocks','PET_uncompress_sinograms','pair_ranges','location_chunks','chunk_structure']
+
+
+class CompressionIndex(object):
+    """Flat index, in the fully sampled projection, of each location of a compression structure (int32 when the
+    projection has fewer than 2**31 bins). The angle pair of a location is flat // (N_u*N_v), its bin in the
+    sinogram is flat % (N_u*N_v). """
+    def __init__(self, offsets, locations, N_u, N_v):
+        offsets = numpy.asarray(offsets)
+        self.N_azimuthal, self.N_axial = offsets.shape
+        self.N_u, self.N_v = int(N_u), int(N_v)
+        self.N_locations = locations.shape[1]
+        dtype = numpy.int32 if self.N_bins < 2**31 else numpy.int64
+        # angle pair (linear index azimuthal + N_azimuthal*axial, i.e. the row of the sinogram) of each location
+        first, stops = pair_ranges(offsets, self.N_locations)
+        order = numpy.argsort(first, kind='mergesort')
+        self.flat = numpy.repeat(order.astype(dtype), (stops - first)[order])
+        self.flat *= self.N_u * self.N_v
+        self.flat += numpy.asarray(locations[0], dtype=dtype) * self.N_v
+        self.flat += locations[1]
+        self.flat.flags.writeable = False
+
+    @property
+    def N_bins(self):
+        return self.N_axial * self.N_azimuthal * self.N_u * self.N_v
+
+    def rows_columns(self):
+        """Row (angle pair) and column (bin of the sinogram) of each location, in the (N_axial*N_azimuthal, N_u*N_v)
+        matrix of the sinograms. Not stored: computed at each call. """
+        N_bins = self.N_u * self.N_v
+        return self.flat // N_bins, self.flat % N_bins
+
+
+_lock  = threading.Lock()
+_cache = {}
+
+def _read_only(value):
+    while isinstance(value, numpy.ndarray):
+        if value.flags.writeable:
+            return False
+        value = value.base
+    return True
+
+def compression_index(offsets, locations, N_u, N_v):
+    """CompressionIndex of a structure. The index of read-only structures (e.g. those returned by
+    PET_initialize_compression_structure) is computed once and reused; for writeable structures, create a
+    CompressionIndex and pass it to the functions of this module. """
+    if not (_read_only(offsets) and _read_only(locations)):
+        return CompressionIndex(offsets, locations, N_u, N_v)
+    key = (id(offsets), id(locations), int(N_u), int(N_v))
+    with _lock:
+        entry = _cache.get(key)
+    if entry is not None and entry[0]() is offsets and entry[1]() is locations:
+        return entry[2]
+    index = CompressionIndex(offsets, locations, N_u, N_v)
+    forget = lambda r, key=key: _forget(key)
+    with _lock:
+        _cache[key] = (weakref.ref(offsets, forget), weakref.ref(locations, forget), index)
+    return index
+
+def _forget(key):
+    with _lock:
+        _cache.pop(key, None)
+
+
+def pair_ranges(offsets, N_locations):
+    """First location and end (exclusive) of the locations of each angle pair (linear index azimuthal +
+    N_azimuthal*axial): the locations of a pair are contiguous and the pairs are ordered by offset. """
+    first = numpy.ravel(numpy.asarray(offsets), order='F').astype(numpy.int64)
+    order = numpy.argsort(first, kind='mergesort')
+    stops = numpy.empty_like(first)
+    stops[order] = numpy.append(first[order][1:], N_locations)
+    return first, stops
+
+
+def location_chunks(offsets, N_locations, chunk_size):
+    """Ranges of locations [start,stop) of about chunk_size locations each, aligned to the angle pairs
+    (each range holds whole angle pairs, at least one). """
+    first = numpy.ravel(numpy.asarray(offsets), order='F').astype(numpy.int64)
+    boundaries = numpy.unique(numpy.append(first, N_locations))
+    start = 0
+    while start < N_locations:
+        k = numpy.searchsorted(boundaries, start+int(chunk_size), side='right') - 1
+        stop = int(boundaries[k])
+        if stop <= start:
+            stop = int(boundaries[numpy.searchsorted(boundaries, start, side='right')])
+        yield start, stop
+        start = stop
+
+
+def chunk_structure(offsets, locations, active, start, stop):
+    """Compression structure (offsets, locations, active) of the locations [start,stop) of a structure, for a range
+    returned by location_chunks: the offsets are relative to 'start' and the pairs out of the range are not active. """
+    offsets = numpy.asarray(offsets)
+    first = offsets.astype(numpy.int64)
+    if active is None:
+        active = numpy.ones(offsets.shape, dtype=numpy.int32)
+    inside = (first >= start) & (first < stop) & (numpy.asarray(active) != 0)
+    return (numpy.asfortranarray(numpy.clip(first - start, 0, stop-start), dtype=numpy.int32),
+            numpy.asfortranarray(locations[:,start:stop]),
+            numpy.asfortranarray(inside, dtype=numpy.int32))
+
+
+def PET_initialize_compression_structure_cpu(N_axial, N_azimuthal, N_u, N_v):
+    """'offsets' and 'locations' of fully sampled PET projection data; NumPy engine. """
+    N_bins = N_u * N_v
+    offsets = numpy.asfortranarray((numpy.arange(N_azimuthal)[:,None] + N_azimuthal*numpy.arange(N_axial)[None,:]) * N_bins, dtype=numpy.int32)
+    locations = numpy.zeros((3,N_bins*N_axial*N_azimuthal), dtype=numpy.uint16, order='F')
+    bins = numpy.arange(N_bins*N_axial*N_azimuthal) % N_bins
+    locations[0] = bins // N_v
+    locations[1] = bins % N_v
+    return [offsets, locations]
+
+
+def PET_compress_projection_cpu(offsets, data, locations, N_u, N_v, index=None, out=None):
+    """Compress fully sampled PET projection data (N_axial*N_azimuthal*N_u*N_v bins); NumPy engine. """
+    if index is None:
+        index = compression_index(offsets, locations, N_u, N_v)
+    data = numpy.asarray(data).reshape(-1)
+    if out is None:
+        out = numpy.empty((index.N_locations,), dtype=float32)
+    if data.dtype == float32:
+        numpy.take(data, index.flat, out=out)
+    else:
+        out[...] = data[index.flat]
+    return out
+
+
+def PET_uncompress_projection_cpu(offsets, data, locations, N_u, N_v, index=None, out=None):
+    """Uncompress PET projection data into the fully sampled projection (N_axial*N_azimuthal*N_u*N_v,); NumPy engine. """
+    if index is None:
+        index = compression_index(offsets, locations, N_u, N_v)
+    if out is not None and out.size != index.N_bins:
+        raise ValueError("'out' must have %d elements. "%index.N_bins)
+    # 'out' (any shape with N_bins elements) must be C-contiguous: the scatter writes through a flat view of it
+    out = output_array((index.N_bins,) if out is None else out.shape, float32, 'C', out)
+    out.reshape(-1)[index.flat] = numpy.asarray(data).reshape(-1)
+    return out
+
+
+def PET_compressed_to_sparse(offsets, data, locations, N_u, N_v, format='csr', index=None):
+    """Compressed projection data as a scipy.sparse matrix (format 'coo' or 'csr') of shape
+    (N_axial*N_azimuthal, N_u*N_v): row axial*N_azimuthal+azimuthal is the sinogram of an angle pair. """
+    import scipy.sparse
+    if index is None:
+        index = compression_index(offsets, locations, N_u, N_v)
+    shape = (index.N_axial*index.N_azimuthal, index.N_u*index.N_v)
+    matrix = scipy.sparse.coo_matrix((numpy.asarray(data, dtype=float32).reshape(-1), index.rows_columns()), shape=shape)
+    if format == 'coo':
+        return matrix
+    elif format == 'csr':
+        return matrix.tocsr()
+    raise ValueError("Unknown sparse format '%s': use 'coo' or 'csr'. "%format)
+
+
+def PET_sparse_to_compressed(matrix, offsets, locations, N_u, N_v, index=None):
+    """Values of a scipy.sparse matrix of shape (N_axial*N_azimuthal, N_u*N_v) at the locations of a compression
+    structure (entries that are not stored in the matrix are 0). """
+    if index is None:
+        index = compression_index(offsets, locations, N_u, N_v)
+    matrix = matrix.tocsr()
+    rows, columns = index.rows_columns()
+    return numpy.asarray(matrix[rows, columns], dtype=float32).reshape(-1)
+
+
+def PET_uncompress_blocks(offsets, data, locations, N_u, N_v, block_size=1, start=0, stop=None, reuse=False):
+    """Uncompress PET projection data block by block. Yields (first, block) where block, of shape (n,N_u,N_v), holds the
+    sinograms of the angle pairs [first, first+n) of the fully sampled projection (pair axial*N_azimuthal+azimuthal),
+    block_size pairs at a time, for the pairs [start, stop). With reuse=True the same array is filled at every
+    step (copy it to keep it); only the locations of the block are read from 'data' and 'locations', which can be
+    memmaps. The flat index of the whole structure is not computed: the peak memory is one block. """
+    offsets = numpy.asarray(offsets)
+    N_azimuthal, N_axial = offsets.shape
+    N_u, N_v = int(N_u), int(N_v)
+    firsts, stops = pair_ranges(offsets, locations.shape[1])
+    N_pairs = N_axial * N_azimuthal
+    if stop is None:
+        stop = N_pairs
+    if not 0 <= start <= stop <= N_pairs:
+        raise ValueError("The range of angle pairs must be within [0,%d], not [%d,%d]. "%(N_pairs,start,stop))
+    block = None
+    for first in range(start, stop, int(block_size)):
+        last = min(first+int(block_size), stop)
+        if block is None or not reuse or block.shape[0] != last-first:
+            block = numpy.zeros((last-first, N_u, N_v), dtype=float32)
+        else:
+            block[...] = 0
+        for pair in range(first, last):
+            a, b = firsts[pair], stops[pair]
+            if b > a:
+                sinogram = block[pair-first]
+                sinogram[locations[0,a:b], locations[1,a:b]] = data[a:b]
+        yield first, block
+
+
+def PET_uncompress_sinograms(offsets, data, locations, N_u, N_v, reuse=False):
+    """Uncompress PET projection data one angle pair at a time. Yields (azimuthal, axial, sinogram), sinogram of shape (N_u,N_v). """
+    N_azimuthal = numpy.asarray(offsets).shape[0]
+    for pair, block in PET_uncompress_blocks(offsets, data, locations, N_u, N_v, 1, reuse=reuse):
+        yield pair % N_azimuthal, pair // N_azimuthal, block[0]
@@ -0,0 +1,147 @@
+
+# NiftyRec - Ray-tracing tools
+# Stefano Pedemonte
+# Center for Medical Image Computing (CMIC), University College Lonson (UCL)
+# 2009-2012, London
+# Aalto University, School of Science
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH
+# Jan. 2014, Boston
+
+# Projection data stored in files (numpy.memmap), for studies that do not fit in memory. The projectors are
+# driven chunk by chunk: SPECT projections by ranges of cameras, compressed PET projections by ranges of
+# locations (aligned to the angle pairs). The chunks of a memory-mapped projection are contiguous, hence they
+# are passed to the projectors without copies and the projections are written straight into the file; the
+# backprojections of the chunks are accumulated in the output volume. The resident memory is bounded by one
+# chunk of projection data plus the volume.
+
+import numpy
+from numpy import float32
+from ..Layout import normalize_array
+from .Compression import location_chunks, chunk_structure
+from .NiftyRec import SPECT_project_parallelholes, SPECT_backproject_parallelholes, PET_project_compressed, PET_backproject_compressed
+
+__all__ = ['SPECT_projection_dataset','PET_compressed_dataset']
+
+
+class SPECT_projection_dataset(object):
+    """SPECT projection (Nx,Ny,N_cameras), float32 with Fortran order, stored in a file. 'mode' is the mode of
+    numpy.memmap ('r', 'r+' or 'w+' to create the file). """
+    def __init__(self, filename, shape, cameras, mode='r', attenuation=None, psf=None, background=0.0, background_attenuation=0.0,
+                 use_gpu=1, truncate_negative_values=0, chunk_size=16):
+        self.cameras = numpy.asfortranarray(cameras, dtype=float32)
+        if self.cameras.ndim == 1:
+            self.cameras = self.cameras.reshape((-1,1), order='F')
+        shape = tuple([int(n) for n in shape])
+        if len(shape) != 3 or shape[2] != self.cameras.shape[0]:
+            raise ValueError("The shape of the projection must be (Nx,Ny,N_cameras) with N_cameras=%d, not %s. "%(self.cameras.shape[0],str(shape)))
+        self.filename = filename
+        self.data = numpy.memmap(filename, dtype=float32, mode=mode, shape=shape, order='F')
+        if attenuation is not None:
+            attenuation = normalize_array(attenuation, float32, "F", 'SPECT_projection_dataset')
+        if psf is not None:
+            psf = normalize_array(psf, float32, "F", 'SPECT_projection_dataset')
+        self.attenuation = attenuation
+        self.psf = psf
+        self.background = background
+        self.background_attenuation = background_attenuation
+        self.use_gpu = use_gpu
+        self.truncate_negative_values = truncate_negative_values
+        self.chunk_size = chunk_size
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def chunks(self, chunk_size=None):
+        """Ranges of cameras [start,stop) processed at once. """
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        N_cameras = self.cameras.shape[0]
+        for start in range(0, N_cameras, int(chunk_size)):
+            yield start, min(start+int(chunk_size), N_cameras)
+
+    def project(self, activity, chunk_size=None):
+        """Project 'activity' into the file, chunk by chunk. """
+        for start, stop in self.chunks(chunk_size):
+            SPECT_project_parallelholes(activity, self.cameras[start:stop], self.attenuation, self.psf, self.background, self.background_attenuation,
+                                        self.use_gpu, self.truncate_negative_values, out=self.data[:,:,start:stop])
+        self.data.flush()
+        return self.data
+
+    def backproject(self, out=None, chunk_size=None, projection=None):
+        """Backproject the projection in the file (or 'projection', e.g. another dataset with the same geometry),
+        chunk by chunk; the result is written in 'out' (e.g. a memmap), if given. """
+        if projection is None:
+            projection = self.data
+        shape = (self.shape[0], self.shape[1], self.shape[0])
+        if out is None:
+            out = numpy.zeros(shape, dtype=float32, order="F")
+        else:
+            out[...] = 0
+        chunk = numpy.zeros(shape, dtype=float32, order="F")
+        for start, stop in self.chunks(chunk_size):
+            SPECT_backproject_parallelholes(projection[:,:,start:stop], self.cameras[start:stop], self.attenuation, self.psf, self.background,
+                                            self.background_attenuation, self.use_gpu, self.truncate_negative_values, out=chunk)
+            out += chunk
+        return out
+
+
+class PET_compressed_dataset(object):
+    """Compressed PET projection (N_locations,), float32, stored in a file. 'parameters' are the keyword arguments
+    of PET_project_compressed other than activity and out (offsets=.., locations=.., active=.., N_axial=.., ..).
+    'mode' is the mode of numpy.memmap ('r', 'r+' or 'w+' to create the file). The chunks hold whole angle pairs,
+    about chunk_size locations each. """
+    def __init__(self, filename, activity_shape, mode='r', chunk_size=2**20, **parameters):
+        self.activity_shape = tuple([int(n) for n in activity_shape])
+        self.parameters = parameters
+        self.offsets = numpy.asarray(parameters['offsets'])
+        self.locations = parameters['locations']
+        active = parameters.get('active')
+        if active is None:
+            active = numpy.ones(self.offsets.shape, dtype=numpy.int32)
+        self.active = numpy.asarray(active)
+        self.N_locations = self.locations.shape[1]
+        self.filename = filename
+        self.data = numpy.memmap(filename, dtype=float32, mode=mode, shape=(self.N_locations,))
+        self.chunk_size = chunk_size
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def chunks(self, chunk_size=None):
+        """Ranges of locations [start,stop) processed at once; each range holds whole angle pairs. """
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        return location_chunks(self.offsets, self.N_locations, chunk_size)
+
+    def _chunk_parameters(self, start, stop):
+        parameters = dict(self.parameters)
+        parameters['offsets'], parameters['locations'], parameters['active'] = chunk_structure(self.offsets, self.locations, self.active, start, stop)
+        return parameters
+
+    def project(self, activity, chunk_size=None):
+        """Project 'activity' into the file, chunk by chunk. """
+        for start, stop in self.chunks(chunk_size):
+            PET_project_compressed(activity, out=self.data[start:stop], **self._chunk_parameters(start, stop))
+        self.data.flush()
+        return self.data
+
+    def backproject(self, out=None, chunk_size=None, projection=None):
+        """Backproject the projection in the file (or 'projection', with the same structure), chunk by chunk;
+        the result is written in 'out' (e.g. a memmap), if given. """
+        if projection is None:
+            projection = self.data
+        if out is None:
+            out = numpy.zeros(self.activity_shape, dtype=float32, order="F")
+        else:
+            out[...] = 0
+        chunk = numpy.zeros(self.activity_shape, dtype=float32, order="F")
+        N_x, N_y, N_z = self.activity_shape
+        for start, stop in self.chunks(chunk_size):
+            parameters = self._chunk_parameters(start, stop)
+            parameters.pop('truncate_negative_values', None)
+            PET_backproject_compressed(projection[start:stop], N_activity_x=N_x, N_activity_y=N_y, N_activity_z=N_z, out=chunk, **parameters)
+            out += chunk
+        return out
@@ -0,0 +1,89 @@
+
+# NiftyRec - Ray-tracing tools
+# Stefano Pedemonte
+# Center for Medical Image Computing (CMIC), University College Lonson (UCL)
+# 2009-2012, London
+# Aalto University, School of Science
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH
+# Jan. 2014, Boston
+
+# Management of the GPUs. The GPUs are enumerated once and the list is cached until gpu_reset. The selection of
+# the GPU in the NiftyRec library (CUDA runtime) applies to the calling host thread: the manager records the
+# device selected by each thread, so that a thread selects a device once (bind, e.g. the workers of a Scheduler)
+# and the scoped selections (use) restore the previous device of the thread, without affecting other threads.
+
+import threading
+from contextlib import contextmanager
+
+__all__ = ['DeviceManager']
+
+
+class DeviceManager(object):
+    """GPUs of the NiftyRec library. 'enumerate' returns the list of the GPUs (dictionaries with key 'id'), 'select'
+    selects a GPU by id in the calling thread and 'reset' resets the GPU of the calling thread. 'error' is the exception
+    raised for unknown ids. 'default' is the GPU of a thread that has not selected one (0 in the CUDA runtime). """
+    def __init__(self, enumerate, select, reset, error=ValueError, default=0):
+        self._enumerate = enumerate
+        self._select = select
+        self._reset = reset
+        self._error = error
+        self.default = default
+        self._gpus = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def list(self, refresh=False):
+        """List of the GPUs, enumerated at the first call (or with refresh=True). """
+        with self._lock:
+            if self._gpus is None or refresh:
+                self._gpus = self._enumerate()
+            return [dict(gpu) for gpu in self._gpus]
+
+    def exists(self, gpu_id):
+        return gpu_id in [gpu['id'] for gpu in self.list()]
+
+    def current(self):
+        """GPU selected by the calling thread (None if the thread has not selected one). """
+        return getattr(self._local, 'device', None)
+
+    def select(self, gpu_id):
+        """Select the GPU of the calling thread; the library is called only if the selection changes. """
+        if self.current() == gpu_id:
+            return
+        gpus = self.list()
+        if gpu_id not in [gpu['id'] for gpu in gpus]:
+            raise self._error("The execution of 'gpu_set' was unsuccessful - the requested GPU ID does not exist. The following GPUs have been found: %s"%str(gpus))
+        self._select(gpu_id)
+        self._local.device = gpu_id
+
+    def bind(self, gpu_id):
+        """Select the GPU of the calling thread for the lifetime of the thread (e.g. a worker). """
+        self.select(gpu_id)
+        self._local.bound = gpu_id
+
+    def bound(self):
+        """GPU bound to the calling thread (None if none). """
+        return getattr(self._local, 'bound', None)
+
+    @contextmanager
+    def use(self, gpu_id):
+        """Context manager: select the GPU in the calling thread, then restore the previous selection (the default
+        GPU if the thread had not selected one). """
+        previous = self.current()
+        if previous is None:
+            previous = self.default
+        self.select(gpu_id)
+        try:
+            yield gpu_id
+        finally:
+            self.select(previous)
+
+    def reset(self):
+        """Reset the GPU of the calling thread and forget the enumeration. """
+        try:
+            self._reset()
+        finally:
+            self._local.device = None
+            with self._lock:
+                self._gpus = None
@@ -0,0 +1,144 @@
+
+# NiftyRec - Ray-tracing tools
+# Stefano Pedemonte
+# Center for Medical Image Computing (CMIC), University College Lonson (UCL)
+# 2009-2012, London
+# Aalto University, School of Science
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH
+# Jan. 2014, Boston
+
+# Trilinear interpolation of 3D volumes at arbitrary locations (gather) and its exact adjoint (scatter),
+# used by the NumPy projectors. Volumes are indexed [x,y,z] and locations are expressed in voxel indexes.
+# The scatter uses the same weights as the gather, hence a projector built on trilinear_gather and its
+# backprojector built on trilinear_scatter are adjoint to each other up to rounding errors.
+# A stack of volumes (Nx,Ny,Nz,N_frames) is interpolated at once: the interpolation weights and the
+# indexes of the neighbours are computed once and shared by all the frames.
+# The scatter of a few samples (a batch of rays) updates only the voxels they touch, in place; the scatter of
+# samples that cover the volume (a rotated volume) runs one bincount over the volume per corner of the cell.
+
+import numpy
+
+__all__ = ['rotation_matrix','affine_coordinates','trilinear_gather','trilinear_scatter']
+
+
+def rotation_matrix(theta_x, theta_y=0.0, theta_z=0.0):
+    """Rotation matrix Rz(theta_z) * Ry(theta_y) * Rx(theta_x). Angles in radians. """
+    cx, sx = numpy.cos(theta_x), numpy.sin(theta_x)
+    cy, sy = numpy.cos(theta_y), numpy.sin(theta_y)
+    cz, sz = numpy.cos(theta_z), numpy.sin(theta_z)
+    Rx = numpy.asarray([[1,0,0],[0,cx,-sx],[0,sx,cx]])
+    Ry = numpy.asarray([[cy,0,sy],[0,1,0],[-sy,0,cy]])
+    Rz = numpy.asarray([[cz,-sz,0],[sz,cz,0],[0,0,1]])
+    return numpy.dot(Rz, numpy.dot(Ry, Rx))
+
+
+def affine_coordinates(shape, matrices, offsets):
+    """Locations matrices[b].dot(p) + offsets[b] of the voxels p of a grid of the given shape, for a batch of
+    affine transformations ('matrices' has shape (B,3,3), 'offsets' has shape (B,3)).
+    Returns three float32 arrays of shape (B,)+shape. """
+    matrices = numpy.asarray(matrices, dtype=numpy.float32)
+    offsets  = numpy.asarray(offsets, dtype=numpy.float32)
+    x = numpy.arange(shape[0], dtype=numpy.float32)[None,:,None,None]
+    y = numpy.arange(shape[1], dtype=numpy.float32)[None,None,:,None]
+    z = numpy.arange(shape[2], dtype=numpy.float32)[None,None,None,:]
+    coordinates = []
+    for k in range(3):
+        m = matrices[:,k,:]
+        coordinates.append( offsets[:,k,None,None,None] + m[:,0,None,None,None]*x + m[:,1,None,None,None]*y + m[:,2,None,None,None]*z )
+    return coordinates
+
+
+def _corners(shape, sx, sy, sz):
+    # Yields, for each of the 8 corners of the interpolation cell: flat (Fortran order) index, weight, inside mask.
+    nx, ny, nz = shape
+    x0 = numpy.floor(sx); fx = sx - x0; x0 = x0.astype(numpy.intp)
+    y0 = numpy.floor(sy); fy = sy - y0; y0 = y0.astype(numpy.intp)
+    z0 = numpy.floor(sz); fz = sz - z0; z0 = z0.astype(numpy.intp)
+    for dx in (0,1):
+        xi = x0 + dx
+        wx = fx if dx else 1.0 - fx
+        in_x = (xi >= 0) & (xi < nx)
+        for dy in (0,1):
+            yi = y0 + dy
+            wxy = wx * (fy if dy else 1.0 - fy)
+            in_xy = in_x & (yi >= 0) & (yi < ny)
+            for dz in (0,1):
+                zi = z0 + dz
+                w = wxy * (fz if dz else 1.0 - fz)
+                inside = in_xy & (zi >= 0) & (zi < nz)
+                index = xi + nx*(yi + ny*zi)
+                index[~inside] = 0
+                yield index, w, inside
+
+
+def trilinear_gather(volume, sx, sy, sz, background=0.0):
+    """Values of 'volume' at the locations (sx,sy,sz), by trilinear interpolation. Neighbours outside of
+    the volume take the value 'background'. The result has the shape of sx and dtype float32.
+    If 'volume' is a stack (Nx,Ny,Nz,N_frames), the result has shape (N_frames,)+sx.shape. """
+    if volume.ndim == 4:
+        N = volume.shape[0] * volume.shape[1] * volume.shape[2]
+        flat = volume.reshape((N,volume.shape[3]), order='F').T
+        result = numpy.zeros((volume.shape[3],)+sx.shape, dtype=numpy.float32)
+    else:
+        flat = numpy.ravel(volume, order='F')
+        result = numpy.zeros(sx.shape, dtype=numpy.float32)
+    for index, w, inside in _corners(volume.shape[0:3], sx, sy, sz):
+        values = flat[...,index]
+        if background:
+            values = numpy.where(inside, values, numpy.float32(background))
+        else:
+            values = values * inside
+        result += w * values
+    return result
+
+
+def trilinear_scatter(values, sx, sy, sz, shape, out=None):
+    """Adjoint of trilinear_gather (with background=0): distribute 'values', defined at the locations (sx,sy,sz),
+    to the voxels of a volume of the given shape. The result is accumulated in 'out' (Fortran order) if given.
+    If 'shape' is (Nx,Ny,Nz,N_frames), 'values' has shape (N_frames,)+sx.shape and the result is a stack. """
+    N = int(shape[0]) * int(shape[1]) * int(shape[2])
+    N_frames = int(shape[3]) if len(shape) == 4 else 1
+    frames = (numpy.arange(N_frames) * N).reshape((N_frames,)+(1,)*sx.ndim)
+    if out is None:
+        out = numpy.zeros(tuple(shape), dtype=numpy.float32, order="F")
+    if sx.size >= N:
+        # dense: the samples cover the volume, one pass of bincount over the volume per corner
+        accumulator = numpy.zeros(N*N_frames, dtype=numpy.float64)
+        for index, w, inside in _corners(shape[0:3], sx, sy, sz):
+            weights = (w*values).reshape((N_frames,)+sx.shape)[:,inside]
+            index = (index[None] + frames)[:,inside]
+            accumulator += numpy.bincount(index.ravel(), weights=weights.ravel(), minlength=N*N_frames)
+        out += accumulator.reshape(tuple(shape), order='F')
+        return out
+    # sparse (e.g. a batch of rays): the samples are grouped by interpolation cell (one sort), the weights of each
+    # corner are summed per cell and only the voxels of the touched cells are updated, in place
+    flat = out.reshape(-1, order='F') if out.flags.f_contiguous else numpy.zeros(N*N_frames, dtype=numpy.float64)
+    nx, ny, nz = [int(n) for n in shape[0:3]]
+    x0 = numpy.floor(sx); fx = sx - x0; x0 = x0.astype(numpy.intp)
+    y0 = numpy.floor(sy); fy = sy - y0; y0 = y0.astype(numpy.intp)
+    z0 = numpy.floor(sz); fz = sz - z0; z0 = z0.astype(numpy.intp)
+    # cells with at least one corner in the volume, indexed in the grid of cells [-1,n) along each axis
+    seen = (x0 >= -1) & (x0 < nx) & (y0 >= -1) & (y0 < ny) & (z0 >= -1) & (z0 < nz)
+    cell = (x0[seen]+1) + (nx+1)*((y0[seen]+1) + (ny+1)*(z0[seen]+1))
+    N_cells = (nx+1)*(ny+1)*(nz+1)
+    cells, inverse = numpy.unique((cell[None] + numpy.arange(N_frames)[:,None]*N_cells).ravel(), return_inverse=True)
+    values = values.reshape((N_frames,)+sx.shape)[:,seen].ravel()
+    fx, fy, fz = [numpy.tile(f[seen], N_frames) for f in (fx, fy, fz)]
+    cx = cells % (nx+1) - 1
+    cy = (cells // (nx+1)) % (ny+1) - 1
+    cz = (cells // ((nx+1)*(ny+1))) % (nz+1) - 1
+    frame = cells // N_cells
+    for dx in (0,1):
+        wx = fx if dx else 1.0 - fx
+        for dy in (0,1):
+            wxy = wx * (fy if dy else 1.0 - fy)
+            for dz in (0,1):
+                w = wxy * (fz if dz else 1.0 - fz)
+                xi, yi, zi = cx + dx, cy + dy, cz + dz
+                inside = (xi >= 0) & (xi < nx) & (yi >= 0) & (yi < ny) & (zi >= 0) & (zi < nz)
+                sums = numpy.bincount(inverse, weights=w*values, minlength=len(cells))
+                flat[(xi + nx*(yi + ny*zi) + N*frame)[inside]] += sums[inside]
+    if not out.flags.f_contiguous:
+        out += flat.reshape(tuple(shape), order='F')
+    return out
@@ -0,0 +1,157 @@
+
+# NiftyRec - Ray-tracing tools
+# Stefano Pedemonte
+# Center for Medical Image Computing (CMIC), University College Lonson (UCL)
+# 2009-2012, London
+# Aalto University, School of Science
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH
+# Jan. 2014, Boston
+
+# Ingestion of list-mode PET events into the compressed projection format. The events are read from a binary
+# file in chunks of records (numpy structured dtype); a binning function maps each chunk to the flat index of
+# the bins in the fully sampled projection (see Compression.py) and the counts are accumulated at the locations
+# of the compression structure with numpy.bincount over the locations touched by each chunk. The fully sampled
+# projection is never created: the flat index of a bin is mapped to its location with a binary search in the
+# sorted flat indexes of the locations (12 bytes per location). A lookup table (int32, one entry per bin of the
+# fully sampled projection) is faster but is as large as the fully sampled projection: it is used only for dense
+# structures, with at most LOOKUP_MAX_RATIO bins per location, where it is no larger than the sorted index.
+# Events in bins that are not listed in the structure are counted as dropped.
+
+import numpy
+from numpy import float32
+from .Compression import compression_index
+
+__all__ = ['LISTMODE_BINNED','LISTMODE_CRYSTALS','binned_events','RingScannerBinning','ListModeIngester']
+
+LOOKUP_MAX_RATIO = 3
+
+# Events that carry the coordinates of their bin.
+LISTMODE_BINNED = numpy.dtype([('azimuthal','<u2'),('axial','<u2'),('u','<u2'),('v','<u2')])
+# Events that carry the two crystals of the coincidence (index of the crystal in the ring and index of the ring).
+LISTMODE_CRYSTALS = numpy.dtype([('crystal_1','<u2'),('ring_1','<u2'),('crystal_2','<u2'),('ring_2','<u2')])
+
+
+def binned_events(events, N_axial, N_azimuthal, N_u, N_v):
+    """Binning function of the events of type LISTMODE_BINNED: flat index of the bins, -1 for invalid events. """
+    azimuthal = events['azimuthal'].astype(numpy.int64)
+    axial = events['axial'].astype(numpy.int64)
+    u = events['u'].astype(numpy.int64)
+    v = events['v'].astype(numpy.int64)
+    flat = ((axial*N_azimuthal + azimuthal)*N_u + u)*N_v + v
+    valid = (azimuthal < N_azimuthal) & (axial < N_axial) & (u < N_u) & (v < N_v)
+    flat[~valid] = -1
+    return flat
+
+
+class RingScannerBinning(object):
+    """Binning function of the events of type LISTMODE_CRYSTALS, for a cylindrical scanner of N_rings rings of
+    N_crystals crystals. The azimuthal bin is the direction of the line of response in [0,pi), the u bin its signed
+    distance from the axis (N_u bins across the diameter), the axial bin the ring difference (N_axial bins centered
+    on 0; larger differences are dropped) and the v bin the mean ring position (N_v bins along the scanner). """
+    def __init__(self, N_crystals, N_rings):
+        self.N_crystals = N_crystals
+        self.N_rings = N_rings
+
+    def __call__(self, events, N_axial, N_azimuthal, N_u, N_v):
+        theta_1 = events['crystal_1'] * (2*numpy.pi/self.N_crystals)
+        theta_2 = events['crystal_2'] * (2*numpy.pi/self.N_crystals)
+        ring_1 = events['ring_1'].astype(numpy.int64)
+        ring_2 = events['ring_2'].astype(numpy.int64)
+        phi = (theta_1 + theta_2) / 2 + numpy.pi/2
+        s = numpy.cos((theta_2 - theta_1) / 2)
+        # directions in [0,pi): the opposite direction has opposite distance and ring difference
+        turns = numpy.floor(phi / numpy.pi)
+        phi -= turns * numpy.pi
+        flip = (turns.astype(numpy.int64) % 2) == 1
+        s[flip] = -s[flip]
+        difference = ring_2 - ring_1
+        difference[flip] = -difference[flip]
+        azimuthal = numpy.minimum((phi * (N_azimuthal/numpy.pi)).astype(numpy.int64), N_azimuthal-1)
+        u = numpy.minimum(((s + 1) * (N_u/2.0)).astype(numpy.int64), N_u-1)
+        axial = difference + (N_axial-1)//2
+        v = ((ring_1 + ring_2) * N_v) // (2*self.N_rings)
+        flat = ((axial*N_azimuthal + azimuthal)*N_u + u)*N_v + v
+        valid = (axial >= 0) & (axial < N_axial) & (v >= 0) & (v < N_v) & (events['crystal_1'] != events['crystal_2'])
+        flat[~valid] = -1
+        return flat
+
+
+class ListModeIngester(object):
+    """Accumulate list-mode events into compressed PET projection data with the structure (offsets, locations).
+    'binning' maps a chunk of events to the flat index of their bins (default: binned_events, for LISTMODE_BINNED
+    records); 'dtype' is the type of the records in the file. """
+    def __init__(self, offsets, locations, N_u, N_v, binning=binned_events, dtype=LISTMODE_BINNED, chunk_events=2**22):
+        self.index = compression_index(offsets, locations, N_u, N_v)
+        self.binning = binning
+        self.dtype = numpy.dtype(dtype)
+        self.chunk_events = int(chunk_events)
+        self.events = 0
+        self.dropped = 0
+        flat = self.index.flat
+        if self.index.N_bins <= LOOKUP_MAX_RATIO * self.index.N_locations:
+            self._lookup = numpy.empty((self.index.N_bins,), dtype=numpy.int32)
+            self._lookup.fill(-1)
+            self._lookup[flat] = numpy.arange(len(flat), dtype=numpy.int32)
+            self._sorted = None
+        else:
+            self._lookup = None
+            self._order = numpy.argsort(flat, kind='mergesort')
+            self._sorted = flat[self._order]
+
+    @property
+    def N_locations(self):
+        return self.index.N_locations
+
+    def _locations(self, flat):
+        # location of each bin, -1 if the bin is not in the structure (or the event is not valid)
+        valid = flat >= 0
+        if self._lookup is not None:
+            result = numpy.empty(flat.shape, dtype=numpy.int64)
+            result.fill(-1)
+            result[valid] = self._lookup[flat[valid]]
+            return result
+        position = numpy.searchsorted(self._sorted, flat)
+        position = numpy.minimum(position, len(self._sorted)-1)
+        found = valid & (self._sorted[position] == flat)
+        result = numpy.empty(flat.shape, dtype=numpy.int64)
+        result.fill(-1)
+        result[found] = self._order[position[found]]
+        return result
+
+    def add(self, events, out, weights=None):
+        """Accumulate a chunk of events (array of records) in 'out' (N_locations,). 'weights' (optional) weights each event. """
+        flat = self.binning(events, self.index.N_axial, self.index.N_azimuthal, self.index.N_u, self.index.N_v)
+        locations = self._locations(flat)
+        listed = locations >= 0
+        if weights is not None:
+            weights = numpy.asarray(weights)[listed]
+        # counts of the bins touched by the chunk only: the cost does not depend on the size of the structure
+        touched, inverse = numpy.unique(locations[listed], return_inverse=True)
+        out[touched] += numpy.bincount(inverse, weights=weights, minlength=len(touched))
+        self.events += len(events)
+        self.dropped += len(events) - int(numpy.count_nonzero(listed))
+        return out
+
+    def chunks(self, filename, start=0, count=None):
+        """Read the events of a file in chunks; 'start' and 'count' select a range of events. """
+        with open(filename, 'rb') as f:
+            f.seek(start * self.dtype.itemsize)
+            remaining = count
+            while remaining is None or remaining > 0:
+                n = self.chunk_events if remaining is None else min(self.chunk_events, remaining)
+                events = numpy.fromfile(f, dtype=self.dtype, count=n)
+                if len(events) == 0:
+                    break
+                if remaining is not None:
+                    remaining -= len(events)
+                yield events
+
+    def ingest(self, filename, out=None, start=0, count=None):
+        """Accumulate the events of a file (or the range [start,start+count) of events) in 'out', if given, else in
+        a new compressed projection. Returns the compressed projection. """
+        if out is None:
+            out = numpy.zeros((self.N_locations,), dtype=float32)
+        for events in self.chunks(filename, start, count):
+            self.add(events, out)
+        return out
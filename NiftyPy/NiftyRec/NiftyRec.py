@@ -9,16 +9,30 @@
 # Jan. 2014, Boston
 
 from simplewrap import *
+from ..CallPlan import CallPlan, StatusTable, LibraryNotFound
+from ..Library import Library
+from ..Buffers import output_array
+from ..Layout import normalize_array
+from ..DiskCache import get_disk_cache
+from .Devices import DeviceManager
+from .SPECT_cpu import SPECT_project_parallelholes_cpu, SPECT_backproject_parallelholes_cpu
+from .PET_cpu import PET_project_compressed_cpu, PET_backproject_compressed_cpu
+from .Compression import PET_compress_projection_cpu, PET_uncompress_projection_cpu, PET_initialize_compression_structure_cpu
+from .TR_cpu import TR_resample_grid_cpu
+from .CT_cpu import CT_project_parallelbeam_cpu, CT_backproject_parallelbeam_cpu, CT_project_conebeam_cpu, CT_backproject_conebeam_cpu, RAY_BATCH
 import numpy
 import os, platform
+import threading
+import atexit
 
-__all__ = ['test_library_niftyrec_c','gpu_set','gpu_reset','gpu_list','gpu_exists',
+__all__ = ['test_library_niftyrec_c','gpu_set','gpu_reset','gpu_list','gpu_exists','gpu_use','gpu_bind','devices',
 'PET_project','PET_backproject','PET_project_compressed','PET_backproject_compressed',
-'PET_compress_projection','PET_uncompress_projection','PET_initialize_compression_structure',
-'SPECT_project_parallelholes','SPECT_backproject_parallelholes',
+'PET_compress_projection','PET_uncompress_projection','PET_initialize_compression_structure','PET_project_compressed_cpu','PET_backproject_compressed_cpu',
+'SPECT_project_parallelholes','SPECT_backproject_parallelholes','SPECT_project_parallelholes_cpu','SPECT_backproject_parallelholes_cpu','set_cpu_engine',
+'set_cpu_threads',
 'CT_project_conebeam','CT_backproject_conebeam','CT_project_parallelbeam','CT_backproject_parallelbeam',
 'ET_spherical_phantom','ET_cylindrical_phantom','ET_spheres_ring_phantom', 
-'TR_grid_from_box_and_affine', 'TR_resample_grid', 'TR_resample_box', 'TR_gradient_grid', 'TR_gradient_box', 'TR_transform_grid',
+'TR_grid_from_box_and_affine', 'TR_resample_grid', 'TR_resample_grid_cpu', 'TR_resample_box', 'TR_gradient_grid', 'TR_gradient_box', 'TR_transform_grid',
  'INTERPOLATION_LINEAR','INTERPOLATION_POINT'] 
 
 library_name = "_et_array_interface"
@@ -27,6 +41,14 @@ niftyrec_lib_paths = [localpath(), filepath(__file__), './', '/usr/local/niftyre
 INTERPOLATION_LINEAR = 0
 INTERPOLATION_POINT  = 1
 
+# Engine of the projectors when use_gpu=0: the C library or NumPy. The NumPy engine is also used, with use_gpu=0, when the C library is
+# not available; with use_gpu=1 the C library is required (LibraryNotFound is raised if it is not available). 
+CPU_ENGINE_C     = "C"
+CPU_ENGINE_NUMPY = "numpy"
+cpu_engine = CPU_ENGINE_C
+# Thread pool of the projectors when use_gpu=0 (see set_cpu_threads); None: the projectors run in the calling thread. 
+cpu_threads = None
+
 
 ####################################### Error handling: ########################################
 
@@ -35,16 +57,7 @@ class ErrorInCFunction(Exception):
         self.msg = str(msg) 
         self.status = status
         self.function_name = function_name
-        if self.status == status_io_error(): 
-            self.status_msg = "IO Error"
-        elif self.status == status_initialisation_error(): 
-            self.status_msg = "Error with the initialisation of the C library"
-        elif self.status == status_parameter_error(): 
-            self.status_msg = "One or more of the specified parameters are not right"
-        elif self.status == status_unhandled_error(): 
-            self.status_msg = "Unhandled error, likely a bug. "
-        else: 
-            self.status_msg = "Unspecified Error"
+        self.status_msg = status_codes.message(self.status) 
     def __str__(self): 
         return "'%s' returned by the C Function '%s' (error code %d). %s"%(self.status_msg,self.function_name,self.status,self.msg)
 
@@ -57,640 +70,839 @@ class ErrorGPU(Exception):
 
 def status_success(): 
     """Returns the value returned by the function calls to the library in case of success. """
-    r = call_c_function( niftyrec_c.status_success, [{'name':'return_value',  'type':'uint', 'value':None}] ) 
-    return r.return_value
+    return status_codes.success
 
 def status_io_error(): 
     """Returns the integer value returned by the function calls to the library in case of IO error. """
-    r = call_c_function( niftyrec_c.status_io_error, [{'name':'return_value',  'type':'uint', 'value':None}] ) 
-    return r.return_value
+    return status_codes.io_error
 
 def status_initialisation_error(): 
     """Returns the value returned by the function calls to the library in case of initialisation error. """
-    r = call_c_function( niftyrec_c.status_initialisation_error, [{'name':'return_value',  'type':'uint', 'value':None}] ) 
-    return r.return_value
+    return status_codes.initialisation_error
 
 def status_parameter_error(): 
     """Returns the value returned by the function calls to the library in case of parameter error. """
-    r = call_c_function( niftyrec_c.status_parameter_error, [{'name':'return_value',  'type':'uint', 'value':None}] ) 
-    return r.return_value
+    return status_codes.parameter_error
 
 def status_unhandled_error(): 
     """Returns the value returned by the function calls to the library in case of unhandled error. """
-    r = call_c_function( niftyrec_c.status_unhandled_error, [{'name':'return_value',  'type':'uint', 'value':None}] ) 
-    return r.return_value
-
-
-class LibraryNotFound(Exception): 
-    def __init__(self,msg): 
-        self.msg = msg 
-    def __str__(self): 
-        return "Library cannot be found: %s"%str(self.msg) 
+    return status_codes.unhandled_error
 
 
 ####################################### Load library: ########################################
 def test_library_niftyrec_c(): 
     """Test whether the C library niftyrec_c responds. """
     number = 101 # just a number
-    descriptor = [  {'name':'input',  'type':'int', 'value':number},
-                    {'name':'output', 'type':'int', 'value':None },  ]
-    r = call_c_function( niftyrec_c.echo, descriptor ) 
+    r = _echo(input=number, output=None) 
     return r.output == number
     
 
-# search for the library in the list of locations 'niftyrec_lib_paths' 
-# and in the locations in the environment variables "LD_LIBRARY_PATH", "DYLD_LIBRARY_PATH" and "PATH"
-
-if platform.system()=='Linux':
-    sep = ":"
-elif platform.system()=='Darwin':
-    sep = ":"
-elif platform.system()=='Windows':
-    sep = ";"
-if os.environ.has_key('LD_LIBRARY_PATH'): 
-    niftyrec_lib_paths = niftyrec_lib_paths + os.environ['LD_LIBRARY_PATH'].split(sep)
-if os.environ.has_key('DYLD_LIBRARY_PATH'): 
-    niftyrec_lib_paths = niftyrec_lib_paths + os.environ['DYLD_LIBRARY_PATH'].split(sep)
-if os.environ.has_key('PATH'): 
-    niftyrec_lib_paths = niftyrec_lib_paths + os.environ['PATH'].split(sep)
-
-(found,fullpath,path) = find_c_library(library_name,niftyrec_lib_paths) 
-if found == NOT_FOUND: 
-    print "The library %s cannot be FOUND, please make sure that the path to the NiftyRec libraries has been exported. "%fullpath
-    print "1) Before launching Python, type the following in the terminal (the same terminal): "
-    path = "'path to the niftyrec libraries'"
-    if platform.system()=='Linux':
-        print "export LD_LIBRARY_PATH=%s"%path
-    elif platform.system()=='Darwin':
-        print "export DYLD_LIBRARY_PATH=%s"%path
-    elif platform.system()=='Windows':
-        print "Add %s to the system PATH using Control Panel -> Advanced Settings -> System -> .."%path
-    raise LibraryNotFound("NiftyRec"+" ("+str(library_name)+") ")
-elif found == FOUND_NOT_LOADABLE: 
-    print "The library %s cannot be LOADED, please make sure that the path to the NiftyRec libraries has been exported. "%fullpath
-    print "1) Before launching Python, type the following in the terminal (the same terminal): "
-    if platform.system()=='Linux':
-        print "export LD_LIBRARY_PATH=%s"%path
-    elif platform.system()=='Darwin':
-        print "export DYLD_LIBRARY_PATH=%s"%path
-    elif platform.system()=='Windows':
-        print "Add %s to the system PATH using Control Panel -> Advanced Settings -> System -> .."%path
-    raise LibraryNotFound("NiftyRec"+" ("+str(library_name)+") ")
-else: 
-    niftyrec_c = load_c_library(fullpath)
+# The library is searched (in 'niftyrec_lib_paths' and in the directories in the environment variables "LD_LIBRARY_PATH",
+# "DYLD_LIBRARY_PATH" and "PATH") and loaded at the first call to a C function, and its path is cached on disk: see Library.
+# If the library is not available the module is still usable (e.g. the NumPy engines), the C functions raise LibraryNotFound. 
+# The return codes of the library are queried once, at the first call; the success check and the error messages do not call the library. 
+niftyrec_c = Library(library_name, niftyrec_lib_paths, 'NiftyRec')
+status_codes = StatusTable(niftyrec_c)
 
 #################################### Create interface to the C functions: ####################################
 
-def gpu_list(): 
-    """List GPUs and get information. """
+# The argument layout of each C function is declared once here (simplewrap descriptors without 'value') and
+# compiled into a CallPlan; the wrappers only bind the values. Output arrays are allocated by the wrappers.
+
+_echo = CallPlan(niftyrec_c, 'echo', [
+                  {'name':'input',  'type':'int'},
+                  {'name':'output', 'type':'int'}, ])
+
+_et_array_list_gpus = CallPlan(niftyrec_c, 'et_array_list_gpus', [
+                  {'name':'N',     'type':'array',  'dtype':int32 },
+                  {'name':'info',  'type':'array',  'dtype':int32 }, ])
+
+_et_array_set_gpu_pointer = CallPlan(niftyrec_c, 'et_array_set_gpu_pointer', [
+                  {'name':'id',   'type':'int' }, ])
+
+_et_array_reset_gpu = CallPlan(niftyrec_c, 'et_array_reset_gpu', [])
+
+_PET_project = CallPlan(niftyrec_c, 'PET_project', [
+                  {'name':'activity',            'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'activity_size_x',     'type':'int'},
+                  {'name':'activity_size_y',     'type':'int'},
+                  {'name':'activity_size_z',     'type':'int'},
+                  {'name':'attenuation',         'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'attenuation_size_x',  'type':'int'},
+                  {'name':'attenuation_size_y',  'type':'int'},
+                  {'name':'attenuation_size_z',  'type':'int'},
+                  {'name':'use_gpu',             'type':'int'}, ])
+
+_PET_backproject = CallPlan(niftyrec_c, 'PET_backproject', [])
+
+_PET_project_compressed = CallPlan(niftyrec_c, 'PET_project_compressed', [
+                  {'name':'projection',               'type':'array',   'dtype':float32 },
+                  {'name':'activity',                 'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'N_activity_x',             'type':'uint'},
+                  {'name':'N_activity_y',             'type':'uint'},
+                  {'name':'N_activity_z',             'type':'uint'},
+                  {'name':'activity_size_x',          'type':'float'},
+                  {'name':'activity_size_y',          'type':'float'},
+                  {'name':'activity_size_z',          'type':'float'},
+                  {'name':'T_activity_x',             'type':'float'},
+                  {'name':'T_activity_y',             'type':'float'},
+                  {'name':'T_activity_z',             'type':'float'},
+                  {'name':'R_activity_x',             'type':'float'},
+                  {'name':'R_activity_y',             'type':'float'},
+                  {'name':'R_activity_z',             'type':'float'},
+                  {'name':'attenuation',              'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'N_attenuation_x',          'type':'uint'},
+                  {'name':'N_attenuation_y',          'type':'uint'},
+                  {'name':'N_attenuation_z',          'type':'uint'},
+                  {'name':'attenuation_size_x',       'type':'float'},
+                  {'name':'attenuation_size_y',       'type':'float'},
+                  {'name':'attenuation_size_z',       'type':'float'},
+                  {'name':'T_attenuation_x',          'type':'float'},
+                  {'name':'T_attenuation_y',          'type':'float'},
+                  {'name':'T_attenuation_z',          'type':'float'},
+                  {'name':'R_attenuation_x',          'type':'float'},
+                  {'name':'R_attenuation_y',          'type':'float'},
+                  {'name':'R_attenuation_z',          'type':'float'},
+                  {'name':'N_axial',                  'type':'uint'},
+                  {'name':'N_azimuthal',              'type':'uint'},
+                  {'name':'angles_axial',             'type':'array',   'dtype':float32,  'order':"C" },
+                  {'name':'angles_azimuthal',         'type':'array',   'dtype':float32,  'order':"C" },
+                  {'name':'N_u',                      'type':'uint'},
+                  {'name':'N_v',                      'type':'uint'},
+                  {'name':'size_u',                   'type':'float'},
+                  {'name':'size_v',                   'type':'float'},
+                  {'name':'N_locations',              'type':'uint'},
+                  {'name':'offsets',                  'type':'array',   'dtype':int32,    'order':"F" },
+                  {'name':'locations',                'type':'array',   'dtype':uint16,   'order':"F" },
+                  {'name':'active',                   'type':'array',   'order':"F" },
+                  {'name':'N_samples',                'type':'uint'},
+                  {'name':'sample_step',              'type':'float'},
+                  {'name':'background',               'type':'float'},
+                  {'name':'background_attenuation',   'type':'float'},
+                  {'name':'truncate_negative_values', 'type':'uint'},
+                  {'name':'use_gpu',                  'type':'uint'},
+                  {'name':'direction',                'type':'uint'},
+                  {'name':'block_size',               'type':'uint'}, ])
+
+_PET_project_compressed_test = CallPlan(niftyrec_c, 'PET_project_compressed_test', [
+                  {'name':'projection',             'type':'array',   'dtype':float32 },
+                  {'name':'activity',               'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'N_activity_x',           'type':'uint'},
+                  {'name':'N_activity_y',           'type':'uint'},
+                  {'name':'N_activity_z',           'type':'uint'},
+                  {'name':'attenuation',            'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'N_attenuation_x',        'type':'uint'},
+                  {'name':'N_attenuation_y',        'type':'uint'},
+                  {'name':'N_attenuation_z',        'type':'uint'},
+                  {'name':'N_axial',                'type':'uint'},
+                  {'name':'N_azimuthal',            'type':'uint'},
+                  {'name':'N_locations',            'type':'uint'},
+                  {'name':'offsets',                'type':'array',   'dtype':int32,    'order':"F" },
+                  {'name':'locations',              'type':'array',   'dtype':uint16,   'order':"F" },
+                  {'name':'active',                 'type':'array',   'order':"F" }, ])
+
+_PET_backproject_compressed = CallPlan(niftyrec_c, 'PET_backproject_compressed', [
+                  {'name':'back_projection',        'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'N_activity_x',           'type':'uint'},
+                  {'name':'N_activity_y',           'type':'uint'},
+                  {'name':'N_activity_z',           'type':'uint'},
+                  {'name':'activity_size_x',        'type':'float'},
+                  {'name':'activity_size_y',        'type':'float'},
+                  {'name':'activity_size_z',        'type':'float'},
+                  {'name':'T_activity_x',           'type':'float'},
+                  {'name':'T_activity_y',           'type':'float'},
+                  {'name':'T_activity_z',           'type':'float'},
+                  {'name':'R_activity_x',           'type':'float'},
+                  {'name':'R_activity_y',           'type':'float'},
+                  {'name':'R_activity_z',           'type':'float'},
+                  {'name':'attenuation',            'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'N_attenuation_x',        'type':'uint'},
+                  {'name':'N_attenuation_y',        'type':'uint'},
+                  {'name':'N_attenuation_z',        'type':'uint'},
+                  {'name':'attenuation_size_x',     'type':'float'},
+                  {'name':'attenuation_size_y',     'type':'float'},
+                  {'name':'attenuation_size_z',     'type':'float'},
+                  {'name':'T_attenuation_x',        'type':'float'},
+                  {'name':'T_attenuation_y',        'type':'float'},
+                  {'name':'T_attenuation_z',        'type':'float'},
+                  {'name':'R_attenuation_x',        'type':'float'},
+                  {'name':'R_attenuation_y',        'type':'float'},
+                  {'name':'R_attenuation_z',        'type':'float'},
+                  {'name':'N_axial',                'type':'uint'},
+                  {'name':'N_azimuthal',            'type':'uint'},
+                  {'name':'angles_axial',           'type':'array',   'dtype':float32,  'order':"C" },
+                  {'name':'angles_azimuthal',       'type':'array',   'dtype':float32,  'order':"C" },
+                  {'name':'N_u',                    'type':'uint'},
+                  {'name':'N_v',                    'type':'uint'},
+                  {'name':'size_u',                 'type':'float'},
+                  {'name':'size_v',                 'type':'float'},
+                  {'name':'N_locations',            'type':'uint'},
+                  {'name':'offsets',                'type':'array',   'dtype':int32,    'order':"F" },
+                  {'name':'locations',              'type':'array',   'dtype':uint16,   'order':"F" },
+                  {'name':'active',                 'type':'array',   'order':"F" },
+                  {'name':'projection_data',        'type':'array',   'dtype':float32,  'order':"C" },
+                  {'name':'use_gpu',                'type':'uint'},
+                  {'name':'N_samples',              'type':'uint'},
+                  {'name':'sample_step',            'type':'float'},
+                  {'name':'background_activity',    'type':'float'},
+                  {'name':'background_attenuation', 'type':'float'},
+                  {'name':'direction',              'type':'uint'},
+                  {'name':'block_size',             'type':'uint'}, ])
+
+_PET_initialize_compression_structure = CallPlan(niftyrec_c, 'PET_initialize_compression_structure', [
+                  {'name':'N_axial',              'type':'uint'},
+                  {'name':'N_azimuthal',          'type':'uint'},
+                  {'name':'N_u',                  'type':'uint'},
+                  {'name':'N_v',                  'type':'uint'},
+                  {'name':'offsets',              'type':'array',   'dtype':int32,    'order':'F' },
+                  {'name':'locations',            'type':'array',   'dtype':uint16,   'order':'F' }, ])
+
+_PET_compress_projection = CallPlan(niftyrec_c, 'PET_compress_projection', [
+                  {'name':'N_locations',          'type':'uint'},
+                  {'name':'N_axial',              'type':'uint'},
+                  {'name':'N_azimuthal',          'type':'uint'},
+                  {'name':'N_u',                  'type':'uint'},
+                  {'name':'N_v',                  'type':'uint'},
+                  {'name':'offsets',              'type':'array',   'dtype':int32,    'order':"F" },
+                  {'name':'data',                 'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'locations',            'type':'array',   'dtype':uint16,   'order':"F" },
+                  {'name':'projection',           'type':'array',   'dtype':float32,  'order':'F' }, ])
+
+_PET_uncompress_projection = CallPlan(niftyrec_c, 'PET_uncompress_projection', [
+                  {'name':'N_locations',          'type':'uint'},
+                  {'name':'N_axial',              'type':'uint'},
+                  {'name':'N_azimuthal',          'type':'uint'},
+                  {'name':'N_u',                  'type':'uint'},
+                  {'name':'N_v',                  'type':'uint'},
+                  {'name':'offsets',              'type':'array',   'dtype':int32,    'order':"F" },
+                  {'name':'data',                 'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'locations',            'type':'array',   'dtype':uint16,   'order':"F" },
+                  {'name':'projection',           'type':'array',   'dtype':float32,  'order':'F' }, ])
+
+_ET_spherical_phantom = CallPlan(niftyrec_c, 'ET_spherical_phantom', [
+                  {'name':'image',                 'type':'array', 'dtype':float32,  'order':"F" },
+                  {'name':'Nx',                    'type':'uint'},
+                  {'name':'Ny',                    'type':'uint'},
+                  {'name':'Nz',                    'type':'uint'},
+                  {'name':'sizex',                 'type':'float'},
+                  {'name':'sizey',                 'type':'float'},
+                  {'name':'sizez',                 'type':'float'},
+                  {'name':'centerx',               'type':'float'},
+                  {'name':'centery',               'type':'float'},
+                  {'name':'centerz',               'type':'float'},
+                  {'name':'radius',                'type':'float'},
+                  {'name':'inner_value',           'type':'float'},
+                  {'name':'outer_value',           'type':'float'}, ])
+
+_ET_cylindrical_phantom = CallPlan(niftyrec_c, 'ET_cylindrical_phantom', [
+                  {'name':'image',                 'type':'array', 'dtype':float32,  'order':"F" },
+                  {'name':'Nx',                    'type':'uint'},
+                  {'name':'Ny',                    'type':'uint'},
+                  {'name':'Nz',                    'type':'uint'},
+                  {'name':'sizex',                 'type':'float'},
+                  {'name':'sizey',                 'type':'float'},
+                  {'name':'sizez',                 'type':'float'},
+                  {'name':'centerx',               'type':'float'},
+                  {'name':'centery',               'type':'float'},
+                  {'name':'centerz',               'type':'float'},
+                  {'name':'radius',                'type':'float'},
+                  {'name':'length',                'type':'float'},
+                  {'name':'axis',                  'type':'uint'},
+                  {'name':'inner_value',           'type':'float'},
+                  {'name':'outer_value',           'type':'float'}, ])
+
+_ET_spheres_ring_phantom = CallPlan(niftyrec_c, 'ET_spheres_ring_phantom', [
+                  {'name':'image',                 'type':'array', 'dtype':float32,  'order':"F" },
+                  {'name':'Nx',                    'type':'uint'},
+                  {'name':'Ny',                    'type':'uint'},
+                  {'name':'Nz',                    'type':'uint'},
+                  {'name':'sizex',                 'type':'float'},
+                  {'name':'sizey',                 'type':'float'},
+                  {'name':'sizez',                 'type':'float'},
+                  {'name':'centerx',               'type':'float'},
+                  {'name':'centery',               'type':'float'},
+                  {'name':'centerz',               'type':'float'},
+                  {'name':'ring_radius',           'type':'float'},
+                  {'name':'min_sphere_radius',     'type':'float'},
+                  {'name':'max_sphere_radius',     'type':'float'},
+                  {'name':'N_spheres',             'type':'uint'},
+                  {'name':'inner_value',           'type':'float'},
+                  {'name':'outer_value',           'type':'float'},
+                  {'name':'taper',                 'type':'float'},
+                  {'name':'ring_axis',             'type':'uint'}, ])
+
+_SPECT_project_parallelholes = CallPlan(niftyrec_c, 'SPECT_project_parallelholes', [
+                  {'name':'activity',               'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'activity_size',          'type':'array',   'dtype':int32 },
+                  {'name':'projection',             'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'projection_size',        'type':'array',   'dtype':int32 },
+                  {'name':'cameras',                'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'cameras_size',           'type':'array',   'dtype':int32 },
+                  {'name':'psf',                    'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'psf_size',               'type':'array',   'dtype':int32 },
+                  {'name':'attenuation',            'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'attenuation_size',       'type':'array',   'dtype':int32 },
+                  {'name':'background',             'type':'float'},
+                  {'name':'background_attenuation', 'type':'float'},
+                  {'name':'use_gpu',                'type':'int'},
+                  {'name':'truncate_negative_values','type':'int'}, ])
+
+_SPECT_backproject_parallelholes = CallPlan(niftyrec_c, 'SPECT_backproject_parallelholes', [
+                  {'name':'projection',             'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'projection_size',        'type':'array',   'dtype':int32 },
+                  {'name':'backprojection',         'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'backprojection_size',    'type':'array',   'dtype':int32 },
+                  {'name':'cameras',                'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'cameras_size',           'type':'array',   'dtype':int32 },
+                  {'name':'psf',                    'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'psf_size',               'type':'array',   'dtype':int32 },
+                  {'name':'attenuation',            'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'attenuation_size',       'type':'array',   'dtype':int32 },
+                  {'name':'background',             'type':'float'},
+                  {'name':'background_attenuation', 'type':'float'},
+                  {'name':'use_gpu',                'type':'int'},
+                  {'name':'truncate_negative_values','type':'int'}, ])
+
+
+_TR_grid_from_box_and_affine = CallPlan(niftyrec_c, 'TR_grid_from_box_and_affine', [
+                  {'name':'grid',                'type':'array',  'dtype':float32,   'order':"F" },
+                  {'name':'affine_box2grid',     'type':'array',   'dtype':float32 },
+                  {'name':'box_min_x',           'type':'float'},
+                  {'name':'box_min_y',           'type':'float'},
+                  {'name':'box_min_z',           'type':'float'},
+                  {'name':'box_max_x',           'type':'float'},
+                  {'name':'box_max_y',           'type':'float'},
+                  {'name':'box_max_z',           'type':'float'},
+                  {'name':'box_n_x',             'type':'uint'},
+                  {'name':'box_n_y',             'type':'uint'},
+                  {'name':'box_n_z',             'type':'uint'}, ])
+
+_TR_resample_grid = CallPlan(niftyrec_c, 'TR_resample_grid', [
+                  {'name':'resampled_array',     'type':'array',  'dtype':float32,   'order':"F" },
+                  {'name':'image_array',         'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'affine',              'type':'array',  'dtype':float32 },
+                  {'name':'grid_array',          'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'Nx',                  'type':'uint'},
+                  {'name':'Ny',                  'type':'uint'},
+                  {'name':'Nz',                  'type':'uint'},
+                  {'name':'Nx_grid',             'type':'uint'},
+                  {'name':'Ny_grid',             'type':'uint'},
+                  {'name':'Nz_grid',             'type':'uint'},
+                  {'name':'background',          'type':'float'},
+                  {'name':'use_gpu',             'type':'uint'},
+                  {'name':'interpolation_mode',  'type':'uint'}, ])
+
+_TR_transform_grid = CallPlan(niftyrec_c, 'TR_transform_grid', [
+                  {'name':'transformed_array',   'type':'array',  'dtype':float32,   'order':"F" },
+                  {'name':'grid_array',          'type':'array',   'dtype':float32,  'order':"F" },
+                  {'name':'Nx',                  'type':'uint'},
+                  {'name':'Ny',                  'type':'uint'},
+                  {'name':'Nz',                  'type':'uint'},
+                  {'name':'affine',              'type':'array',  'dtype':float32 },
+                  {'name':'use_gpu',             'type':'uint'}, ])
+
+
+
+def set_cpu_engine(engine): 
+    """Select the engine of the projectors when use_gpu=0: CPU_ENGINE_C (NiftyRec library) or CPU_ENGINE_NUMPY. """
+    global cpu_engine
+    if engine not in (CPU_ENGINE_C, CPU_ENGINE_NUMPY): 
+        raise ValueError("Unknown engine '%s'; use '%s' or '%s'. "%(str(engine),CPU_ENGINE_C,CPU_ENGINE_NUMPY))
+    cpu_engine = engine
+
+def _use_numpy_engine(use_gpu): 
+    if use_gpu: 
+        return False
+    return cpu_engine == CPU_ENGINE_NUMPY or not niftyrec_c.available()
+
+def set_cpu_threads(N_workers=0, shards_per_worker=1, shard_size=None): 
+    """Run the SPECT and compressed PET projectors with use_gpu=0 on a pool of N_workers threads (0: disabled,
+    None: one per processor). A call is split in N_workers*shards_per_worker shards or, if 'shard_size' is given, in
+    shards of shard_size cameras (SPECT) or locations (PET); the projections of the shards are written in disjoint
+    slices of the output and the backprojections are summed in place. See Scheduler. """
+    global cpu_threads
+    from .Scheduler import Scheduler
+    if cpu_threads is not None: 
+        cpu_threads.close()
+        cpu_threads = None
+    if N_workers != 0: 
+        cpu_threads = Scheduler(N_workers=N_workers, shards_per_worker=shards_per_worker, shard_size=shard_size)
+    return cpu_threads
+
+@atexit.register
+def _close_cpu_threads(): 
+    # Stop the workers before the interpreter shuts down, while they are blocked waiting for tasks. 
+    if cpu_threads is not None: 
+        cpu_threads.close()
+
+def _cpu_threads(use_gpu): 
+    # The thread pool for this call: None with use_gpu, when disabled and within the workers of a scheduler. 
+    pool = cpu_threads
+    if use_gpu or pool is None or pool.in_worker(): 
+        return None
+    return pool
+
+
+def _gpu_enumerate():
     MAX_GPUs  = 1000
     INFO_SIZE = 5
-    descriptor = [{'name':'N',     'type':'array',  'value':None,   'dtype':int32,  'size':(1,) }, 
-                  {'name':'info',  'type':'array',  'value':None,   'dtype':int32,  'size':(MAX_GPUs,INFO_SIZE) }, ]
-    r = call_c_function( niftyrec_c.et_array_list_gpus, descriptor) 
-    if not r.status == status_success(): 
-        raise ErrorInCFunction("The execution of 'gpu_list' was unsuccessful.",r.status,'niftyrec_c.et_array_list_gpus') 
+    r = _et_array_list_gpus(N=numpy.zeros((1,),dtype=int32), info=numpy.zeros((MAX_GPUs,INFO_SIZE),dtype=int32))
+    if r.status != status_codes.success:
+        raise ErrorInCFunction("The execution of 'gpu_list' was unsuccessful.",r.status,'niftyrec_c.et_array_list_gpus')
     N = r.dictionary['N'][0]
-    info = r.dictionary['info'] 
+    info = r.dictionary['info']
     gpus = []
-    for i in range(N): 
+    for i in range(N):
         gpus.append({'id':info[i,0], 'gflops':info[i,1], 'multiprocessors':info[i,2], 'clock':info[i,3], 'globalmemory':info[i,4] })
-    return gpus 
-
-def gpu_exists(gpu_id): 
-    for gpu in gpu_list(): 
-        if gpu['id']==gpu_id: 
-            return True
-    return False 
-
-def gpu_set(gpu_id=0): 
-    """Set GPU (when multiple GPUs are installed in the system). """
-    if not gpu_exists(gpu_id): 
-        gpus = gpu_list()
-        raise ErrorGPU("The execution of 'gpu_set' was unsuccessful - the requested GPU ID does not exist. The following GPUs have been found: %s"%str(gpus))
-    descriptor = [{'name':'id',   'type':'int',    'value':gpu_id }, ] 
-    r = call_c_function( niftyrec_c.et_array_set_gpu_pointer, descriptor)
-    #print "STATUS:",r.status
-    if not r.status == status_success(): 
+    return gpus
+
+def _gpu_select(gpu_id):
+    r = _et_array_set_gpu_pointer(id=gpu_id)
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'gpu_set' was unsuccessful.",r.status,'niftyrec_c.et_array_set_gpu')
 
-def gpu_reset(): 
-    """Reset the currently selected GPU. """ 
-    r = call_c_function( niftyrec_c.et_array_reset_gpu, [])
-    if not r.status == status_success(): 
+def _gpu_reset():
+    r = _et_array_reset_gpu()
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'gpu_reset' was unsuccessful.",r.status,'niftyrec_c.et_array_reset_gpu')
-    #print "STATUS:",r.status
 
-def PET_project(activity,attenuation,binning,use_gpu=0): #FIXME: in this and all other functions, replace 'binning' object with (only the required) raw variables 
+# The GPUs are enumerated once (until gpu_reset); the selection is recorded per thread. See DeviceManager. 
+devices = DeviceManager(_gpu_enumerate, _gpu_select, _gpu_reset, ErrorGPU)
+
+def gpu_list(refresh=False):
+    """List GPUs and get information. The list is cached until gpu_reset (or refresh=True). """
+    return devices.list(refresh)
+
+def gpu_exists(gpu_id):
+    return devices.exists(gpu_id)
+
+def gpu_set(gpu_id=0):
+    """Set GPU (when multiple GPUs are installed in the system), for the calling thread. """
+    devices.select(gpu_id)
+
+def gpu_use(gpu_id):
+    """Context manager: select the GPU for the calling thread within the 'with' block. """
+    return devices.use(gpu_id)
+
+def gpu_bind(gpu_id):
+    """Select the GPU for the calling thread, for the lifetime of the thread (e.g. a worker thread). """
+    devices.bind(gpu_id)
+
+def gpu_reset():
+    """Reset the currently selected GPU; the list of the GPUs is enumerated again at the next call. """
+    devices.reset()
+
+def PET_project(activity,attenuation,binning,use_gpu=0): #FIXME: in this and all other functions, replace 'binning' object with (only the required) raw variables
     """PET projection; output projection data is compressed. """
-    descriptor = [{'name':'activity',            'type':'array',  'value':activity}, 
-                  {'name':'activity_size_x',     'type':'int',    'value':activity.shape[0]}, 
-                  {'name':'activity_size_y',     'type':'int',    'value':activity.shape[1]}, 
-                  {'name':'activity_size_z',     'type':'int',    'value':activity.shape[2]}, 
-
-                  {'name':'attenuation',         'type':'array',  'value':attenuation}, 
-                  {'name':'attenuation_size_x',  'type':'int',    'value':attenuation.shape[0]}, 
-                  {'name':'attenuation_size_y',  'type':'int',    'value':attenuation.shape[1]}, 
-                  {'name':'attenuation_size_z',  'type':'int',    'value':attenuation.shape[2]}, 
-
-                  {'name':'use_gpu',             'type':'int',    'value':use_gpu}, ]
-    r = call_c_function( niftyrec_c.PET_project, descriptor ) 
-    if not r.status == status_success(): 
+    r = _PET_project(activity=activity, activity_size_x=activity.shape[0], activity_size_y=activity.shape[1], activity_size_z=activity.shape[2],
+                     attenuation=attenuation, attenuation_size_x=attenuation.shape[0], attenuation_size_y=attenuation.shape[1], attenuation_size_z=attenuation.shape[2],
+                     use_gpu=use_gpu)
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'PET_project' was unsuccessful.",r.status,'niftyrec_c.PET_project')
     return r.dictionary['projection']
 
 
-def PET_backproject(projection_data,attenuation,binning,use_gpu=0): 
+def PET_backproject(projection_data,attenuation,binning,use_gpu=0):
     """PET back-projection; input projection data is compressed. """
-    descriptor = [    ] 
-    r = call_c_function( niftyrec_c.PET_backproject, descriptor ) 
-    if not r.status == status_success(): 
+    r = _PET_backproject()
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'PET_backproject' was unsuccessful.",r.status,'niftyrec_c.PET_backproject')
-    return r.dictionary 
-
-    
-def PET_project_compressed(activity, attenuation, offsets, locations, active, 
-N_axial, N_azimuthal, angles_axial, angles_azimuthal, N_u, N_v, size_u, size_v, 
-activity_size_x, activity_size_y, activity_size_z, attenuation_size_x, attenuation_size_y, attenuation_size_z, 
-T_activity_x, T_activity_y, T_activity_z, R_activity_x, R_activity_y, R_activity_z, 
-T_attenuation_x, T_attenuation_y, T_attenuation_z, R_attenuation_x, R_attenuation_y, R_attenuation_z, 
-use_gpu, N_samples, sample_step, background, background_attenuation, truncate_negative_values,direction,block_size): 
-    """PET projection; output projection data is compressed. """
-    N_locations = locations.shape[1] 
-    #accept attenuation=None: 
-    if attenuation  is None: 
-        attenuation = numpy.zeros((0,0,0))
-    descriptor = [{'name':'projection',             'type':'array',   'value':None,   'dtype':float32,  'size':(N_locations) }, 
-                  {'name':'activity',               'type':'array',   'value':activity}, 
-                  {'name':'N_activity_x',           'type':'uint',    'value':activity.shape[0]}, 
-                  {'name':'N_activity_y',           'type':'uint',    'value':activity.shape[1]}, 
-                  {'name':'N_activity_z',           'type':'uint',    'value':activity.shape[2]}, 
-                  {'name':'activity_size_x',        'type':'float',   'value':activity_size_x}, 
-                  {'name':'activity_size_y',        'type':'float',   'value':activity_size_y}, 
-                  {'name':'activity_size_z',        'type':'float',   'value':activity_size_z}, 
-                  
-                  {'name':'T_activity_x',           'type':'float',   'value':T_activity_x}, 
-                  {'name':'T_activity_y',           'type':'float',   'value':T_activity_y}, 
-                  {'name':'T_activity_z',           'type':'float',   'value':T_activity_z}, 
-                  {'name':'R_activity_x',           'type':'float',   'value':R_activity_x}, 
-                  {'name':'R_activity_y',           'type':'float',   'value':R_activity_y}, 
-                  {'name':'R_activity_z',           'type':'float',   'value':R_activity_z}, 
-
-                  {'name':'attenuation',            'type':'array',   'value':attenuation}, 
-                  {'name':'N_attenuation_x',        'type':'uint',    'value':attenuation.shape[0]}, 
-                  {'name':'N_attenuation_y',        'type':'uint',    'value':attenuation.shape[1]}, 
-                  {'name':'N_attenuation_z',        'type':'uint',    'value':attenuation.shape[2]}, 
-                  {'name':'attenuation_size_x',     'type':'float',   'value':attenuation_size_x}, 
-                  {'name':'attenuation_size_y',     'type':'float',   'value':attenuation_size_y}, 
-                  {'name':'attenuation_size_z',     'type':'float',   'value':attenuation_size_z}, 
- 
-                  {'name':'T_attenuation_x',        'type':'float',   'value':T_attenuation_x}, 
-                  {'name':'T_attenuation_y',        'type':'float',   'value':T_attenuation_y}, 
-                  {'name':'T_attenuation_z',        'type':'float',   'value':T_attenuation_z}, 
-                  {'name':'R_attenuation_x',        'type':'float',   'value':R_attenuation_x}, 
-                  {'name':'R_attenuation_y',        'type':'float',   'value':R_attenuation_y}, 
-                  {'name':'R_attenuation_z',        'type':'float',   'value':R_attenuation_z}, 
-
-                  {'name':'N_axial',                'type':'uint',    'value':N_axial}, 
-                  {'name':'N_azimuthal',            'type':'uint',    'value':N_azimuthal}, 
-                  {'name':'angles_axial',           'type':'array',   'value':angles_axial}, 
-                  {'name':'angles_azimuthal',       'type':'array',   'value':angles_azimuthal},
-                  {'name':'N_u',                    'type':'uint',    'value':N_u}, 
-                  {'name':'N_v',                    'type':'uint',    'value':N_v}, 
-                  {'name':'size_u',                 'type':'float',   'value':size_u}, 
-                  {'name':'size_v',                 'type':'float',   'value':size_v}, 
-
-                  {'name':'N_locations',            'type':'uint',    'value':N_locations},
-                 
-                  {'name':'offsets',                'type':'array',   'value':offsets}, 
-                  {'name':'locations',              'type':'array',   'value':locations}, 
-                  {'name':'active',                 'type':'array',   'value':active}, 
-
-                  {'name':'N_samples',                'type':'uint',    'value':N_samples}, 
-                  {'name':'sample_step',              'type':'float',   'value':sample_step}, 
-                  {'name':'background',               'type':'float',   'value':background},
-                  {'name':'background_attenuation',   'type':'float',   'value':background_attenuation},  
-                  {'name':'truncate_negative_values', 'type':'uint',    'value':truncate_negative_values},  
-
-                  {'name':'use_gpu',                  'type':'uint',    'value':use_gpu}, 
-                  {'name':'direction',                'type':'uint',    'value':direction}, 
-                  {'name':'block_size',               'type':'uint',    'value':block_size}, 
-                  ]
-    r = call_c_function( niftyrec_c.PET_project_compressed, descriptor ) 
-    if not r.status == status_success(): 
+    return r.dictionary
+
+
+def PET_project_compressed(activity, attenuation, offsets, locations, active,
+N_axial, N_azimuthal, angles_axial, angles_azimuthal, N_u, N_v, size_u, size_v,
+activity_size_x, activity_size_y, activity_size_z, attenuation_size_x, attenuation_size_y, attenuation_size_z,
+T_activity_x, T_activity_y, T_activity_z, R_activity_x, R_activity_y, R_activity_z,
+T_attenuation_x, T_attenuation_y, T_attenuation_z, R_attenuation_x, R_attenuation_y, R_attenuation_z,
+use_gpu, N_samples, sample_step, background, background_attenuation, truncate_negative_values,direction,block_size,out=None,chunk_size=None):
+    """PET projection; output projection data is compressed. The projection is written in 'out', if given.
+    'chunk_size' is the number of lines processed at once by the NumPy engine (default: CHUNK_SAMPLES samples). """
+    pool = _cpu_threads(use_gpu)
+    if pool is not None: 
+        parameters = dict(locals())
+        del parameters['pool']
+        return pool.PET_project_compressed(parameters.pop('activity'), out=parameters.pop('out'), **parameters)
+    N_locations = locations.shape[1]
+    #accept attenuation=None:
+    if attenuation  is None:
+        attenuation = numpy.zeros((0,0,0),dtype=float32)
+    projection = output_array((N_locations,),float32,"C",out)
+    if _use_numpy_engine(use_gpu): 
+        return PET_project_compressed_cpu(activity, attenuation, offsets, locations, active,
+            N_axial, N_azimuthal, angles_axial, angles_azimuthal, N_u, N_v, size_u, size_v,
+            activity_size_x, activity_size_y, activity_size_z, attenuation_size_x, attenuation_size_y, attenuation_size_z,
+            T_activity_x, T_activity_y, T_activity_z, R_activity_x, R_activity_y, R_activity_z,
+            T_attenuation_x, T_attenuation_y, T_attenuation_z, R_attenuation_x, R_attenuation_y, R_attenuation_z,
+            use_gpu, N_samples, sample_step, background, background_attenuation, truncate_negative_values, out=projection, chunk_size=chunk_size)
+    r = _PET_project_compressed(projection=projection,
+            activity=activity, N_activity_x=activity.shape[0], N_activity_y=activity.shape[1], N_activity_z=activity.shape[2],
+            activity_size_x=activity_size_x, activity_size_y=activity_size_y, activity_size_z=activity_size_z,
+            T_activity_x=T_activity_x, T_activity_y=T_activity_y, T_activity_z=T_activity_z,
+            R_activity_x=R_activity_x, R_activity_y=R_activity_y, R_activity_z=R_activity_z,
+            attenuation=attenuation, N_attenuation_x=attenuation.shape[0], N_attenuation_y=attenuation.shape[1], N_attenuation_z=attenuation.shape[2],
+            attenuation_size_x=attenuation_size_x, attenuation_size_y=attenuation_size_y, attenuation_size_z=attenuation_size_z,
+            T_attenuation_x=T_attenuation_x, T_attenuation_y=T_attenuation_y, T_attenuation_z=T_attenuation_z,
+            R_attenuation_x=R_attenuation_x, R_attenuation_y=R_attenuation_y, R_attenuation_z=R_attenuation_z,
+            N_axial=N_axial, N_azimuthal=N_azimuthal, angles_axial=angles_axial, angles_azimuthal=angles_azimuthal,
+            N_u=N_u, N_v=N_v, size_u=size_u, size_v=size_v,
+            N_locations=N_locations, offsets=offsets, locations=locations, active=active,
+            N_samples=N_samples, sample_step=sample_step, background=background, background_attenuation=background_attenuation,
+            truncate_negative_values=truncate_negative_values, use_gpu=use_gpu, direction=direction, block_size=block_size)
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'PET_project_compressed' was unsuccessful.",r.status,'niftyrec_c.PET_project_compressed')
     return r.dictionary["projection"]
 
 
 
-def PET_project_compressed_test(activity, attenuation, N_axial, N_azimuthal, offsets, locations, active): 
+def PET_project_compressed_test(activity, attenuation, N_axial, N_azimuthal, offsets, locations, active):
     N_locations = locations.shape[1]
-    #accept attenuation=None: 
-    if attenuation  is None: 
-        attenuation = numpy.zeros((0,0,0))
-    descriptor = [{'name':'projection',             'type':'array',   'value':None,   'dtype':float32,  'size':(N_locations),  }, 
-                  {'name':'activity',               'type':'array',   'value':activity}, 
-                  {'name':'N_activity_x',           'type':'uint',    'value':activity.shape[0]}, 
-                  {'name':'N_activity_y',           'type':'uint',    'value':activity.shape[1]}, 
-                  {'name':'N_activity_z',           'type':'uint',    'value':activity.shape[2]}, 
-
-                  {'name':'attenuation',            'type':'array',   'value':attenuation}, 
-                  {'name':'N_attenuation_x',        'type':'uint',    'value':attenuation.shape[0]}, 
-                  {'name':'N_attenuation_y',        'type':'uint',    'value':attenuation.shape[1]}, 
-                  {'name':'N_attenuation_z',        'type':'uint',    'value':attenuation.shape[2]}, 
-
-                  {'name':'N_axial',                'type':'uint',    'value':N_axial}, 
-                  {'name':'N_azimuthal',            'type':'uint',    'value':N_azimuthal}, 
-                  {'name':'N_locations',            'type':'uint',    'value':N_locations},
-                 
-                  {'name':'offsets',                'type':'array',   'value':offsets}, 
-                  {'name':'locations',              'type':'array',   'value':locations}, 
-                  {'name':'active',                 'type':'array',   'value':active}, ]
-    r = call_c_function( niftyrec_c.PET_project_compressed_test, descriptor ) 
-    if not r.status == status_success(): 
+    #accept attenuation=None:
+    if attenuation  is None:
+        attenuation = numpy.zeros((0,0,0),dtype=float32)
+    projection = numpy.zeros((N_locations,),dtype=float32)
+    r = _PET_project_compressed_test(projection=projection,
+            activity=activity, N_activity_x=activity.shape[0], N_activity_y=activity.shape[1], N_activity_z=activity.shape[2],
+            attenuation=attenuation, N_attenuation_x=attenuation.shape[0], N_attenuation_y=attenuation.shape[1], N_attenuation_z=attenuation.shape[2],
+            N_axial=N_axial, N_azimuthal=N_azimuthal, N_locations=N_locations, offsets=offsets, locations=locations, active=active)
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'PET_project_compressed_test' was unsuccessful.",r.status,'niftyrec_c.PET_project_compressed_test')
     return r.dictionary["projection"]
 
 
-                           
 
-def PET_backproject_compressed(projection_data, attenuation, offsets, locations, active, 
-N_axial, N_azimuthal, angles_axial, angles_azimuthal, N_u, N_v, size_u, size_v, 
-N_activity_x, N_activity_y, N_activity_z, 
-activity_size_x, activity_size_y, activity_size_z, 
-attenuation_size_x, attenuation_size_y, attenuation_size_z, 
-T_activity_x, T_activity_y, T_activity_z, R_activity_x, R_activity_y, R_activity_z, 
-T_attenuation_x, T_attenuation_y, T_attenuation_z, R_attenuation_x, R_attenuation_y, R_attenuation_z, 
-use_gpu, N_samples, sample_step, background, background_attenuation, direction, block_size): 
-    """PET back-projection; input projection data is compressed. """
-    N_locations = locations.shape[1] 
-    #accept attenuation=None: 
-    if attenuation  is None: 
-        attenuation = numpy.zeros((0,0,0))
-    descriptor = [{'name':'back_projection',        'type':'array',   'value':None,   'dtype':float32,  'size':(N_activity_x,N_activity_y,N_activity_z),  'order':"F"  }, 
-                  {'name':'N_activity_x',           'type':'uint',    'value':N_activity_x}, 
-                  {'name':'N_activity_y',           'type':'uint',    'value':N_activity_y}, 
-                  {'name':'N_activity_z',           'type':'uint',    'value':N_activity_z}, 
-                  {'name':'activity_size_x',        'type':'float',   'value':activity_size_x}, 
-                  {'name':'activity_size_y',        'type':'float',   'value':activity_size_y}, 
-                  {'name':'activity_size_z',        'type':'float',   'value':activity_size_z}, 
-                  
-                  {'name':'T_activity_x',           'type':'float',   'value':T_activity_x}, 
-                  {'name':'T_activity_y',           'type':'float',   'value':T_activity_y}, 
-                  {'name':'T_activity_z',           'type':'float',   'value':T_activity_z}, 
-                  {'name':'R_activity_x',           'type':'float',   'value':R_activity_x}, 
-                  {'name':'R_activity_y',           'type':'float',   'value':R_activity_y}, 
-                  {'name':'R_activity_z',           'type':'float',   'value':R_activity_z}, 
-
-                  {'name':'attenuation',            'type':'array',   'value':attenuation}, 
-                  {'name':'N_attenuation_x',        'type':'uint',    'value':attenuation.shape[0]}, 
-                  {'name':'N_attenuation_y',        'type':'uint',    'value':attenuation.shape[1]}, 
-                  {'name':'N_attenuation_z',        'type':'uint',    'value':attenuation.shape[2]}, 
-                  {'name':'attenuation_size_x',     'type':'float',   'value':attenuation_size_x}, 
-                  {'name':'attenuation_size_y',     'type':'float',   'value':attenuation_size_y}, 
-                  {'name':'attenuation_size_z',     'type':'float',   'value':attenuation_size_z}, 
-
-                  {'name':'T_attenuation_x',        'type':'float',   'value':T_attenuation_x}, 
-                  {'name':'T_attenuation_y',        'type':'float',   'value':T_attenuation_y}, 
-                  {'name':'T_attenuation_z',        'type':'float',   'value':T_attenuation_z}, 
-                  {'name':'R_attenuation_x',        'type':'float',   'value':R_attenuation_x}, 
-                  {'name':'R_attenuation_y',        'type':'float',   'value':R_attenuation_y}, 
-                  {'name':'R_attenuation_z',        'type':'float',   'value':R_attenuation_z}, 
-
-                  {'name':'N_axial',                'type':'uint',    'value':N_axial}, 
-                  {'name':'N_azimuthal',            'type':'uint',    'value':N_azimuthal}, 
-                  {'name':'angles_axial',           'type':'array',   'value':angles_axial}, 
-                  {'name':'angles_azimuthal',       'type':'array',   'value':angles_azimuthal},
-                  {'name':'N_u',                    'type':'uint',    'value':N_u}, 
-                  {'name':'N_v',                    'type':'uint',    'value':N_v}, 
-                  {'name':'size_u',                 'type':'float',   'value':size_u}, 
-                  {'name':'size_v',                 'type':'float',   'value':size_v}, 
-
-                  {'name':'N_locations',            'type':'uint',    'value':N_locations},
-                 
-                  {'name':'offsets',                'type':'array',   'value':offsets}, 
-                  {'name':'locations',              'type':'array',   'value':locations}, 
-                  {'name':'active',                 'type':'array',   'value':active}, 
-                  {'name':'projection_data',        'type':'array',   'value':projection_data}, 
-           
-                  {'name':'use_gpu',                'type':'uint',    'value':use_gpu}, 
-                  {'name':'N_samples',              'type':'uint',    'value':N_samples}, 
-                  {'name':'sample_step',            'type':'float',   'value':sample_step}, 
-                  {'name':'background_activity',    'type':'float',   'value':background}, 
-                  {'name':'background_attenuation', 'type':'float',   'value':background_attenuation}, 
-                  {'name':'direction',              'type':'uint',    'value':direction},
-                  {'name':'block_size',             'type':'uint',    'value':block_size},  ]
-    r = call_c_function( niftyrec_c.PET_backproject_compressed, descriptor ) 
-    if not r.status == status_success(): 
+
+def PET_backproject_compressed(projection_data, attenuation, offsets, locations, active,
+N_axial, N_azimuthal, angles_axial, angles_azimuthal, N_u, N_v, size_u, size_v,
+N_activity_x, N_activity_y, N_activity_z,
+activity_size_x, activity_size_y, activity_size_z,
+attenuation_size_x, attenuation_size_y, attenuation_size_z,
+T_activity_x, T_activity_y, T_activity_z, R_activity_x, R_activity_y, R_activity_z,
+T_attenuation_x, T_attenuation_y, T_attenuation_z, R_attenuation_x, R_attenuation_y, R_attenuation_z,
+use_gpu, N_samples, sample_step, background, background_attenuation, direction, block_size, out=None, chunk_size=None):
+    """PET back-projection; input projection data is compressed. The back-projection is written in 'out', if given.
+    'chunk_size' is the number of lines processed at once by the NumPy engine (default: CHUNK_SAMPLES samples). """
+    pool = _cpu_threads(use_gpu)
+    if pool is not None: 
+        parameters = dict(locals())
+        del parameters['pool']
+        return pool.PET_backproject_compressed(parameters.pop('projection_data'), out=parameters.pop('out'), **parameters)
+    N_locations = locations.shape[1]
+    #accept attenuation=None:
+    if attenuation  is None:
+        attenuation = numpy.zeros((0,0,0),dtype=float32)
+    back_projection = output_array((N_activity_x,N_activity_y,N_activity_z),float32,"F",out)
+    if _use_numpy_engine(use_gpu): 
+        return PET_backproject_compressed_cpu(projection_data, attenuation, offsets, locations, active,
+            N_axial, N_azimuthal, angles_axial, angles_azimuthal, N_u, N_v, size_u, size_v,
+            N_activity_x, N_activity_y, N_activity_z, activity_size_x, activity_size_y, activity_size_z,
+            attenuation_size_x, attenuation_size_y, attenuation_size_z,
+            T_activity_x, T_activity_y, T_activity_z, R_activity_x, R_activity_y, R_activity_z,
+            T_attenuation_x, T_attenuation_y, T_attenuation_z, R_attenuation_x, R_attenuation_y, R_attenuation_z,
+            use_gpu, N_samples, sample_step, background, background_attenuation, out=back_projection, chunk_size=chunk_size)
+    r = _PET_backproject_compressed(back_projection=back_projection,
+            N_activity_x=N_activity_x, N_activity_y=N_activity_y, N_activity_z=N_activity_z,
+            activity_size_x=activity_size_x, activity_size_y=activity_size_y, activity_size_z=activity_size_z,
+            T_activity_x=T_activity_x, T_activity_y=T_activity_y, T_activity_z=T_activity_z,
+            R_activity_x=R_activity_x, R_activity_y=R_activity_y, R_activity_z=R_activity_z,
+            attenuation=attenuation, N_attenuation_x=attenuation.shape[0], N_attenuation_y=attenuation.shape[1], N_attenuation_z=attenuation.shape[2],
+            attenuation_size_x=attenuation_size_x, attenuation_size_y=attenuation_size_y, attenuation_size_z=attenuation_size_z,
+            T_attenuation_x=T_attenuation_x, T_attenuation_y=T_attenuation_y, T_attenuation_z=T_attenuation_z,
+            R_attenuation_x=R_attenuation_x, R_attenuation_y=R_attenuation_y, R_attenuation_z=R_attenuation_z,
+            N_axial=N_axial, N_azimuthal=N_azimuthal, angles_axial=angles_axial, angles_azimuthal=angles_azimuthal,
+            N_u=N_u, N_v=N_v, size_u=size_u, size_v=size_v,
+            N_locations=N_locations, offsets=offsets, locations=locations, active=active, projection_data=projection_data,
+            use_gpu=use_gpu, N_samples=N_samples, sample_step=sample_step, background_activity=background,
+            background_attenuation=background_attenuation, direction=direction, block_size=block_size)
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'PET_backproject_compressed' was unsuccessful.",r.status,'niftyrec_c.PET_backproject_compressed')
     return r.dictionary['back_projection']
 
 
 
-def PET_initialize_compression_structure(N_axial, N_azimuthal, N_u, N_v): 
-    """Obtain 'offsets' and 'locations' arrays for fully sampled PET compressed projection data. """
-    descriptor = [{'name':'N_axial',              'type':'uint',         'value':N_axial         }, 
-                  {'name':'N_azimuthal',          'type':'uint',         'value':N_azimuthal     }, 
-                  {'name':'N_u',                  'type':'uint',         'value':N_u             },  
-                  {'name':'N_v',                  'type':'uint',         'value':N_v             }, 
-                  {'name':'offsets',              'type':'array',        'value':None,   'dtype':int32,     'size':(N_azimuthal,N_axial),           'order': 'F'  }, 
-                  {'name':'locations',            'type':'array',        'value':None,   'dtype':uint16,    'size':(3,N_u*N_v*N_axial*N_azimuthal), 'order':'F'},
-                ] 
-
-    r = call_c_function( niftyrec_c.PET_initialize_compression_structure, descriptor )
-    if not r.status == status_success(): 
+_compression_structures = {}
+_compression_structures_lock = threading.Lock()
+
+def PET_initialize_compression_structure(N_axial, N_azimuthal, N_u, N_v, cache=None):
+    """Obtain 'offsets' and 'locations' arrays for fully sampled PET compressed projection data.
+    The arrays depend only on (N_axial, N_azimuthal, N_u, N_v): they are computed once per process and, if a
+    disk cache is active ('cache', default: the active DiskCache), once per machine, and returned read-only
+    (memory-mapped from the disk cache), so that the processes share one physical copy. """
+    key = (int(N_axial), int(N_azimuthal), int(N_u), int(N_v))
+    with _compression_structures_lock:
+        structure = _compression_structures.get(key)
+    if structure is not None:
+        return list(structure)
+    if cache is None:
+        cache = get_disk_cache()
+    if cache is not None:
+        keys = [cache.key('PET_initialize_compression_structure', name, key) for name in ('offsets','locations')]
+        structure = [cache.get(k) for k in keys]
+        if structure[0] is None or structure[1] is None:
+            structure = [cache.put(k, a) for k, a in zip(keys, _initialize_compression_structure(*key))]
+    else:
+        structure = _initialize_compression_structure(*key)
+        for a in structure:
+            a.flags.writeable = False
+    with _compression_structures_lock:
+        structure = _compression_structures.setdefault(key, tuple(structure))
+    return list(structure)
+
+
+def _initialize_compression_structure(N_axial, N_azimuthal, N_u, N_v):
+    if _use_numpy_engine(0):
+        return PET_initialize_compression_structure_cpu(N_axial, N_azimuthal, N_u, N_v)
+    offsets   = numpy.zeros((N_azimuthal,N_axial),dtype=int32,order='F')
+    locations = numpy.zeros((3,N_u*N_v*N_axial*N_azimuthal),dtype=uint16,order='F')
+    r = _PET_initialize_compression_structure(N_axial=N_axial, N_azimuthal=N_azimuthal, N_u=N_u, N_v=N_v, offsets=offsets, locations=locations)
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'PET_initialize_compression_structure' was unsuccessful.",r.status,'niftyrec_c.PET_initialize_compression_structure')
     return [r.dictionary['offsets'],r.dictionary['locations']]
 
 
-def PET_compress_projection(offsets, data, locations, N_u, N_v): 
+def PET_compress_projection(offsets, data, locations, N_u, N_v):
     """Find the zero entries in fully sampled PET projection data and compress it."""
+    if _use_numpy_engine(0):
+        return PET_compress_projection_cpu(offsets, data, locations, N_u, N_v)
     N_locations = locations.shape[1]
     N_axial     = offsets.shape[1]
-    N_azimuthal = offsets.shape[0] 
-    descriptor = [  {'name':'N_locations',             'type':'uint',      'value':N_locations   }, 
-                    {'name':'N_axial',                 'type':'uint',      'value':N_axial       }, 
-                    {'name':'N_azimuthal',             'type':'uint',      'value':N_azimuthal   }, 
-                    {'name':'N_u',                     'type':'uint',      'value':N_u           }, 
-                    {'name':'N_v',                     'type':'uint',      'value':N_v           },  
-                    {'name':'offsets',                 'type':'array',     'value':offsets       }, 
-                    {'name':'data',                    'type':'array',     'value':data          }, 
-                    {'name':'locations',               'type':'array',     'value':locations     },   
-                    {'name':'projection',              'type':'array',     'value':None,   'dtype':float32,  'size':(N_locations,),   'order':'F' },  
-                 ] 
-    r = call_c_function( niftyrec_c.PET_compress_projection, descriptor )
-    if not r.status == status_success(): 
+    N_azimuthal = offsets.shape[0]
+    projection = numpy.zeros((N_locations,),dtype=float32,order='F')
+    r = _PET_compress_projection(N_locations=N_locations, N_axial=N_axial, N_azimuthal=N_azimuthal, N_u=N_u, N_v=N_v,
+                                 offsets=offsets, data=data, locations=locations, projection=projection)
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'PET_compress_projection' was unsuccessful.",r.status,'niftyrec_c.PET_compress_projection')
     return r.dictionary['projection']
 
 
-def PET_uncompress_projection(offsets, data, locations, N_u, N_v): 
+def PET_uncompress_projection(offsets, data, locations, N_u, N_v):
     """Uncompress compressed PET projection data. """
+    if _use_numpy_engine(0):
+        return PET_uncompress_projection_cpu(offsets, data, locations, N_u, N_v)
     N_locations = locations.shape[1]
     N_axial     = offsets.shape[1]
-    N_azimuthal = offsets.shape[0] 
-    descriptor = [  {'name':'N_locations',             'type':'uint',      'value':N_locations   }, 
-                    {'name':'N_axial',                 'type':'uint',      'value':N_axial       }, 
-                    {'name':'N_azimuthal',             'type':'uint',      'value':N_azimuthal   }, 
-                    {'name':'N_u',                     'type':'uint',      'value':N_u           }, 
-                    {'name':'N_v',                     'type':'uint',      'value':N_v           },  
-                    {'name':'offsets',                 'type':'array',     'value':offsets       }, 
-                    {'name':'data',                  'type':'array',     'value':data            }, 
-                    {'name':'locations',               'type':'array',     'value':locations     },   
-                    {'name':'projection',              'type':'array',     'value':None,   'dtype':float32,  'size':(N_v * N_u * N_azimuthal * N_axial, ),   'order':'F' },  
-                 ] 
-    r = call_c_function( niftyrec_c.PET_uncompress_projection, descriptor )
-    if not r.status == status_success(): 
+    N_azimuthal = offsets.shape[0]
+    projection = numpy.zeros((N_v * N_u * N_azimuthal * N_axial, ),dtype=float32,order='F')
+    r = _PET_uncompress_projection(N_locations=N_locations, N_axial=N_axial, N_azimuthal=N_azimuthal, N_u=N_u, N_v=N_v,
+                                   offsets=offsets, data=data, locations=locations, projection=projection)
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'PET_uncompress_projection' was unsuccessful.",r.status,'niftyrec_c.PET_uncompress_projection')
     return r.dictionary['projection']
 
 
 
 
-def ET_spherical_phantom(voxels,size,center,radius,inner_value,outer_value): 
+def ET_spherical_phantom(voxels,size,center,radius,inner_value,outer_value):
     """Create a spherical phantom. """
-    descriptor = [{'name':'image',                 'type':'array', 'value':None,   'dtype':float32,  'size':(voxels[0],voxels[1],voxels[2]),  'order':"F"  }, 
-                  {'name':'Nx',                    'type':'uint',  'value':voxels[0]}, 
-                  {'name':'Ny',                    'type':'uint',  'value':voxels[1]}, 
-                  {'name':'Nz',                    'type':'uint',  'value':voxels[2]}, 
-                  {'name':'sizex',                 'type':'float', 'value':size[0]},
-                  {'name':'sizey',                 'type':'float', 'value':size[1]},
-                  {'name':'sizez',                 'type':'float', 'value':size[2]},
-                  {'name':'centerx',               'type':'float', 'value':center[0]},
-                  {'name':'centery',               'type':'float', 'value':center[1]},
-                  {'name':'centerz',               'type':'float', 'value':center[2]},
-                  {'name':'radius',                'type':'float', 'value':radius},
-                  {'name':'inner_value',           'type':'float', 'value':inner_value},
-                  {'name':'outer_value',           'type':'float', 'value':outer_value},  ] 
-    r = call_c_function( niftyrec_c.ET_spherical_phantom, descriptor ) 
-    if not r.status == status_success(): 
+    image = numpy.zeros((voxels[0],voxels[1],voxels[2]),dtype=float32,order="F")
+    r = _ET_spherical_phantom(image=image, Nx=voxels[0], Ny=voxels[1], Nz=voxels[2], sizex=size[0], sizey=size[1], sizez=size[2],
+                              centerx=center[0], centery=center[1], centerz=center[2], radius=radius, inner_value=inner_value, outer_value=outer_value)
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'ET_spherical_phantom' was unsuccessful.",r.status,'niftyrec_c.ET_spherical_phantom')
     return r.dictionary['image']
 
 
 
-def ET_cylindrical_phantom(voxels,size,center,radius,length,axis,inner_value,outer_value): 
+def ET_cylindrical_phantom(voxels,size,center,radius,length,axis,inner_value,outer_value):
     """Create a cylindrical phantom. """
-    descriptor = [{'name':'image',                 'type':'array', 'value':None,   'dtype':float32,  'size':(voxels[0],voxels[1],voxels[2]),  'order':"F"  }, 
-                  {'name':'Nx',                    'type':'uint',  'value':voxels[0]}, 
-                  {'name':'Ny',                    'type':'uint',  'value':voxels[1]}, 
-                  {'name':'Nz',                    'type':'uint',  'value':voxels[2]}, 
-                  {'name':'sizex',                 'type':'float', 'value':size[0]},
-                  {'name':'sizey',                 'type':'float', 'value':size[1]},
-                  {'name':'sizez',                 'type':'float', 'value':size[2]},
-                  {'name':'centerx',               'type':'float', 'value':center[0]},
-                  {'name':'centery',               'type':'float', 'value':center[1]},
-                  {'name':'centerz',               'type':'float', 'value':center[2]},
-                  {'name':'radius',                'type':'float', 'value':radius},
-                  {'name':'length',                'type':'float', 'value':length},
-                  {'name':'axis',                  'type':'uint',  'value':axis},
-                  {'name':'inner_value',           'type':'float', 'value':inner_value},
-                  {'name':'outer_value',           'type':'float', 'value':outer_value},  ] 
-    r = call_c_function( niftyrec_c.ET_cylindrical_phantom, descriptor ) 
-    if not r.status == status_success(): 
+    image = numpy.zeros((voxels[0],voxels[1],voxels[2]),dtype=float32,order="F")
+    r = _ET_cylindrical_phantom(image=image, Nx=voxels[0], Ny=voxels[1], Nz=voxels[2], sizex=size[0], sizey=size[1], sizez=size[2],
+                                centerx=center[0], centery=center[1], centerz=center[2], radius=radius, length=length, axis=axis,
+                                inner_value=inner_value, outer_value=outer_value)
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'ET_cylindrical_phantom' was unsuccessful.",r.status,'niftyrec_c.ET_cylindrical_phantom')
     return r.dictionary['image']
 
 
 
-def ET_spheres_ring_phantom(voxels,size,center,ring_radius,min_sphere_radius,max_sphere_radius,N_spheres=6,inner_value=1.0,outer_value=0.0,taper=0,axis=0): 
+def ET_spheres_ring_phantom(voxels,size,center,ring_radius,min_sphere_radius,max_sphere_radius,N_spheres=6,inner_value=1.0,outer_value=0.0,taper=0,axis=0):
     """Create a phantom with a ring of spheres of variable radius. """
-    descriptor = [{'name':'image',                 'type':'array', 'value':None,   'dtype':float32,  'size':(voxels[0],voxels[1],voxels[2]),  'order':"F"  }, 
-                  {'name':'Nx',                    'type':'uint',  'value':voxels[0]}, 
-                  {'name':'Ny',                    'type':'uint',  'value':voxels[1]}, 
-                  {'name':'Nz',                    'type':'uint',  'value':voxels[2]}, 
-                  {'name':'sizex',                 'type':'float', 'value':size[0]},
-                  {'name':'sizey',                 'type':'float', 'value':size[1]},
-                  {'name':'sizez',                 'type':'float', 'value':size[2]},
-                  {'name':'centerx',               'type':'float', 'value':center[0]},
-                  {'name':'centery',               'type':'float', 'value':center[1]},
-                  {'name':'centerz',               'type':'float', 'value':center[2]},
-                  {'name':'ring_radius',           'type':'float', 'value':ring_radius}, 
-                  {'name':'min_sphere_radius',     'type':'float', 'value':min_sphere_radius}, 
-                  {'name':'max_sphere_radius',     'type':'float', 'value':max_sphere_radius}, 
-                  {'name':'N_spheres',             'type':'uint',  'value':N_spheres}, 
-                  {'name':'inner_value',           'type':'float', 'value':inner_value},
-                  {'name':'outer_value',           'type':'float', 'value':outer_value},  
-                  {'name':'taper',                 'type':'float', 'value':taper},  
-                  {'name':'ring_axis',             'type':'uint',  'value':axis}, ] 
-    r = call_c_function( niftyrec_c.ET_spheres_ring_phantom, descriptor ) 
-    if not r.status == status_success(): 
+    image = numpy.zeros((voxels[0],voxels[1],voxels[2]),dtype=float32,order="F")
+    r = _ET_spheres_ring_phantom(image=image, Nx=voxels[0], Ny=voxels[1], Nz=voxels[2], sizex=size[0], sizey=size[1], sizez=size[2],
+                                 centerx=center[0], centery=center[1], centerz=center[2], ring_radius=ring_radius,
+                                 min_sphere_radius=min_sphere_radius, max_sphere_radius=max_sphere_radius, N_spheres=N_spheres,
+                                 inner_value=inner_value, outer_value=outer_value, taper=taper, ring_axis=axis)
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'ET_spheres_ring_phantom' was unsuccessful.",r.status,'niftyrec_c.ET_spheres_ring_phantom')
     return r.dictionary['image']
 
-    
-
-def SPECT_project_parallelholes(activity,cameras,attenuation=None,psf=None,background=0.0, background_attenuation=0.0, use_gpu=1, truncate_negative_values=0): 
-    """SPECT projection; parallel-holes geometry. """
-    #accept attenuation=None and psf=None: 
-    if attenuation  is None: 
-        attenuation = numpy.zeros((0,0,0)) 
-    if psf is None: 
-        psf = numpy.zeros((0,0,0)) 
-    N_projections = cameras.shape[0]
-    descriptor = [{'name':'activity',               'type':'array',   'value':activity }, 
-                  {'name':'activity_size',          'type':'array',   'value':int32(activity.shape) }, 
-                  {'name':'projection',             'type':'array',   'value':None,   'dtype':float32,  'size':(activity.shape[0],activity.shape[1],N_projections),  'order':"F"  }, 
-                  {'name':'projection_size',        'type':'array',   'value':int32([N_projections, activity.shape[0], activity.shape[1]]) }, 
-                  {'name':'cameras',                'type':'array',   'value':cameras,                  'order':"F" }, 
-                  {'name':'cameras_size',           'type':'array',   'value':int32(cameras.shape) }, 
-                  {'name':'psf',                    'type':'array',   'value':psf,                      'order':"F" }, 
-                  {'name':'psf_size',               'type':'array',   'value':int32(psf.shape) }, 
-                  {'name':'attenuation',            'type':'array',   'value':attenuation }, 
-                  {'name':'attenuation_size',       'type':'array',   'value':int32(attenuation.shape) }, 
-                  {'name':'background',             'type':'float',   'value':background }, 
-                  {'name':'background_attenuation', 'type':'float',   'value':background_attenuation }, 
-                  {'name':'use_gpu',                'type':'int',     'value':use_gpu }, 
-                  {'name':'truncate_negative_values','type':'int',    'value':truncate_negative_values },  ]
-
-    r = call_c_function( niftyrec_c.SPECT_project_parallelholes, descriptor ) 
-    if not r.status == status_success(): 
-        raise ErrorInCFunction("The execution of 'SPECT_project_parallelholes' was unsuccessful.",r.status,'niftyrec_c.SPECT_project_parallelholes')
-    return r.dictionary['projection']
 
 
-def SPECT_backproject_parallelholes(projection, cameras, attenuation=None,psf=None,background=0.0, background_attenuation=0.0, use_gpu=1, truncate_negative_values=0): 
-    """SPECT backprojection; parallel-holes geometry. """
-    #accept attenuation=None and psf=None: 
-    if attenuation  is None: 
-        attenuation = numpy.zeros((0,0,0)) 
-    if psf is None: 
-        psf = numpy.zeros((0,0,0)) 
+def SPECT_project_parallelholes(activity,cameras,attenuation=None,psf=None,background=0.0, background_attenuation=0.0, use_gpu=1, truncate_negative_values=0, out=None):
+    """SPECT projection; parallel-holes geometry. The projection is written in 'out', if given.
+    'activity' can be a stack of activities (Nx,Ny,Nz,N_frames): the frames are projected in one pass,
+    sharing cameras, psf and attenuation, and the projection has shape (Nx,Ny,N_cameras,N_frames). """
+    pool = _cpu_threads(use_gpu)
+    if pool is not None: 
+        return pool.SPECT_project_parallelholes(activity, cameras, attenuation, psf, background, background_attenuation, truncate_negative_values, out=out)
+    #accept attenuation=None and psf=None:
+    if attenuation  is None:
+        attenuation = numpy.zeros((0,0,0),dtype=float32)
+    if psf is None:
+        psf = numpy.zeros((0,0,0),dtype=float32)
     N_projections = cameras.shape[0]
-    descriptor = [{'name':'projection',             'type':'array',   'value':projection }, 
-                  {'name':'projection_size',        'type':'array',   'value':int32(projection.shape) }, 
-                  {'name':'backprojection',         'type':'array',   'value':None,   'dtype':float32,  'size':(projection.shape[0],projection.shape[1],projection.shape[0]),  'order':"F"  }, 
-                  {'name':'backprojection_size',    'type':'array',   'value':int32( [projection.shape[0],projection.shape[1],projection.shape[0]] ) }, 
-                  {'name':'cameras',                'type':'array',   'value':cameras,                  'order':"F" }, 
-                  {'name':'cameras_size',           'type':'array',   'value':int32(cameras.shape) }, 
-                  {'name':'psf',                    'type':'array',   'value':psf,                      'order':"F" }, 
-                  {'name':'psf_size',               'type':'array',   'value':int32(psf.shape) }, 
-                  {'name':'attenuation',            'type':'array',   'value':attenuation }, 
-                  {'name':'attenuation_size',       'type':'array',   'value':int32(attenuation.shape) }, 
-                  {'name':'background',             'type':'float',   'value':background }, 
-                  {'name':'background_attenuation', 'type':'float',   'value':background_attenuation }, 
-                  {'name':'use_gpu',                'type':'int',     'value':use_gpu }, 
-                  {'name':'truncate_negative_values','type':'int',    'value':truncate_negative_values },  ]
-
-    r = call_c_function( niftyrec_c.SPECT_backproject_parallelholes, descriptor ) 
-    if not r.status == status_success(): 
-        raise ErrorInCFunction("The execution of 'SPECT_backproject_parallelholes' was unsuccessful.",r.status,'niftyrec_c.SPECT_backproject_parallelholes')
-    return r.dictionary['backprojection']
-    
-
-
-def CT_project_conebeam(attenuation,camera_trajectory,source_trajectory,use_gpu=0): 
-    """Transmission imaging projection; cone-beam geometry. """
-    descriptor = [    ] 
-    r = call_c_function( niftyrec_c.CT_project_conebeam, descriptor ) 
-    if not r.status == status_success(): 
-        raise ErrorInCFunction("The execution of 'CT_project_conebeam' was unsuccessful.",r.status,'niftyrec_c.CT_project_conebeam')
-    return r.dictionary     
-
-
-def CT_backproject_conebeam(projection_data,camera_trajectory,source_trajectory,use_gpu=0): 
-    """Transmission imaging back-projection; cone-beam geometry. """
-    descriptor = [    ] 
-    r = call_c_function( niftyrec_c.CT_backproject_conebeam, descriptor ) 
-    if not r.status == status_success(): 
-        raise ErrorInCFunction("The execution of 'CT_backproject_conebeam' was unsuccessful.",r.status,'niftyrec_c.CT_backproject_conebeam')
-    return r.dictionary             
-
-
-def CT_project_parallelbeam(attenuation,camera_trajectory,source_trajectory,use_gpu=0): 
-    """Transmission imaging projection; parallel-beam geometry. """
-    descriptor = [    ] 
-    r = call_c_function( niftyrec_c.CT_project_parallelbeam, descriptor ) 
-    if not r.status == status_success(): 
-        raise ErrorInCFunction("The execution of 'CT_project_parallelbeam' was unsuccessful.",r.status,'niftyrec_c.CT_project_parallelbeam')
-    return r.dictionary         
-
-
-def CT_backproject_parallelbeam(attenuation,camera_trajectory,source_trajectory,use_gpu=0): 
-    """Transmission imaging back-projection; parallel-beam geometry. """
-    descriptor = [    ] 
-    r = call_c_function( niftyrec_c.CT_backproject_parallelbeam, descriptor ) 
-    if not r.status == status_success(): 
-        raise ErrorInCFunction("The execution of 'CT_backproject_parallelbeam' was unsuccessful.",r.status,'niftyrec_c.CT_backproject_parallelbeam')
-    return r.dictionary         
-
-
-
-
-
-
-
-
-def TR_grid_from_box_and_affine(box_min, box_max, box_n, affine_box2grid=None): 
+    projection = output_array((activity.shape[0],activity.shape[1],N_projections)+activity.shape[3:],float32,"F",out)
+    if _use_numpy_engine(use_gpu): 
+        return SPECT_project_parallelholes_cpu(activity, cameras, attenuation, psf, background, background_attenuation, truncate_negative_values, out=projection)
+    # convert the geometry once: the frames then reuse it without further copies
+    name = 'SPECT_project_parallelholes'
+    activity    = normalize_array(activity, float32, "F", name)
+    cameras     = normalize_array(cameras, float32, "F", name)
+    psf         = normalize_array(psf, float32, "F", name)
+    attenuation = normalize_array(attenuation, float32, "F", name)
+    for frame in range(1 if activity.ndim == 3 else activity.shape[3]):
+        r = _SPECT_project_parallelholes(activity=activity if activity.ndim == 3 else activity[:,:,:,frame], activity_size=activity.shape[0:3],
+                                         projection=projection if activity.ndim == 3 else projection[:,:,:,frame], projection_size=(N_projections, activity.shape[0], activity.shape[1]),
+                                         cameras=cameras, cameras_size=cameras.shape, psf=psf, psf_size=psf.shape,
+                                         attenuation=attenuation, attenuation_size=attenuation.shape,
+                                         background=background, background_attenuation=background_attenuation,
+                                         use_gpu=use_gpu, truncate_negative_values=truncate_negative_values)
+        if r.status != status_codes.success:
+            raise ErrorInCFunction("The execution of 'SPECT_project_parallelholes' was unsuccessful.",r.status,'niftyrec_c.SPECT_project_parallelholes')
+    return projection
+
+
+def SPECT_backproject_parallelholes(projection, cameras, attenuation=None,psf=None,background=0.0, background_attenuation=0.0, use_gpu=1, truncate_negative_values=0, out=None):
+    """SPECT backprojection; parallel-holes geometry. The backprojection is written in 'out', if given.
+    'projection' can be a stack of projections (Nx,Ny,N_cameras,N_frames): the backprojection is then a stack
+    (Nx,Ny,Nx,N_frames), computed in one pass sharing cameras, psf and attenuation. """
+    pool = _cpu_threads(use_gpu)
+    if pool is not None: 
+        return pool.SPECT_backproject_parallelholes(projection, cameras, attenuation, psf, background, background_attenuation, truncate_negative_values, out=out)
+    #accept attenuation=None and psf=None:
+    if attenuation  is None:
+        attenuation = numpy.zeros((0,0,0),dtype=float32)
+    if psf is None:
+        psf = numpy.zeros((0,0,0),dtype=float32)
+    N_projections = cameras.shape[0]
+    backprojection_size = (projection.shape[0],projection.shape[1],projection.shape[0])
+    backprojection = output_array(backprojection_size+projection.shape[3:],float32,"F",out)
+    if _use_numpy_engine(use_gpu): 
+        return SPECT_backproject_parallelholes_cpu(projection, cameras, attenuation, psf, background, background_attenuation, truncate_negative_values, out=backprojection, shape=backprojection_size)
+    # convert the geometry once: the frames then reuse it without further copies
+    name = 'SPECT_backproject_parallelholes'
+    projection  = normalize_array(projection, float32, "F", name)
+    cameras     = normalize_array(cameras, float32, "F", name)
+    psf         = normalize_array(psf, float32, "F", name)
+    attenuation = normalize_array(attenuation, float32, "F", name)
+    for frame in range(1 if projection.ndim == 3 else projection.shape[3]):
+        r = _SPECT_backproject_parallelholes(projection=projection if projection.ndim == 3 else projection[:,:,:,frame], projection_size=projection.shape[0:3],
+                                             backprojection=backprojection if projection.ndim == 3 else backprojection[:,:,:,frame], backprojection_size=backprojection_size,
+                                             cameras=cameras, cameras_size=cameras.shape, psf=psf, psf_size=psf.shape,
+                                             attenuation=attenuation, attenuation_size=attenuation.shape,
+                                             background=background, background_attenuation=background_attenuation,
+                                             use_gpu=use_gpu, truncate_negative_values=truncate_negative_values)
+        if r.status != status_codes.success:
+            raise ErrorInCFunction("The execution of 'SPECT_backproject_parallelholes' was unsuccessful.",r.status,'niftyrec_c.SPECT_backproject_parallelholes')
+    return backprojection
+
+
+
+def CT_project_conebeam(attenuation,camera_trajectory,source_trajectory,use_gpu=0,detector_shape=None,pixel_size=1.0,out=None,ray_batch=RAY_BATCH):
+    """Transmission imaging projection; cone-beam geometry. Coordinates are in voxels, with the origin at the center
+    of the volume: 'source_trajectory' (N_views,3) holds the positions of the source, 'camera_trajectory' the center
+    of the detector (N_views,3), or the center and the u and v pixel vectors (N_views,9). Returns the line integrals
+    of the attenuation, shape detector_shape+(N_views,), default detector (max(Nx,Ny),Nz).
+    The C library does not implement this geometry: the projection is computed by the NumPy engine, 'ray_batch' rays at a time. """
+    if detector_shape is None:
+        detector_shape = (max(attenuation.shape[0],attenuation.shape[1]),attenuation.shape[2])
+    N_views = numpy.asarray(source_trajectory).reshape((-1,3)).shape[0]
+    projection = output_array((detector_shape[0],detector_shape[1],N_views),float32,"F",out)
+    return CT_project_conebeam_cpu(attenuation, camera_trajectory, source_trajectory, detector_shape, pixel_size, out=projection, ray_batch=ray_batch)
+
+
+def CT_backproject_conebeam(projection_data,camera_trajectory,source_trajectory,use_gpu=0,shape=None,pixel_size=1.0,out=None,accumulate=False,ray_batch=RAY_BATCH):
+    """Transmission imaging back-projection; cone-beam geometry. Adjoint of CT_project_conebeam. The back-projection
+    has the given shape (default (Nu,Nu,Nv)) and is written in 'out', if given. With accumulate=True it is added
+    to the content of 'out', so that a scan can be back-projected in several calls into a preallocated volume. """
+    if accumulate:
+        if out is None:
+            raise ValueError("accumulate=True requires a preallocated 'out' volume. ")
+        if out.dtype != float32 or not out.flags.f_contiguous or not out.flags.writeable:
+            raise ValueError("'out' must be a writeable float32 array with order 'F'. ")
+        backprojection = out
+    else:
+        if shape is None:
+            shape = (projection_data.shape[0],projection_data.shape[0],projection_data.shape[1])
+        backprojection = output_array(shape,float32,"F",out)
+    return CT_backproject_conebeam_cpu(projection_data, camera_trajectory, source_trajectory, pixel_size=pixel_size, out=backprojection, ray_batch=ray_batch)
+
+
+def CT_project_parallelbeam(attenuation,camera_trajectory,source_trajectory=None,use_gpu=0,out=None):
+    """Transmission imaging projection; parallel-beam geometry. 'camera_trajectory' holds the rotation of
+    each camera, as the 'cameras' of SPECT_project_parallelholes; 'source_trajectory' is not used (the
+    sources are at infinity). Returns the line integrals of the attenuation, shape (Nx,Ny,N_cameras).
+    The C library does not implement this geometry: the projection is computed by the NumPy engine. """
+    projection = output_array((attenuation.shape[0],attenuation.shape[1],len(camera_trajectory)),float32,"F",out)
+    return CT_project_parallelbeam_cpu(attenuation, camera_trajectory, out=projection)
+
+
+def CT_backproject_parallelbeam(projection_data,camera_trajectory,source_trajectory=None,use_gpu=0,shape=None,out=None):
+    """Transmission imaging back-projection; parallel-beam geometry. Adjoint of CT_project_parallelbeam.
+    The back-projection has the given shape (default (Nx,Ny,Nx)) and is written in 'out', if given. """
+    if shape is None:
+        shape = (projection_data.shape[0],projection_data.shape[1],projection_data.shape[0])
+    backprojection = output_array(shape,float32,"F",out)
+    return CT_backproject_parallelbeam_cpu(projection_data, camera_trajectory, out=backprojection)
+
+
+
+
+
+
+
+
+def TR_grid_from_box_and_affine(box_min, box_max, box_n, affine_box2grid=None):
     """Create 3D grid from box and affine transformation. """
-    if affine_box2grid is None: 
-        affine_box2grid=numpy.eye(4,dtype=float32) 
-    descriptor = [{'name':'grid',                'type':'array',  'value':None,                       'dtype':float32,   'size':(box_n[0],box_n[1],box_n[2],3),   'order':"F"    }, 
-                  {'name':'affine_box2grid',     'type':'array',  'value':affine_box2grid, },
-                  {'name':'box_min_x',           'type':'float',  'value':box_min[0], }, 
-                  {'name':'box_min_y',           'type':'float',  'value':box_min[1], }, 
-                  {'name':'box_min_z',           'type':'float',  'value':box_min[2], }, 
-                  {'name':'box_max_x',           'type':'float',  'value':box_max[0], }, 
-                  {'name':'box_max_y',           'type':'float',  'value':box_max[1], }, 
-                  {'name':'box_max_z',           'type':'float',  'value':box_max[2], }, 
-                  {'name':'box_n_x',             'type':'uint',   'value':box_n[0],   }, 
-                  {'name':'box_n_y',             'type':'uint',   'value':box_n[1],   }, 
-                  {'name':'box_n_z',             'type':'uint',   'value':box_n[2],   }, ]
-    r = call_c_function( niftyrec_c.TR_grid_from_box_and_affine, descriptor ) 
-    if not r.status == status_success(): 
+    if affine_box2grid is None:
+        affine_box2grid=numpy.eye(4,dtype=float32)
+    grid = numpy.zeros((box_n[0],box_n[1],box_n[2],3),dtype=float32,order="F")
+    r = _TR_grid_from_box_and_affine(grid=grid, affine_box2grid=affine_box2grid,
+                                     box_min_x=box_min[0], box_min_y=box_min[1], box_min_z=box_min[2],
+                                     box_max_x=box_max[0], box_max_y=box_max[1], box_max_z=box_max[2],
+                                     box_n_x=box_n[0], box_n_y=box_n[1], box_n_z=box_n[2])
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'TR_grid_from_box_and_affine' was unsuccessful.",r.status,'niftyrec_c.TR_grid_from_box_and_affine')
-    return r.dictionary['grid']  
-
-
-def TR_resample_grid(image_array, grid_array, affine_index2grid=None, background=0.0, use_gpu=1, interpolation_mode=INTERPOLATION_LINEAR): 
-    """Resample the image at locations specified by grid_array (array of 3D locations) and given the affine transformation that maps 
-    image array indexes to grid coordinates.  """
-    if affine_index2grid is None: 
-        affine_index2grid=numpy.eye(4,dtype=float32) 
-    resampled_shape = numpy.asarray([grid_array.shape[0],grid_array.shape[1],grid_array.shape[2]])
-    descriptor = [{'name':'resampled_array',     'type':'array',  'value':None,                       'dtype':float32,   'size':(resampled_shape[0],resampled_shape[1],resampled_shape[2]),   'order':"F"    }, 
-                  {'name':'image_array',         'type':'array',  'value':image_array,                'dtype':float32}, 
-                  {'name':'affine',              'type':'array',  'value':affine_index2grid,          'dtype':float32}, 
-                  {'name':'grid_array',          'type':'array',  'value':grid_array,                 'dtype':float32},     
-                  {'name':'Nx',                  'type':'uint',   'value':image_array.shape[0]}, 
-                  {'name':'Ny',                  'type':'uint',   'value':image_array.shape[1]}, 
-                  {'name':'Nz',                  'type':'uint',   'value':image_array.shape[2]}, 
-                  {'name':'Nx_grid',             'type':'uint',   'value':resampled_shape[0]}, 
-                  {'name':'Ny_grid',             'type':'uint',   'value':resampled_shape[1]}, 
-                  {'name':'Nz_grid',             'type':'uint',   'value':resampled_shape[2]}, 
-                  {'name':'background',          'type':'float',  'value':background}, 
-                  {'name':'use_gpu',             'type':'uint',   'value':numpy.uint32(use_gpu)},
-                  {'name':'interpolation_mode',  'type':'uint',   'value':numpy.uint32(interpolation_mode)},
-                   ]
-    r = call_c_function( niftyrec_c.TR_resample_grid, descriptor ) 
-    if not r.status == status_success(): 
+    return r.dictionary['grid']
+
+
+def TR_resample_grid(image_array, grid_array, affine_index2grid=None, background=0.0, use_gpu=1, interpolation_mode=INTERPOLATION_LINEAR, out=None):
+    """Resample the image at locations specified by grid_array (array of 3D locations) and given the affine transformation that maps
+    image array indexes to grid coordinates. The resampled image is written in 'out', if given. """
+    if affine_index2grid is None:
+        affine_index2grid=numpy.eye(4,dtype=float32)
+    resampled_shape = (grid_array.shape[0],grid_array.shape[1],grid_array.shape[2])
+    resampled_array = output_array(resampled_shape,float32,"F",out)
+    if _use_numpy_engine(use_gpu): 
+        return TR_resample_grid_cpu(image_array, grid_array, affine_index2grid, background, interpolation_mode, out=resampled_array)
+    r = _TR_resample_grid(resampled_array=resampled_array, image_array=image_array, affine=affine_index2grid, grid_array=grid_array,
+                          Nx=image_array.shape[0], Ny=image_array.shape[1], Nz=image_array.shape[2],
+                          Nx_grid=resampled_shape[0], Ny_grid=resampled_shape[1], Nz_grid=resampled_shape[2],
+                          background=background, use_gpu=numpy.uint32(use_gpu), interpolation_mode=numpy.uint32(interpolation_mode))
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'TR_resample_grid' was unsuccessful.",r.status,'niftyrec_c.TR_resample_grid')
     return r.dictionary['resampled_array']
-    
 
-def TR_resample_box(image_array, box_min, box_max, box_n, affine_index2grid=None, background=0, use_gpu=1, interpolation_mode=INTERPOLATION_LINEAR): 
-    pass 
-    
+
+def TR_resample_box(image_array, box_min, box_max, box_n, affine_index2grid=None, background=0, use_gpu=1, interpolation_mode=INTERPOLATION_LINEAR):
+    pass
+
 def TR_gradient_grid(image_array, grid_array, affine_index2grid=None, background=0, use_gpu=1, interpolation_mode=INTERPOLATION_LINEAR):
-    pass 
-    
+    pass
+
 def TR_gradient_box(image_array, box_min, box_max, box_n, affine_index2grid=None, background=0, use_gpu=1, interpolation_mode=INTERPOLATION_LINEAR):
-    pass 
-
-
-def TR_transform_grid(grid_array, affine_from_grid, use_gpu=1): 
-    """Transform 3D grid according to affine transformation. """
-    if affine_from_grid  is None: 
-        affine_from_grid = numpy.eye(4,dtype=float32) 
-    descriptor = [{'name':'transformed_array',   'type':'array',  'value':None,                       'dtype':float32,   'size':(grid_array.shape[0],grid_array.shape[1],grid_array.shape[2],3),   'order':"F"    }, 
-                  {'name':'grid_array',          'type':'array',  'value':grid_array,                 'dtype':float32},     
-                  {'name':'Nx',                  'type':'uint',   'value':grid_array.shape[0]}, 
-                  {'name':'Ny',                  'type':'uint',   'value':grid_array.shape[1]}, 
-                  {'name':'Nz',                  'type':'uint',   'value':grid_array.shape[2]}, 
-                  {'name':'affine',              'type':'array',  'value':affine_from_grid,           'dtype':float32}, 
-                  {'name':'use_gpu',             'type':'uint',   'value':numpy.uint32(use_gpu)}, ]
-    r = call_c_function( niftyrec_c.TR_transform_grid, descriptor ) 
-    if not r.status == status_success(): 
+    pass
+
+
+def TR_transform_grid(grid_array, affine_from_grid, use_gpu=1, out=None):
+    """Transform 3D grid according to affine transformation. The transformed grid is written in 'out', if given. """
+    if affine_from_grid  is None:
+        affine_from_grid = numpy.eye(4,dtype=float32)
+    transformed_array = output_array((grid_array.shape[0],grid_array.shape[1],grid_array.shape[2],3),float32,"F",out)
+    r = _TR_transform_grid(transformed_array=transformed_array, grid_array=grid_array,
+                           Nx=grid_array.shape[0], Ny=grid_array.shape[1], Nz=grid_array.shape[2],
+                           affine=affine_from_grid, use_gpu=numpy.uint32(use_gpu))
+    if r.status != status_codes.success:
         raise ErrorInCFunction("The execution of 'TR_transform_grid' was unsuccessful.",r.status,'niftyrec_c.TR_transform_grid')
-    return r.dictionary['transformed_array'] 
+    return r.dictionary['transformed_array']
 
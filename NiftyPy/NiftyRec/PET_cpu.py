@@ -0,0 +1,179 @@
+
+# NiftyRec - Ray-tracing tools
+# Stefano Pedemonte
+# Center for Medical Image Computing (CMIC), University College Lonson (UCL)
+# 2009-2012, London
+# Aalto University, School of Science
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH
+# Jan. 2014, Boston
+
+# NumPy implementation of the PET projector and backprojector for compressed projection data.
+#
+# Geometry (same as PET_project_compressed): the projection is a set of parallel projections, one for
+# each pair of angles (azimuthal, axial). For angles (phi, theta) the lines of response have direction
+#     d = (cos(theta)cos(phi), cos(theta)sin(phi), sin(theta))
+# and the detector plane, through the origin, has axes u = (-sin(phi), cos(phi), 0) and v = d x u.
+# The detector has N_u x N_v bins and extent size_u x size_v (mm), centered at the origin.
+# The compressed data lists only some of the bins: the bins of the angle pair with linear index
+# k = azimuthal + N_azimuthal*axial start at offsets[azimuthal,axial] in 'locations' (3,N_locations), whose
+# first two rows are the (u,v) indexes of each bin (the third row is not used by the projector).
+# Angle pairs with active[azimuthal,axial]==0 are skipped.
+# Each line is sampled at N_samples points, sample_step (mm) apart, centered on the detector plane.
+# The activity (attenuation) volume has N voxels and extent 'size' (mm), it is centered at the origin, rotated by
+# R = Rz*Ry*Rx (angles R_x, R_y, R_z) and translated by T. The attenuation is in 1/mm; the projection of
+# a line is the line integral of the activity times exp(-line integral of the attenuation).
+# The lines are processed in chunks of 'chunk_size' lines, so that the memory is bounded: the geometry of the lines
+# (angle pair, direction, detector axes) is computed per chunk from tables of one entry per angle pair.
+# 'direction' and 'block_size' configure the GPU kernels of the C library and are not used here.
+# The backprojector is the exact adjoint of the projector (for background=0).
+
+import numpy
+from .Interpolation import rotation_matrix, trilinear_gather, trilinear_scatter
+from .Compression import pair_ranges
+
+__all__ = ['PET_project_compressed_cpu','PET_backproject_compressed_cpu']
+
+CHUNK_SAMPLES = 2**22
+
+
+class CompressedGeometry(object):
+    """Lines of response of compressed PET projection data. Only the tables of the angle pairs are stored; the
+    geometry of the lines is computed chunk by chunk, hence the memory does not depend on the number of locations. """
+    def __init__(self, offsets, locations, active, angles_axial, angles_azimuthal, N_u, N_v, size_u, size_v, N_samples, sample_step):
+        offsets = numpy.asarray(offsets)
+        N_azimuthal, N_axial = offsets.shape
+        self.locations = locations
+        self.N_locations = locations.shape[1]
+        # pairs sorted by offset: the pair of a location is the last pair that starts at or before it
+        first = pair_ranges(offsets, self.N_locations)[0]
+        self.order = numpy.argsort(first, kind='mergesort')
+        self.starts = first[self.order]
+        if active is None:
+            active = numpy.ones((N_azimuthal,N_axial))
+        self.pair_active = numpy.ravel(numpy.asarray(active), order='F') != 0
+        pairs = numpy.arange(N_azimuthal*N_axial)
+        self.phi   = numpy.asarray(angles_azimuthal, dtype=numpy.float64).ravel()[pairs % N_azimuthal]
+        self.theta = numpy.asarray(angles_axial, dtype=numpy.float64).ravel()[pairs // N_azimuthal]
+        self.N_u, self.N_v = N_u, N_v
+        self.size_u, self.size_v = float(size_u), float(size_v)
+        self.t = (numpy.arange(N_samples, dtype=numpy.float64) - (N_samples-1)/2.0) * sample_step
+        self.sample_step = sample_step
+
+    def chunks(self, chunk_size=None):
+        if chunk_size is None:
+            chunk_size = max(1, CHUNK_SAMPLES // max(1,len(self.t)))
+        for start in range(0, self.N_locations, int(chunk_size)):
+            yield start, min(start+int(chunk_size), self.N_locations)
+
+    def pairs(self, start, stop):
+        """Angle pair (linear index azimuthal + N_azimuthal*axial) of the lines [start,stop). """
+        return self.order[numpy.searchsorted(self.starts, numpy.arange(start, stop), side='right') - 1]
+
+    def active(self, start, stop):
+        """True for the lines [start,stop) of the active angle pairs. """
+        return self.pair_active[self.pairs(start, stop)]
+
+    def points(self, start, stop):
+        """World coordinates (3 arrays of shape (lines,N_samples)) of the samples of the lines [start,stop). """
+        pairs = self.pairs(start, stop)
+        phi, theta = self.phi[pairs], self.theta[pairs]
+        direction = [numpy.cos(theta)*numpy.cos(phi), numpy.cos(theta)*numpy.sin(phi), numpy.sin(theta)]
+        axis_u    = [-numpy.sin(phi), numpy.cos(phi), 0.0]
+        axis_v    = [-direction[2]*axis_u[1], direction[2]*axis_u[0], direction[0]*axis_u[1] - direction[1]*axis_u[0]]
+        u = (numpy.asarray(self.locations[0,start:stop], dtype=numpy.float64) - (self.N_u-1)/2.0) * (self.size_u/self.N_u)
+        v = (numpy.asarray(self.locations[1,start:stop], dtype=numpy.float64) - (self.N_v-1)/2.0) * (self.size_v/self.N_v)
+        points = []
+        for k in range(3):
+            base = u*axis_u[k] + v*axis_v[k]
+            points.append( base[:,None] + direction[k][:,None]*self.t[None,:] )
+        return points
+
+
+def volume_coordinates(points, N, size, T, R):
+    """Voxel indexes of world points, for a volume of N voxels and extent 'size' (mm), rotated by the angles R
+    and translated by T. """
+    M = rotation_matrix(R[0], R[1], R[2]).T
+    p = [points[k] - T[k] for k in range(3)]
+    coordinates = []
+    for k in range(3):
+        q = M[k,0]*p[0] + M[k,1]*p[1] + M[k,2]*p[2]
+        voxel = float(size[k]) / N[k]
+        coordinates.append( ((q + size[k]/2.0) / voxel - 0.5).astype(numpy.float32) )
+    return coordinates
+
+
+def _attenuation_factors(points, attenuation, attenuation_size, T_attenuation, R_attenuation, background_attenuation, sample_step):
+    if attenuation is None:
+        return None
+    c = volume_coordinates(points, attenuation.shape, attenuation_size, T_attenuation, R_attenuation)
+    integral = trilinear_gather(attenuation, c[0], c[1], c[2], background_attenuation).sum(axis=1) * sample_step
+    return numpy.exp(-integral)
+
+
+def PET_project_compressed_cpu(activity, attenuation, offsets, locations, active,
+N_axial, N_azimuthal, angles_axial, angles_azimuthal, N_u, N_v, size_u, size_v,
+activity_size_x, activity_size_y, activity_size_z, attenuation_size_x, attenuation_size_y, attenuation_size_z,
+T_activity_x, T_activity_y, T_activity_z, R_activity_x, R_activity_y, R_activity_z,
+T_attenuation_x, T_attenuation_y, T_attenuation_z, R_attenuation_x, R_attenuation_y, R_attenuation_z,
+use_gpu, N_samples, sample_step, background, background_attenuation, truncate_negative_values, direction=0, block_size=0, out=None, chunk_size=None):
+    """PET projection; output projection data is compressed; NumPy engine. Same arguments as PET_project_compressed.
+    'chunk_size' is the number of lines processed at once. """
+    activity = numpy.asarray(activity, dtype=numpy.float32)
+    if truncate_negative_values:
+        activity = numpy.maximum(activity, 0)
+    if attenuation is not None and attenuation.size == 0:
+        attenuation = None
+    geometry = CompressedGeometry(offsets, locations, active, angles_axial, angles_azimuthal, N_u, N_v, size_u, size_v, N_samples, sample_step)
+    if out is None:
+        out = numpy.zeros((geometry.N_locations,), dtype=numpy.float32)
+    activity_size = (activity_size_x, activity_size_y, activity_size_z)
+    T_activity, R_activity = (T_activity_x, T_activity_y, T_activity_z), (R_activity_x, R_activity_y, R_activity_z)
+    attenuation_size = (attenuation_size_x, attenuation_size_y, attenuation_size_z)
+    T_attenuation, R_attenuation = (T_attenuation_x, T_attenuation_y, T_attenuation_z), (R_attenuation_x, R_attenuation_y, R_attenuation_z)
+    for start, stop in geometry.chunks(chunk_size):
+        points = geometry.points(start, stop)
+        c = volume_coordinates(points, activity.shape, activity_size, T_activity, R_activity)
+        values = trilinear_gather(activity, c[0], c[1], c[2], background).sum(axis=1) * sample_step
+        factors = _attenuation_factors(points, attenuation, attenuation_size, T_attenuation, R_attenuation, background_attenuation, sample_step)
+        if factors is not None:
+            values *= factors
+        values[~geometry.active(start, stop)] = 0
+        out[start:stop] = values
+    return out
+
+
+def PET_backproject_compressed_cpu(projection_data, attenuation, offsets, locations, active,
+N_axial, N_azimuthal, angles_axial, angles_azimuthal, N_u, N_v, size_u, size_v,
+N_activity_x, N_activity_y, N_activity_z,
+activity_size_x, activity_size_y, activity_size_z,
+attenuation_size_x, attenuation_size_y, attenuation_size_z,
+T_activity_x, T_activity_y, T_activity_z, R_activity_x, R_activity_y, R_activity_z,
+T_attenuation_x, T_attenuation_y, T_attenuation_z, R_attenuation_x, R_attenuation_y, R_attenuation_z,
+use_gpu, N_samples, sample_step, background, background_attenuation, direction=0, block_size=0, out=None, chunk_size=None):
+    """PET back-projection; input projection data is compressed; NumPy engine. Same arguments as PET_backproject_compressed.
+    Adjoint of PET_project_compressed_cpu; 'background' only applies to the projector. The result is accumulated in 'out', if given. """
+    projection_data = numpy.asarray(projection_data, dtype=numpy.float32).ravel()
+    if attenuation is not None and attenuation.size == 0:
+        attenuation = None
+    geometry = CompressedGeometry(offsets, locations, active, angles_axial, angles_azimuthal, N_u, N_v, size_u, size_v, N_samples, sample_step)
+    shape = (int(N_activity_x), int(N_activity_y), int(N_activity_z))
+    if out is None:
+        out = numpy.zeros(shape, dtype=numpy.float32, order="F")
+    activity_size = (activity_size_x, activity_size_y, activity_size_z)
+    T_activity, R_activity = (T_activity_x, T_activity_y, T_activity_z), (R_activity_x, R_activity_y, R_activity_z)
+    attenuation_size = (attenuation_size_x, attenuation_size_y, attenuation_size_z)
+    T_attenuation, R_attenuation = (T_attenuation_x, T_attenuation_y, T_attenuation_z), (R_attenuation_x, R_attenuation_y, R_attenuation_z)
+    for start, stop in geometry.chunks(chunk_size):
+        values = projection_data[start:stop] * geometry.active(start, stop) * numpy.float32(sample_step)
+        if not numpy.any(values):
+            continue
+        points = geometry.points(start, stop)
+        factors = _attenuation_factors(points, attenuation, attenuation_size, T_attenuation, R_attenuation, background_attenuation, sample_step)
+        if factors is not None:
+            values = values * factors
+        c = volume_coordinates(points, shape, activity_size, T_activity, R_activity)
+        samples = numpy.empty(c[0].shape, dtype=numpy.float32)
+        samples[...] = values[:,None]
+        trilinear_scatter(samples, c[0], c[1], c[2], shape, out=out)
+    return out
@@ -0,0 +1,133 @@
+
+# NiftyRec - Ray-tracing tools
+# Stefano Pedemonte
+# Center for Medical Image Computing (CMIC), University College Lonson (UCL)
+# 2009-2012, London
+# Aalto University, School of Science
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH
+# Jan. 2014, Boston
+
+# MLEM / OSEM reconstruction on top of the NiftyRec projectors. The system is any object with the interface
+# of SPECT_subsets and PET_compressed_subsets: N_subsets, project(activity,subset,out) and
+# backproject(projection,subset,out). MLEM is OSEM with one subset. If the system provides indexes(subset), the
+# indexes of the views (third axis of the projection, e.g. the cameras of SPECT_subsets) of a subset, the ratio
+# of the measurement to the projection is computed on the views of the subset only.
+# The work arrays (projection, ratio, update) are allocated once and every update is done in place;
+# the sensitivity image of each subset is computed once, when the reconstruction is created, or read from the
+# disk cache if the system provides sensitivity(subset,shape,cache) and a cache is active.
+
+import time
+import numpy
+from numpy import float32
+from ..DiskCache import get_disk_cache
+
+__all__ = ['OSEM_reconstruction']
+
+EPSILON = 1e-9
+
+
+class OSEM_reconstruction(object):
+    """Ordered-subsets expectation maximisation. 'system' provides the projector and the backprojector of each
+    subset, 'measurement' is the full measured projection and 'shape' the shape of the activity.
+    'activity' is the initial activity (default: uniform 1), updated in place. 'cache' is the DiskCache of the
+    sensitivity images (default: the active disk cache). """
+    def __init__(self, system, measurement, shape=None, activity=None, epsilon=EPSILON, cache=None):
+        self.system = system
+        self.cache = cache if cache is not None else get_disk_cache()
+        self.epsilon = epsilon
+        self.measurement = numpy.asarray(measurement, dtype=float32)
+        if activity is None:
+            if shape is None:
+                raise ValueError("Either 'shape' or the initial 'activity' must be given. ")
+            activity = numpy.ones(shape, dtype=float32, order="F")
+        elif activity.dtype != float32 or not activity.flags.f_contiguous:
+            activity = numpy.asfortranarray(activity, dtype=float32)
+        self.activity = activity
+        self.shape = activity.shape
+        # work arrays, reused at every subset and every iteration
+        self._projection = numpy.zeros(self.measurement.shape, dtype=float32, order="F")
+        self._ratio      = numpy.zeros(self.measurement.shape, dtype=float32, order="F")
+        self._update     = numpy.zeros(self.shape, dtype=float32, order="F")
+        self._previous   = numpy.zeros(self.shape, dtype=float32, order="F")
+        self._views = self._subset_views()
+        self.inverse_sensitivity = self._sensitivities()
+        self.iteration = 0
+        self.history = []
+
+    def _sensitivities(self):
+        # 1/sensitivity of each subset, 0 where the sensitivity is 0 (voxels not seen by the subset stay unchanged)
+        self._ratio[...] = 1
+        inverse = []
+        cached = self.cache is not None and hasattr(self.system, 'sensitivity')
+        for subset in range(self.system.N_subsets):
+            if cached:
+                sensitivity = numpy.array(self.system.sensitivity(subset, self.shape, cache=self.cache), dtype=float32, order="F")
+            else:
+                sensitivity = numpy.zeros(self.shape, dtype=float32, order="F")
+                self.system.backproject(self._ratio, subset, out=sensitivity)
+            seen = sensitivity > self.epsilon
+            sensitivity[seen] = 1.0 / sensitivity[seen]
+            sensitivity[~seen] = 0
+            inverse.append(sensitivity)
+        return inverse
+
+    def _subset_views(self):
+        # views of each subset: a slice of the third axis of the projection when the indexes are consecutive, the
+        # indexes otherwise; None for the systems that do not provide indexes(subset) (every view is used)
+        if not hasattr(self.system, 'indexes'):
+            return [None] * self.system.N_subsets
+        views = []
+        for subset in range(self.system.N_subsets):
+            indexes = numpy.asarray(self.system.indexes(subset))
+            if len(indexes) and numpy.all(numpy.diff(indexes) == 1):
+                views.append((slice(None), slice(None), slice(int(indexes[0]), int(indexes[-1])+1)))
+            else:
+                views.append((slice(None), slice(None), indexes))
+        return views
+
+    def subset_update(self, subset):
+        """One OSEM update of the activity (in place) with the given subset. """
+        self.system.project(self.activity, subset, out=self._projection)
+        views = self._views[subset]
+        if views is None:
+            numpy.maximum(self._projection, self.epsilon, out=self._projection)
+            numpy.divide(self.measurement, self._projection, out=self._ratio)
+        elif isinstance(views[2], slice):
+            projection = self._projection[views]
+            numpy.maximum(projection, self.epsilon, out=projection)
+            numpy.divide(self.measurement[views], projection, out=self._ratio[views])
+        else:
+            self._ratio[views] = self.measurement[views] / numpy.maximum(self._projection[views], self.epsilon)
+        self.system.backproject(self._ratio, subset, out=self._update)
+        self.activity *= self._update
+        self.activity *= self.inverse_sensitivity[subset]
+        return self.activity
+
+    def change(self):
+        """Relative change of the activity in the last iteration: |x_new - x_old| / |x_old|. """
+        norm = numpy.sqrt(numpy.vdot(self._previous, self._previous))
+        numpy.subtract(self.activity, self._previous, out=self._previous)
+        change = numpy.sqrt(numpy.vdot(self._previous, self._previous))
+        return float(change / norm) if norm > 0 else float('inf')
+
+    def iterate(self, N_iterations=1, tolerance=None, callback=None):
+        """Run up to N_iterations iterations (each visits all the subsets). If 'tolerance' is given, stop when the
+        relative change of the activity falls below it. callback(reconstruction, record) is called after each
+        iteration. Returns the activity; the timing of each iteration is in self.history. """
+        for i in range(N_iterations):
+            t0 = time.time()
+            self._previous[...] = self.activity
+            for subset in range(self.system.N_subsets):
+                self.subset_update(subset)
+            elapsed = time.time() - t0
+            self.iteration += 1
+            change = self.change()
+            record = {'iteration':self.iteration, 'time':elapsed, 'subsets':self.system.N_subsets,
+                      'time_per_subset':elapsed/self.system.N_subsets, 'change':change}
+            self.history.append(record)
+            if callback is not None:
+                callback(self, record)
+            if tolerance is not None and change < tolerance:
+                break
+        return self.activity
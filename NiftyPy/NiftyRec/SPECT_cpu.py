@@ -0,0 +1,172 @@
+
+# NiftyRec - Ray-tracing tools
+# Stefano Pedemonte
+# Center for Medical Image Computing (CMIC), University College Lonson (UCL)
+# 2009-2012, London
+# Aalto University, School of Science
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH
+# Jan. 2014, Boston
+
+# NumPy implementation of the SPECT parallel-holes projector and backprojector, for hosts where the
+# NiftyRec C library is not available. Same algorithm as the C library: for each camera the activity
+# (and the attenuation) is rotated about the center of the volume, each plane parallel to the detector
+# is convolved with the depth-dependent psf, and the planes are summed along z, attenuated by the
+# cumulative attenuation between the plane and the detector (the plane z=0 faces the detector).
+# The cameras are processed in batches, so that the memory is bounded by 'batch_voxels'.
+# A stack of activities (Nx,Ny,Nz,N_frames), e.g. dynamic frames, is projected in one pass: the sampling
+# coordinates, the interpolation weights and the attenuation factors are computed once for all the frames.
+# The backprojector is the exact adjoint of the projector (for background=0).
+
+import numpy
+from .Interpolation import rotation_matrix, affine_coordinates, trilinear_gather, trilinear_scatter
+
+__all__ = ['SPECT_project_parallelholes_cpu','SPECT_backproject_parallelholes_cpu']
+
+BATCH_VOXELS = 2**22
+
+
+def camera_rotations(cameras):
+    """Rotation matrices of the cameras. 'cameras' is (N,1), angle about the x axis, or (N,3), angles
+    about the x, y and z axes (radians). """
+    cameras = numpy.asarray(cameras, dtype=numpy.float64)
+    if cameras.ndim == 1:
+        cameras = cameras.reshape((-1,1))
+    if cameras.shape[1] == 1:
+        return [rotation_matrix(c[0]) for c in cameras]
+    elif cameras.shape[1] == 3:
+        return [rotation_matrix(c[0],c[1],c[2]) for c in cameras]
+    raise ValueError("'cameras' must have shape (N_cameras,1) or (N_cameras,3), not %s. "%str(cameras.shape))
+
+
+def _batches(N_cameras, shape, batch_voxels):
+    N_voxels = 1
+    for n in shape:
+        N_voxels *= int(n)
+    batch = max(1, int(batch_voxels) // max(1,N_voxels))
+    for start in range(0, N_cameras, batch):
+        yield start, min(start+batch, N_cameras)
+
+
+def _sampling(rotations, shape):
+    # The rotated volume at p is the volume at R^T (p-c) + c, c the center of the volume.
+    center = (numpy.asarray(shape, dtype=numpy.float64) - 1) / 2.0
+    matrices = numpy.asarray([R.T for R in rotations])
+    offsets  = numpy.asarray([center - numpy.dot(R.T, center) for R in rotations])
+    return affine_coordinates(shape, matrices, offsets)
+
+
+def _psf_convolve(planes, psf, adjoint=False):
+    # planes: (...,Nx,Ny,Nz); psf: (Kx,Ky,Nz) or (Kx,Ky), one 2D kernel per plane, centered at (Kx//2,Ky//2).
+    if psf.ndim == 2:
+        psf = psf[:,:,None]
+    nx, ny = planes.shape[-3], planes.shape[-2]
+    cx, cy = psf.shape[0]//2, psf.shape[1]//2
+    result = numpy.zeros_like(planes)
+    for i in range(psf.shape[0]):
+        for j in range(psf.shape[1]):
+            w = psf[i,j,:]
+            if not numpy.any(w):
+                continue
+            di, dj = i - cx, j - cy
+            if adjoint:
+                di, dj = -di, -dj
+            if abs(di) >= nx or abs(dj) >= ny:
+                continue
+            result[..., max(0,-di):nx-max(0,di), max(0,-dj):ny-max(0,dj), :] += w * planes[..., max(0,di):nx-max(0,-di), max(0,dj):ny-max(0,-dj), :]
+    return result
+
+
+def _attenuation_factors(attenuation, coordinates, background_attenuation):
+    attenuation = trilinear_gather(attenuation, coordinates[0], coordinates[1], coordinates[2], background_attenuation)
+    numpy.cumsum(attenuation, axis=3, out=attenuation)
+    return numpy.exp(-attenuation, out=attenuation)
+
+
+def _check(attenuation, psf, shape):
+    if attenuation is not None and attenuation.size == 0:
+        attenuation = None
+    if psf is not None and psf.size == 0:
+        psf = None
+    if attenuation is not None and tuple(attenuation.shape) != tuple(shape):
+        raise ValueError("The attenuation must have the same shape as the activity: %s, not %s. "%(str(tuple(shape)),str(attenuation.shape)))
+    if psf is not None:
+        psf = numpy.asarray(psf, dtype=numpy.float32)
+        if psf.ndim == 3 and psf.shape[2] != shape[2]:
+            raise ValueError("The psf must have one kernel per plane (%d), not %d. "%(shape[2],psf.shape[2]))
+    return attenuation, psf
+
+
+def _frames(array):
+    # View of a volume (or projection) as a stack of one frame.
+    if array.ndim == 3:
+        return array.reshape(array.shape+(1,), order='A')
+    return array
+
+
+def SPECT_project_parallelholes_cpu(activity, cameras, attenuation=None, psf=None, background=0.0, background_attenuation=0.0, truncate_negative_values=0, out=None, batch_voxels=BATCH_VOXELS):
+    """SPECT projection; parallel-holes geometry; NumPy engine. Same arguments and output as SPECT_project_parallelholes:
+    the projection has shape (Nx,Ny,N_cameras), or (Nx,Ny,N_cameras,N_frames) for a stack of activities (Nx,Ny,Nz,N_frames).
+    'batch_voxels' bounds the number of voxels processed at once. """
+    activity = numpy.asarray(activity, dtype=numpy.float32)
+    if truncate_negative_values:
+        activity = numpy.maximum(activity, 0)
+    stack = _frames(activity)
+    shape = stack.shape[0:3]
+    attenuation, psf = _check(attenuation, psf, shape)
+    rotations = camera_rotations(cameras)
+    N_cameras = len(rotations)
+    if out is None:
+        out = numpy.zeros((shape[0],shape[1],N_cameras)+activity.shape[3:], dtype=numpy.float32, order="F")
+    projection = _frames(out)
+    for start, stop in _batches(N_cameras, stack.shape, batch_voxels):
+        coordinates = _sampling(rotations[start:stop], shape)
+        planes = trilinear_gather(stack, coordinates[0], coordinates[1], coordinates[2], background)
+        if psf is not None:
+            planes = _psf_convolve(planes, psf)
+        if attenuation is not None:
+            planes *= _attenuation_factors(attenuation, coordinates, background_attenuation)
+        projection[:,:,start:stop,:] = planes.sum(axis=4).transpose(2,3,1,0)
+    return out
+
+
+def SPECT_backproject_parallelholes_cpu(projection, cameras, attenuation=None, psf=None, background=0.0, background_attenuation=0.0, truncate_negative_values=0, out=None, shape=None, batch_voxels=BATCH_VOXELS):
+    """SPECT backprojection; parallel-holes geometry; NumPy engine. Adjoint of SPECT_project_parallelholes_cpu.
+    The backprojection has the shape of the attenuation, if given, else 'shape', else the shape used by
+    SPECT_backproject_parallelholes: (Nx,Ny,Nx). A stack of projections (Nx,Ny,N_cameras,N_frames) gives a stack
+    of backprojections. Voxels that are not seen by a camera receive 'background' for that camera.
+    The backprojection is accumulated in 'out', if given. """
+    projection = numpy.asarray(projection, dtype=numpy.float32)
+    if truncate_negative_values:
+        projection = numpy.maximum(projection, 0)
+    if shape is None:
+        if attenuation is not None and attenuation.size != 0:
+            shape = attenuation.shape
+        else:
+            shape = (projection.shape[0], projection.shape[1], projection.shape[0])
+    shape = tuple([int(s) for s in shape[0:3]])
+    attenuation, psf = _check(attenuation, psf, shape)
+    rotations = camera_rotations(cameras)
+    N_cameras = len(rotations)
+    if projection.shape[2] != N_cameras:
+        raise ValueError("The projection has %d views but %d cameras were given. "%(projection.shape[2],N_cameras))
+    stack = _frames(projection)
+    N_frames = stack.shape[3]
+    if out is None:
+        out = numpy.zeros(shape+projection.shape[3:], dtype=numpy.float32, order="F")
+    backprojection = _frames(out)
+    for start, stop in _batches(N_cameras, shape+(N_frames,), batch_voxels):
+        coordinates = _sampling(rotations[start:stop], shape)
+        planes = numpy.empty((N_frames,stop-start)+shape, dtype=numpy.float32)
+        planes[...] = stack[:,:,start:stop,:].transpose(3,2,0,1)[:,:,:,:,None]
+        if attenuation is not None:
+            planes *= _attenuation_factors(attenuation, coordinates, background_attenuation)
+        if psf is not None:
+            planes = _psf_convolve(planes, psf, adjoint=True)
+        trilinear_scatter(planes, coordinates[0], coordinates[1], coordinates[2], shape+(N_frames,), out=backprojection)
+        if background:
+            ones = numpy.ones((1,)+shape, dtype=numpy.float32)
+            for b in range(stop-start):
+                seen = trilinear_scatter(ones, coordinates[0][b:b+1], coordinates[1][b:b+1], coordinates[2][b:b+1], shape)
+                backprojection[seen == 0] += background
+    return out
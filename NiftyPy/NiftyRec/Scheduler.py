@@ -0,0 +1,274 @@
+
+# NiftyRec - Ray-tracing tools
+# Stefano Pedemonte
+# Center for Medical Image Computing (CMIC), University College Lonson (UCL)
+# 2009-2012, London
+# Aalto University, School of Science
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH
+# Jan. 2014, Boston
+
+# Scheduler of the projectors over several workers. A projection is split into shards: ranges of cameras for
+# SPECT, ranges of locations (whole angle pairs) for compressed PET. Each worker is a thread pinned to a device:
+# a GPU, bound to the thread of the worker with gpu_bind (the GPU selection of the C library is per host
+# thread), or the CPU (use_gpu=0). The workers take the shards from a shared queue, hence faster devices
+# process more shards. The projections of the shards are written into disjoint slices of the output; the
+# backprojections are accumulated in one partial volume per worker, and the partial volumes are summed in place
+# into the output (the first worker accumulates straight into the output). The partial volumes are reused
+# across calls. A CPU-only scheduler is the thread pool of the wrappers with use_gpu=0 (set_cpu_threads):
+# ctypes releases the GIL during the calls to the C library, hence the shards run concurrently.
+
+import threading
+import multiprocessing
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+import numpy
+from numpy import float32
+from ..Buffers import output_array
+from .Compression import location_chunks, chunk_structure
+from .NiftyRec import gpu_bind, SPECT_project_parallelholes, SPECT_backproject_parallelholes, PET_project_compressed, PET_backproject_compressed
+
+__all__ = ['Scheduler','CPU']
+
+CPU = None
+_local = threading.local()
+
+
+def in_worker():
+    """True in the threads of the workers of a Scheduler. """
+    return getattr(_local, 'worker', None) is not None
+
+
+class _Task(object):
+    def __init__(self, function, args):
+        self.function = function
+        self.args = args
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _Worker(threading.Thread):
+    def __init__(self, device, tasks):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.device = device
+        self.use_gpu = 0 if device is CPU else 1
+        self.tasks = tasks
+        self.partials = {}
+        self.spare = {}
+        self.error = None
+        self.ready = threading.Event()
+
+    def run(self):
+        _local.worker = self
+        try:
+            if self.device is not CPU:
+                gpu_bind(self.device)
+        except Exception as e:
+            self.error = e
+        self.ready.set()
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                break
+            try:
+                if self.error is not None:
+                    raise self.error
+                task.result = task.function(self, *task.args)
+            except Exception as e:
+                task.error = e
+            task.done.set()
+
+    def buffer(self, shape):
+        """Zeroed volume of this worker, reused across calls. """
+        buf = self.spare.pop(shape, None)
+        if buf is None:
+            return numpy.zeros(shape, dtype=float32, order="F")
+        buf[...] = 0
+        return buf
+
+    def release(self, buf):
+        self.spare[buf.shape] = buf
+
+
+class Scheduler(object):
+    """Pool of workers, one per entry of 'devices': a GPU id or CPU (None). By default, N_workers CPU workers
+    (default: the number of processors). The projections are split in N_workers*shards_per_worker shards or,
+    if 'shard_size' is given, in shards of shard_size cameras (SPECT) or locations (PET). """
+    def __init__(self, devices=None, N_workers=None, shards_per_worker=1, shard_size=None):
+        if devices is None:
+            if N_workers is None:
+                N_workers = multiprocessing.cpu_count()
+            devices = [CPU] * N_workers
+        self.devices = list(devices)
+        self.shards_per_worker = shards_per_worker
+        self.shard_size = shard_size
+        self._tasks = queue.Queue()
+        self._workers = [_Worker(device, self._tasks) for device in self.devices]
+        self._calls = 0
+        self._owners = {}
+        self._lock = threading.Lock()
+        for worker in self._workers:
+            worker.start()
+        for worker in self._workers:
+            worker.ready.wait()
+            if worker.error is not None:
+                self.close()
+                raise worker.error
+
+    in_worker = staticmethod(in_worker)
+
+    @property
+    def N_workers(self):
+        return len(self._workers)
+
+    def close(self):
+        """Stop the workers. """
+        for worker in self._workers:
+            self._tasks.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def map(self, function, arguments):
+        """Run function(worker, *args) for each tuple of arguments on the workers; returns the results, in order. """
+        if not self._workers:
+            raise RuntimeError("The scheduler has been closed. ")
+        tasks = [_Task(function, args) for args in arguments]
+        for task in tasks:
+            self._tasks.put(task)
+        for task in tasks:
+            task.done.wait()
+        for task in tasks:
+            if task.error is not None:
+                raise task.error
+        return [task.result for task in tasks]
+
+    def _N_shards(self, N, N_shards):
+        if N_shards is not None:
+            return N_shards
+        if self.shard_size is not None:
+            return -(-N // int(self.shard_size))
+        return self.N_workers * self.shards_per_worker
+
+    def _begin(self, out):
+        # New reduction into 'out' (zeroed by output_array); returns its key.
+        with self._lock:
+            self._calls += 1
+            self._owners[self._calls] = None
+            return self._calls
+
+    def _partial(self, worker, key, out):
+        # Volume where 'worker' accumulates its shards: 'out' for the first worker, else a partial volume.
+        with self._lock:
+            if self._owners[key] is None:
+                self._owners[key] = worker
+        if self._owners[key] is worker:
+            return out
+        partial = worker.partials.get(key)
+        if partial is None:
+            partial = worker.partials[key] = worker.buffer(out.shape)
+        return partial
+
+    def _reduce(self, key, out):
+        # Sum the partial volumes of the workers into 'out', in place.
+        with self._lock:
+            del self._owners[key]
+        for worker in self._workers:
+            partial = worker.partials.pop(key, None)
+            if partial is not None:
+                out += partial
+                worker.release(partial)
+        return out
+
+    #### SPECT: ####
+
+    def shards(self, N, N_shards=None):
+        """Ranges [start,stop) that split N items in N_shards shards. """
+        N_shards = max(1, min(N, self._N_shards(N, N_shards)))
+        bounds = numpy.linspace(0, N, N_shards+1).round().astype(int)
+        return [(int(bounds[i]), int(bounds[i+1])) for i in range(N_shards) if bounds[i+1] > bounds[i]]
+
+    def SPECT_project_parallelholes(self, activity, cameras, attenuation=None, psf=None, background=0.0, background_attenuation=0.0,
+                                    truncate_negative_values=0, out=None, N_shards=None):
+        """SPECT projection (see SPECT_project_parallelholes), sharded by cameras over the workers. """
+        cameras = numpy.asfortranarray(cameras, dtype=float32)
+        projection = output_array((activity.shape[0],activity.shape[1],cameras.shape[0])+activity.shape[3:],float32,"F",out)
+        def project(worker, start, stop):
+            # the slices of a stack of projections are not contiguous: the frames are projected in a buffer
+            chunk = projection[:,:,start:stop] if projection.ndim == 3 else worker.buffer(projection[:,:,start:stop].shape)
+            SPECT_project_parallelholes(activity, cameras[start:stop], attenuation, psf, background, background_attenuation,
+                                        worker.use_gpu, truncate_negative_values, out=chunk)
+            if projection.ndim != 3:
+                projection[:,:,start:stop] = chunk
+                worker.release(chunk)
+        self.map(project, self.shards(cameras.shape[0], N_shards))
+        return projection
+
+    def SPECT_backproject_parallelholes(self, projection, cameras, attenuation=None, psf=None, background=0.0, background_attenuation=0.0,
+                                        truncate_negative_values=0, out=None, N_shards=None):
+        """SPECT backprojection (see SPECT_backproject_parallelholes), sharded by cameras over the workers. """
+        cameras = numpy.asfortranarray(cameras, dtype=float32)
+        shape = (projection.shape[0],projection.shape[1],projection.shape[0])+projection.shape[3:]
+        backprojection = output_array(shape,float32,"F",out)
+        key = self._begin(backprojection)
+        def backproject(worker, start, stop):
+            partial = self._partial(worker, key, backprojection)
+            chunk = worker.buffer(shape)
+            SPECT_backproject_parallelholes(projection[:,:,start:stop], cameras[start:stop], attenuation, psf, background,
+                                            background_attenuation, worker.use_gpu, truncate_negative_values, out=chunk)
+            partial += chunk
+            worker.release(chunk)
+        try:
+            self.map(backproject, self.shards(cameras.shape[0], N_shards))
+        finally:
+            self._reduce(key, backprojection)
+        return backprojection
+
+    #### PET: ####
+
+    def _PET_shards(self, offsets, locations, N_shards):
+        N_locations = locations.shape[1]
+        N_shards = self._N_shards(N_locations, N_shards)
+        return list(location_chunks(offsets, N_locations, max(1, -(-N_locations // N_shards))))
+
+    def PET_project_compressed(self, activity, out=None, N_shards=None, **parameters):
+        """PET projection (see PET_project_compressed, keyword arguments), sharded by locations over the workers. """
+        offsets, locations, active = parameters.pop('offsets'), parameters.pop('locations'), parameters.pop('active', None)
+        parameters.pop('use_gpu', None)
+        projection = output_array((locations.shape[1],),float32,"C",out)
+        def project(worker, start, stop):
+            o, l, a = chunk_structure(offsets, locations, active, start, stop)
+            PET_project_compressed(activity, offsets=o, locations=l, active=a, use_gpu=worker.use_gpu, out=projection[start:stop], **parameters)
+        self.map(project, self._PET_shards(offsets, locations, N_shards))
+        return projection
+
+    def PET_backproject_compressed(self, projection_data, out=None, N_shards=None, **parameters):
+        """PET backprojection (see PET_backproject_compressed, keyword arguments), sharded by locations over the workers. """
+        offsets, locations, active = parameters.pop('offsets'), parameters.pop('locations'), parameters.pop('active', None)
+        parameters.pop('use_gpu', None)
+        shape = (parameters['N_activity_x'],parameters['N_activity_y'],parameters['N_activity_z'])
+        backprojection = output_array(shape,float32,"F",out)
+        projection_data = numpy.asarray(projection_data, dtype=float32).reshape(-1)
+        key = self._begin(backprojection)
+        def backproject(worker, start, stop):
+            o, l, a = chunk_structure(offsets, locations, active, start, stop)
+            partial = self._partial(worker, key, backprojection)
+            chunk = worker.buffer(shape)
+            PET_backproject_compressed(projection_data[start:stop], offsets=o, locations=l, active=a, use_gpu=worker.use_gpu, out=chunk, **parameters)
+            partial += chunk
+            worker.release(chunk)
+        try:
+            self.map(backproject, self._PET_shards(offsets, locations, N_shards))
+        finally:
+            self._reduce(key, backprojection)
+        return backprojection
@@ -0,0 +1,67 @@
+
+# NiftyRec - Ray-tracing tools
+# Stefano Pedemonte
+# Center for Medical Image Computing (CMIC), University College Lonson (UCL)
+# 2009-2012, London
+# Aalto University, School of Science
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH
+# Jan. 2014, Boston
+
+# Sensitivity images: backprojection of a projection of ones. They depend only on the geometry, the attenuation
+# and the psf, hence they are stored in the disk cache (NiftyPy.DiskCache), when it is active, under a hash of
+# these inputs: on a hit the backprojection is not computed.
+
+import numpy
+from numpy import float32
+from ..DiskCache import get_disk_cache
+from .NiftyRec import SPECT_backproject_parallelholes, PET_backproject_compressed, _use_numpy_engine
+
+__all__ = ['SPECT_sensitivity','PET_sensitivity_compressed']
+
+
+def _engine(use_gpu):
+    # The engines give slightly different results: they are cached separately.
+    if _use_numpy_engine(use_gpu):
+        return "numpy"
+    return "gpu" if use_gpu else "C"
+
+
+def _array(value, dtype):
+    if value is None:
+        return None
+    return numpy.asarray(value, dtype=dtype)
+
+
+def SPECT_sensitivity(cameras, shape, attenuation=None, psf=None, background=0.0, background_attenuation=0.0, use_gpu=1, cache=None):
+    """Sensitivity image of a SPECT parallel-holes acquisition: backprojection of ones on the given cameras.
+    'shape' is the shape of the projection of one camera (Nx,Ny). The result is read from (or stored in)
+    'cache', default: the active disk cache. """
+    if cache is None:
+        cache = get_disk_cache()
+    cameras = _array(cameras, float32)
+    attenuation, psf = _array(attenuation, float32), _array(psf, float32)
+    def compute():
+        ones = numpy.ones((shape[0],shape[1],cameras.shape[0]), dtype=float32, order="F")
+        return SPECT_backproject_parallelholes(ones, cameras, attenuation, psf, background, background_attenuation, use_gpu)
+    if cache is None:
+        return compute()
+    key = cache.key('SPECT_sensitivity', _engine(use_gpu), tuple(shape[0:2]), cameras, attenuation, psf, float(background), float(background_attenuation))
+    return cache.get_or_compute(key, compute)
+
+
+def PET_sensitivity_compressed(activity_shape, cache=None, **parameters):
+    """Sensitivity image of a PET acquisition in the compressed layout: backprojection of ones.
+    'parameters' are the keyword arguments of PET_backproject_compressed other than projection_data and the
+    size of the activity. The result is read from (or stored in) 'cache', default: the active disk cache. """
+    if cache is None:
+        cache = get_disk_cache()
+    parameters = dict(parameters)
+    parameters['N_activity_x'], parameters['N_activity_y'], parameters['N_activity_z'] = [int(n) for n in activity_shape]
+    def compute():
+        ones = numpy.ones((parameters['locations'].shape[1],), dtype=float32)
+        return PET_backproject_compressed(ones, **parameters)
+    if cache is None:
+        return compute()
+    key = cache.key('PET_sensitivity_compressed', _engine(parameters.get('use_gpu',1)), parameters)
+    return cache.get_or_compute(key, compute)
@@ -0,0 +1,182 @@
+
+# NiftyRec - Ray-tracing tools
+# Stefano Pedemonte
+# Center for Medical Image Computing (CMIC), University College Lonson (UCL)
+# 2009-2012, London
+# Aalto University, School of Science
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH
+# Jan. 2014, Boston
+
+# Ordered subsets of the cameras of a SPECT acquisition and of the angles of a PET acquisition. The subsets
+# are built once: the cameras of each subset (the active mask for PET), the psf and the attenuation are
+# converted to the layout of the C library when the plan is created, so that projecting or backprojecting
+# a subset at each iteration of OSEM does not copy them again. Both classes expose the same interface
+# (N_subsets, project(activity,subset,out), backproject(projection,subset,out)), used by the reconstruction engine.
+
+import numpy
+from numpy import float32
+from ..Layout import normalize_array
+from .NiftyRec import SPECT_project_parallelholes, SPECT_backproject_parallelholes, PET_project_compressed, PET_backproject_compressed
+from .Sensitivity import SPECT_sensitivity, PET_sensitivity_compressed
+
+__all__ = ['SPECT_subsets','PET_compressed_subsets']
+
+
+class SPECT_subsets(object):
+    """Subsets of the cameras of a SPECT acquisition, for the parallel-holes projector.
+    The subsets are either interleaved (subset k holds the cameras k, k+N_subsets, k+2*N_subsets, ..)
+    or given as a list of arrays of camera indexes ('subsets'). """
+    def __init__(self, cameras, N_subsets=1, subsets=None, attenuation=None, psf=None, background=0.0, background_attenuation=0.0, use_gpu=1, truncate_negative_values=0):
+        cameras = numpy.asarray(cameras, dtype=float32)
+        if cameras.ndim == 1:
+            cameras = cameras.reshape((-1,1))
+        self.N_cameras = cameras.shape[0]
+        if subsets is None:
+            if N_subsets < 1 or N_subsets > self.N_cameras:
+                raise ValueError("N_subsets must be between 1 and the number of cameras (%d), not %d. "%(self.N_cameras,N_subsets))
+            subsets = [numpy.arange(k, self.N_cameras, N_subsets) for k in range(N_subsets)]
+        self.subsets = []
+        for indexes in subsets:
+            indexes = numpy.asarray(indexes, dtype=numpy.intp).ravel()
+            if indexes.size == 0 or indexes.min() < 0 or indexes.max() >= self.N_cameras:
+                raise ValueError("Each subset must hold indexes of cameras in [0,%d). "%self.N_cameras)
+            indexes.flags.writeable = False
+            self.subsets.append(indexes)
+        self.N_subsets = len(self.subsets)
+        # contiguous slices of the projection, when the indexes of a subset are consecutive
+        self._slices = []
+        for indexes in self.subsets:
+            if numpy.all(numpy.diff(indexes) == 1):
+                self._slices.append(slice(indexes[0],indexes[-1]+1))
+            else:
+                self._slices.append(None)
+        self.cameras = [numpy.asfortranarray(cameras[indexes]) for indexes in self.subsets]
+        for c in self.cameras:
+            c.flags.writeable = False
+        if attenuation is not None:
+            attenuation = normalize_array(attenuation, float32, "F", 'SPECT_subsets')
+        if psf is not None:
+            psf = normalize_array(psf, float32, "F", 'SPECT_subsets')
+        self.attenuation = attenuation
+        self.psf = psf
+        self.background = background
+        self.background_attenuation = background_attenuation
+        self.use_gpu = use_gpu
+        self.truncate_negative_values = truncate_negative_values
+        self._scratch = {}
+
+    def __len__(self):
+        return self.N_subsets
+
+    def __iter__(self):
+        return iter(range(self.N_subsets))
+
+    def indexes(self, subset):
+        """Indexes of the cameras of a subset. """
+        return self.subsets[subset]
+
+    def _buffer(self, key, shape):
+        # Scratch array of the plan, reused across iterations.
+        buf = self._scratch.get(key)
+        if buf is None or buf.shape != shape:
+            buf = self._scratch[key] = numpy.zeros(shape, dtype=float32, order="F")
+        return buf
+
+    def project(self, activity, subset, out=None):
+        """Project 'activity' on the cameras of a subset. If 'out' is given, it is a full projection
+        (Nx,Ny,N_cameras): the views of the subset are written in it (the other views are not modified) and
+        'out' is returned; otherwise the projection of the subset (Nx,Ny,N_cameras_subset) is returned. """
+        indexes = self.subsets[subset]
+        if out is None:
+            return SPECT_project_parallelholes(activity, self.cameras[subset], self.attenuation, self.psf, self.background,
+                                               self.background_attenuation, self.use_gpu, self.truncate_negative_values)
+        if out.shape[0:3] != (activity.shape[0],activity.shape[1],self.N_cameras):
+            raise ValueError("'out' must be a full projection of shape %s. "%str((activity.shape[0],activity.shape[1],self.N_cameras)))
+        view = self._slices[subset]
+        if view is not None and out.flags.f_contiguous and out.dtype == float32:
+            # consecutive cameras: project directly into the slice of the full projection
+            SPECT_project_parallelholes(activity, self.cameras[subset], self.attenuation, self.psf, self.background,
+                                        self.background_attenuation, self.use_gpu, self.truncate_negative_values, out=out[:,:,view])
+            return out
+        projection = self._buffer(('projection',subset), (activity.shape[0],activity.shape[1],len(indexes)))
+        SPECT_project_parallelholes(activity, self.cameras[subset], self.attenuation, self.psf, self.background,
+                                    self.background_attenuation, self.use_gpu, self.truncate_negative_values, out=projection)
+        out[:,:,indexes] = projection
+        return out
+
+    def backproject(self, projection, subset, out=None):
+        """Backproject the views of a subset. 'projection' is either the full projection (Nx,Ny,N_cameras),
+        of which only the views of the subset are used, or the projection of the subset. """
+        indexes = self.subsets[subset]
+        if projection.shape[2] == self.N_cameras and len(indexes) != self.N_cameras:
+            view = self._slices[subset]
+            if view is not None:
+                projection = projection[:,:,view]
+            else:
+                selected = self._buffer(('backprojection',subset), (projection.shape[0],projection.shape[1],len(indexes)))
+                if projection.dtype == float32:
+                    numpy.take(projection, indexes, axis=2, out=selected)
+                else:
+                    selected[...] = projection[:,:,indexes]
+                projection = selected
+        elif projection.shape[2] != len(indexes):
+            raise ValueError("The projection has %d views: expected %d (subset) or %d (full). "%(projection.shape[2],len(indexes),self.N_cameras))
+        return SPECT_backproject_parallelholes(projection, self.cameras[subset], self.attenuation, self.psf, self.background,
+                                              self.background_attenuation, self.use_gpu, self.truncate_negative_values, out=out)
+
+    def sensitivity(self, subset, shape, cache=None):
+        """Sensitivity image of a subset, for an activity of the given shape; cached on disk (see SPECT_sensitivity). """
+        return SPECT_sensitivity(self.cameras[subset], shape, self.attenuation, self.psf, self.background,
+                                 self.background_attenuation, self.use_gpu, cache)
+
+
+class PET_compressed_subsets(object):
+    """Subsets of the azimuthal angles of compressed PET projection data (subset k holds the azimuthal angles
+    k, k+N_subsets, ..), for the compressed PET projector. 'parameters' are the keyword arguments of
+    PET_project_compressed other than activity (e.g. offsets=.., locations=.., active=.., N_axial=..);
+    'activity_shape' is the shape of the activity. The subsets are selected through the 'active' mask, hence
+    the projection of a subset is a full compressed projection, zero out of the subset. """
+    def __init__(self, activity_shape, N_subsets=1, **parameters):
+        self.activity_shape = tuple([int(n) for n in activity_shape])
+        active = parameters.pop('active', None)
+        N_azimuthal = parameters['N_azimuthal']
+        N_axial = parameters['N_axial']
+        if active is None:
+            active = numpy.ones((N_azimuthal,N_axial), dtype=numpy.int32)
+        if N_subsets < 1 or N_subsets > N_azimuthal:
+            raise ValueError("N_subsets must be between 1 and the number of azimuthal angles (%d), not %d. "%(N_azimuthal,N_subsets))
+        self.N_subsets = N_subsets
+        self.N_locations = parameters['locations'].shape[1]
+        azimuthal = numpy.arange(N_azimuthal).reshape((N_azimuthal,1))
+        self.active = [numpy.asfortranarray(((numpy.asarray(active) != 0) & (azimuthal % N_subsets == k)).astype(numpy.int32)) for k in range(N_subsets)]
+        for a in self.active:
+            a.flags.writeable = False
+        for name, dtype in (('offsets',numpy.int32),('locations',numpy.uint16),('attenuation',float32)):
+            if parameters.get(name) is not None:
+                parameters[name] = normalize_array(parameters[name], dtype, "F", 'PET_compressed_subsets')
+        self.project_parameters = parameters
+        self.backproject_parameters = dict(parameters)
+        self.backproject_parameters.pop('truncate_negative_values', None)
+        self.backproject_parameters['N_activity_x'], self.backproject_parameters['N_activity_y'], self.backproject_parameters['N_activity_z'] = self.activity_shape
+
+    def __len__(self):
+        return self.N_subsets
+
+    def __iter__(self):
+        return iter(range(self.N_subsets))
+
+    def project(self, activity, subset, out=None):
+        """Project 'activity' on the angles of a subset; the result (N_locations,) is written in 'out', if given. """
+        return PET_project_compressed(activity, active=self.active[subset], out=out, **self.project_parameters)
+
+    def backproject(self, projection, subset, out=None):
+        """Backproject the angles of a subset of the compressed projection (N_locations,). """
+        return PET_backproject_compressed(projection, active=self.active[subset], out=out, **self.backproject_parameters)
+
+    def sensitivity(self, subset, shape=None, cache=None):
+        """Sensitivity image of a subset; cached on disk (see PET_sensitivity_compressed). """
+        parameters = dict(self.backproject_parameters)
+        for name in ('N_activity_x','N_activity_y','N_activity_z'):
+            del parameters[name]
+        return PET_sensitivity_compressed(self.activity_shape, cache, active=self.active[subset], **parameters)
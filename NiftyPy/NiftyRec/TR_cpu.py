@@ -0,0 +1,47 @@
+# NiftyRec - Ray-tracing tools
+# Stefano Pedemonte
+# Center for Medical Image Computing (CMIC), University College Lonson (UCL)
+# 2009-2012, London
+# Aalto University, School of Science
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH
+# Jan. 2014, Boston
+
+# NumPy implementation of the resampling of an image on a grid (TR_resample_grid), for hosts where the NiftyRec
+# C library is not available. The grid holds a 3D location per voxel; 'affine_index2grid' maps the indexes of
+# the image to the coordinates of the grid, hence the image is sampled at inv(affine_index2grid) * location,
+# with trilinear interpolation (INTERPOLATION_LINEAR) or nearest neighbour (INTERPOLATION_POINT).
+# The grid is processed in batches of voxels, so that the memory is bounded by 'batch_voxels'.
+
+import numpy
+from .Interpolation import trilinear_gather
+
+__all__ = ['TR_resample_grid_cpu']
+
+BATCH_VOXELS = 2**22
+INTERPOLATION_LINEAR = 0
+INTERPOLATION_POINT  = 1
+
+
+def TR_resample_grid_cpu(image_array, grid_array, affine_index2grid=None, background=0.0, interpolation_mode=INTERPOLATION_LINEAR, out=None, batch_voxels=BATCH_VOXELS):
+    """Resample the image at the locations of grid_array (Nx,Ny,Nz,3); NumPy engine. Same arguments and output as TR_resample_grid. """
+    image_array = numpy.asarray(image_array, dtype=numpy.float32)
+    if affine_index2grid is None:
+        affine_index2grid = numpy.eye(4)
+    grid2index = numpy.linalg.inv(numpy.asarray(affine_index2grid, dtype=numpy.float64))
+    shape = grid_array.shape[0:3]
+    if out is None:
+        out = numpy.zeros(shape, dtype=numpy.float32, order="F")
+    locations = numpy.reshape(grid_array, (-1,3), order='F')
+    result = numpy.reshape(out, (-1,), order='F')
+    for start in range(0, locations.shape[0], int(batch_voxels)):
+        stop = min(start+int(batch_voxels), locations.shape[0])
+        points = numpy.asarray(locations[start:stop], dtype=numpy.float64)
+        index = numpy.dot(points, grid2index[0:3,0:3].T) + grid2index[0:3,3]
+        sx, sy, sz = [numpy.asarray(index[:,k], dtype=numpy.float32) for k in range(3)]
+        if interpolation_mode == INTERPOLATION_POINT:
+            sx, sy, sz = numpy.floor(sx+0.5), numpy.floor(sy+0.5), numpy.floor(sz+0.5)
+        result[start:stop] = trilinear_gather(image_array, sx, sy, sz, background)
+    if not numpy.may_share_memory(result, out):
+        out[...] = numpy.reshape(result, shape, order='F')
+    return out
@@ -8,4 +8,11 @@
 # Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
 # Jan. 2014, Boston
 
-from NiftyRec import *
\ No newline at end of file
+from NiftyRec import *
+from Compression import *
+from Sensitivity import *
+from Subsets import *
+from Reconstruction import *
+from Datasets import *
+from ListMode import *
+from Scheduler import *
\ No newline at end of file
@@ -0,0 +1,161 @@
+
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# Process pool for the NiftyRec and NiftyReg wrappers with the arrays in shared memory. An array is copied once
+# into a shared block (a file in /dev/shm, or in the temporary directory, mapped with numpy.memmap) and the
+# tasks carry only its handle (SharedArray: file name, shape, dtype, order), which is small to pickle. Each
+# worker maps a block the first time it sees it and keeps it mapped, hence the geometry (cameras, psf,
+# attenuation, offsets, locations, ..) stays resident in the workers across iterations and only the handles
+# travel. The wrappers accept the mapped blocks without copies (float32 blocks with the expected order) and
+# write their outputs straight into a shared output block ('out', or 'into' for the wrappers without 'out').
+# multiprocessing.shared_memory does not exist in Python 2: the blocks are memory-mapped files instead.
+
+import os
+import tempfile
+import threading
+import multiprocessing
+import numpy
+
+__all__ = ['SharedArray','ProcessPool']
+
+SHARED_DIRECTORY = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+
+class SharedArray(object):
+    """Handle of an array in a shared block; the handle is pickled to the workers, 'array' maps the block. """
+    def __init__(self, filename, shape, dtype, order):
+        self.filename = filename
+        self.shape = tuple(shape)
+        self.dtype = numpy.dtype(dtype).str
+        self.order = order
+
+    @property
+    def nbytes(self):
+        return int(numpy.prod(self.shape)) * numpy.dtype(self.dtype).itemsize
+
+    @property
+    def array(self):
+        """The array, mapped once per process. """
+        return _attach(self)
+
+    def __repr__(self):
+        return "SharedArray(%r, %r, %r, %r)"%(self.filename, self.shape, self.dtype, self.order)
+
+
+# blocks mapped by this process, by file name
+_attached = {}
+_attached_lock = threading.Lock()
+
+def _attach(handle):
+    with _attached_lock:
+        array = _attached.get(handle.filename)
+        if array is None:
+            # forget the blocks released by the pool
+            for filename in [f for f in _attached if not os.path.exists(f)]:
+                del _attached[filename]
+            array = numpy.memmap(handle.filename, dtype=handle.dtype, mode='r+', shape=handle.shape, order=handle.order)
+            _attached[handle.filename] = array
+        return array
+
+def _resolve(value):
+    if isinstance(value, SharedArray):
+        return value.array
+    return value
+
+def _run(task):
+    # Body of a task, in the worker: map the handles, call the wrapper, store the result in 'into'.
+    function, args, kwargs, into = task
+    args = [_resolve(a) for a in args]
+    kwargs = dict([(k,_resolve(v)) for k,v in kwargs.items()])
+    result = function(*args, **kwargs)
+    if into is not None:
+        out = into.array
+        if result is not out:
+            out[...] = result
+        return into
+    if isinstance(result, numpy.memmap):
+        return _handle_of(result, kwargs, args)
+    return result
+
+def _handle_of(result, kwargs, args):
+    # The result is a shared block given as argument (e.g. 'out'): return its handle rather than the data.
+    for value in list(kwargs.values()) + list(args):
+        if value is result:
+            return SharedArray(result.filename, result.shape, result.dtype, "F" if result.flags.f_contiguous and not result.flags.c_contiguous else "C")
+    return numpy.array(result)
+
+
+class ProcessPool(object):
+    """Pool of N_workers processes (default: the number of processors) that run the NiftyRec and NiftyReg wrappers
+    on arrays in shared memory. share() copies an array in a shared block once; the handles are passed to apply()
+    and map() in place of the arrays. The blocks live until release() or close(). """
+    def __init__(self, N_workers=None, directory=SHARED_DIRECTORY):
+        if N_workers is None:
+            N_workers = multiprocessing.cpu_count()
+        self.directory = directory
+        self.N_workers = N_workers
+        self._pool = multiprocessing.Pool(N_workers)
+        self._blocks = {}
+
+    def empty(self, shape, dtype=numpy.float32, order="F"):
+        """New shared block of zeros (e.g. for the outputs). """
+        handle, filename = tempfile.mkstemp(prefix='niftypy_', suffix='.shm', dir=self.directory)
+        shared = SharedArray(filename, shape, dtype, order)
+        with os.fdopen(handle, 'wb') as f:
+            if shared.nbytes:
+                f.truncate(shared.nbytes)
+        self._blocks[filename] = shared
+        return shared
+
+    def share(self, array, dtype=None, order="F"):
+        """Copy 'array' in a new shared block (converted to 'dtype', default: its own, and 'order'). """
+        array = numpy.asarray(array)
+        shared = self.empty(array.shape, dtype if dtype is not None else array.dtype, order)
+        shared.array[...] = array
+        return shared
+
+    def release(self, *handles):
+        """Free the shared blocks. """
+        for shared in handles:
+            self._blocks.pop(shared.filename, None)
+            with _attached_lock:
+                _attached.pop(shared.filename, None)
+            try:
+                os.remove(shared.filename)
+            except OSError:
+                pass
+
+    def apply(self, function, *args, **kwargs):
+        """Run function(*args, **kwargs) in a worker; SharedArray arguments are mapped in the worker. With
+        into=SharedArray the result is written in that block (for the wrappers without 'out') and its handle
+        is returned; a shared block returned by the function (e.g. 'out') is returned as its handle. """
+        return self.apply_async(function, *args, **kwargs).get()
+
+    def apply_async(self, function, *args, **kwargs):
+        """As apply(); returns a multiprocessing AsyncResult. """
+        into = kwargs.pop('into', None)
+        return self._pool.apply_async(_run, ((function, args, kwargs, into),))
+
+    def map(self, function, calls):
+        """Run function on the workers for each (args, kwargs) in 'calls' (kwargs may hold 'into'); returns the results in order. """
+        results = [self.apply_async(function, *args, **kwargs) for args, kwargs in calls]
+        return [r.get() for r in results]
+
+    def close(self):
+        """Stop the workers and free the shared blocks. """
+        self._pool.close()
+        self._pool.join()
+        self.release(*list(self._blocks.values()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
@@ -0,0 +1,104 @@
+
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# Profiling of the calls to the NiftyRec and NiftyReg C libraries. While a Profiler is active, every CallPlan
+# records the wall time of the phases of a call: 'resolve' (lookup of the function pointer, first call only),
+# 'marshal' (conversion of the arrays and the scalars), 'c_call' (the C function) and 'unmarshal' (read back of
+# the scalars), the bytes of the arrays passed to the library and the bytes copied by the conversions.
+# The calls are aggregated per C function (stats) and kept as a timeline (chrome_trace: JSON for
+# chrome://tracing or Perfetto). When no profiler is active the cost is one test per call.
+
+import os
+import json
+import threading
+from timeit import default_timer as clock
+from .CallPlan import set_profiler
+
+__all__ = ['Profiler','profile']
+
+PHASES = ('resolve','marshal','c_call','unmarshal')
+
+
+class Profiler(object):
+    """Records the calls to the C libraries between start() and stop() (or within a 'with' block). At most
+    max_events calls are kept for the timeline; the aggregated statistics include all the calls. """
+    def __init__(self, max_events=100000):
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._previous = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._events = []
+            self.dropped_events = 0
+            self._origin = clock()
+
+    def start(self):
+        self._previous = set_profiler(self)
+        return self
+
+    def stop(self):
+        set_profiler(self._previous)
+        self._previous = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+
+    def record(self, function_name, phases, nbytes, copied):
+        """Record a call: 'phases' is a list of (phase, start, end), times of timeit.default_timer. """
+        thread = threading.current_thread().ident
+        with self._lock:
+            entry = self._stats.get(function_name)
+            if entry is None:
+                entry = self._stats[function_name] = dict([('calls',0), ('time',0.0), ('bytes',0), ('bytes_copied',0)] + [(p,0.0) for p in PHASES])
+            entry['calls'] += 1
+            entry['time'] += phases[-1][2] - phases[0][1]
+            entry['bytes'] += nbytes
+            entry['bytes_copied'] += copied
+            for phase, start, end in phases:
+                entry[phase] += end - start
+            if len(self._events) < self.max_events:
+                self._events.append((function_name, thread, phases, nbytes, copied))
+            else:
+                self.dropped_events += 1
+
+    def stats(self):
+        """Statistics per C function: calls, time (total wall time), time of each phase, bytes and bytes_copied. """
+        with self._lock:
+            return dict([(name, dict(entry)) for name, entry in self._stats.items()])
+
+    def chrome_trace(self, filename=None):
+        """Timeline of the calls in the Chrome trace format (one event per call and one per phase, in microseconds).
+        Written to 'filename', if given; returns the trace (dictionary). """
+        pid = os.getpid()
+        events = []
+        with self._lock:
+            for function_name, thread, phases, nbytes, copied in self._events:
+                start, end = phases[0][1], phases[-1][2]
+                events.append({'name':function_name, 'cat':'call', 'ph':'X', 'pid':pid, 'tid':thread,
+                               'ts':(start-self._origin)*1e6, 'dur':(end-start)*1e6, 'args':{'bytes':nbytes, 'bytes_copied':copied}})
+                for phase, start, end in phases:
+                    events.append({'name':phase, 'cat':function_name, 'ph':'X', 'pid':pid, 'tid':thread,
+                                   'ts':(start-self._origin)*1e6, 'dur':(end-start)*1e6})
+        trace = {'traceEvents':events, 'displayTimeUnit':'ms'}
+        if filename is not None:
+            with open(filename, 'w') as f:
+                json.dump(trace, f)
+        return trace
+
+
+def profile(max_events=100000):
+    """New Profiler, to be used in a 'with' block. """
+    return Profiler(max_events)
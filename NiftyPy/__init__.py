@@ -11,6 +11,13 @@
 
 
 from Common import *
+from Buffers import BufferPool, set_buffer_pool, get_buffer_pool
+from Layout import copy_stats, reset_copy_stats, clear_layout_cache
+from DiskCache import DiskCache, set_disk_cache, get_disk_cache
+from ProcessPool import SharedArray, ProcessPool
+from Profiling import Profiler, profile
 import NiftyRec
 import NiftyReg
+import Async
+from Backends import register_backend, select_backend, call_backend, list_backends
 #import NiftySeg
@@ -0,0 +1,369 @@
+
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# Benchmarks of the NiftyRec and NiftyReg wrappers, for small, medium and large volumes.
+# Two kinds of benchmark:
+#  - 'wrapper': the wrapper calling the C library. The C library is replaced by a stand-in (standin.c, compiled
+#    with the C compiler of the host) that returns immediately, so that the benchmarks run on a CPU-only host
+#    and measure the overhead of the wrapper; the time of the marshalling of the arguments and the time of the
+#    C call are measured separately with a Profiler.
+#  - 'compute': the NumPy engines (use_gpu=0), i.e. the CPU paths.
+# The results are stored as JSON; compared with a baseline, the benchmarks slower than the baseline by more
+# than 'threshold' (relative) are reported as regressions.
+#
+#   python -m NiftyPy.test.Benchmarks --save baseline.json
+#   python -m NiftyPy.test.Benchmarks --baseline baseline.json --threshold 0.25
+#
+# The stand-in is loaded before any C function is called: run the benchmarks in a fresh process.
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+from timeit import default_timer as clock
+import numpy
+from numpy import float32, int32
+
+__all__ = ['SIZES','BENCHMARKS','build_standin','use_standin','run','compare','main']
+
+SIZES = {'small':16, 'medium':32, 'large':64}
+THRESHOLD = 0.25
+MIN_TIME = 0.2       # seconds of measurements per benchmark
+MAX_REPEAT = 1000
+STANDIN_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'standin.c')
+
+
+#### Stand-in C library: ####
+
+def build_standin(directory=None, compiler=None):
+    """Compile the stand-in library; returns the paths of the stand-ins of _et_array_interface and _reg_array_interface.
+    By default the stand-in is built once in a directory of the temporary folder named after the modification time
+    of standin.c, and reused by the following runs until standin.c changes. """
+    if directory is None:
+        stamp = int(os.path.getmtime(STANDIN_SOURCE))
+        directory = os.path.join(tempfile.gettempdir(), 'niftypy_standin_%d'%stamp)
+    if compiler is None:
+        compiler = os.environ.get('CC', 'cc')
+    niftyrec = os.path.join(directory, '_et_array_interface.so')
+    niftyreg = os.path.join(directory, '_reg_array_interface.so')
+    if os.path.exists(niftyrec) and os.path.exists(niftyreg):
+        return niftyrec, niftyreg
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):   # not created by a concurrent run
+                raise
+    # build under temporary names and rename: concurrent runs never load a partial library
+    handle, temporary = tempfile.mkstemp(suffix='.so', dir=directory)
+    os.close(handle)
+    try:
+        subprocess.check_call([compiler, '-shared', '-fPIC', '-O2', '-o', temporary, STANDIN_SOURCE])
+        shutil.copyfile(temporary, temporary+'.reg')
+        os.rename(temporary+'.reg', niftyreg)
+        os.rename(temporary, niftyrec)
+    finally:
+        for f in (temporary, temporary+'.reg'):
+            if os.path.exists(f):
+                os.remove(f)
+    return niftyrec, niftyreg
+
+def use_standin(directory=None):
+    """Load the stand-in in place of the NiftyRec and NiftyReg libraries. """
+    from NiftyPy.NiftyRec import NiftyRec
+    from NiftyPy.NiftyReg import NiftyReg
+    niftyrec, niftyreg = build_standin(directory)
+    NiftyRec.niftyrec_c.set_path(niftyrec)
+    NiftyReg.niftyreg_c.set_path(niftyreg)
+
+
+#### Benchmarks: ####
+# Each benchmark is (name, kind, setup); setup(n) returns the function to time, for volumes of n^3 voxels.
+
+def _volume(n):
+    return numpy.asfortranarray(numpy.random.rand(n,n,n), dtype=float32)
+
+def _cameras(n):
+    return numpy.asfortranarray(numpy.linspace(0, numpy.pi, max(n//2,1)).reshape(-1,1), dtype=float32)
+
+def _PET_parameters(n):
+    from NiftyPy.NiftyRec import PET_initialize_compression_structure
+    N_axial, N_azimuthal = 2, max(n//4,1)
+    offsets, locations = PET_initialize_compression_structure(N_axial, N_azimuthal, n, n)
+    return dict(attenuation=None, offsets=offsets, locations=locations, active=numpy.ones((N_azimuthal,N_axial),dtype=int32,order="F"),
+                N_axial=N_axial, N_azimuthal=N_azimuthal, angles_axial=numpy.asarray([0.0,0.1],dtype=float32),
+                angles_azimuthal=numpy.asarray(numpy.linspace(0,numpy.pi,N_azimuthal,endpoint=False),dtype=float32),
+                N_u=n, N_v=n, size_u=float(n), size_v=float(n), activity_size_x=float(n), activity_size_y=float(n), activity_size_z=float(n),
+                attenuation_size_x=0.0, attenuation_size_y=0.0, attenuation_size_z=0.0,
+                T_activity_x=0.0, T_activity_y=0.0, T_activity_z=0.0, R_activity_x=0.0, R_activity_y=0.0, R_activity_z=0.0,
+                T_attenuation_x=0.0, T_attenuation_y=0.0, T_attenuation_z=0.0, R_attenuation_x=0.0, R_attenuation_y=0.0, R_attenuation_z=0.0,
+                N_samples=n, sample_step=1.0, background=0.0, background_attenuation=0.0, direction=0, block_size=0)
+
+def _SPECT_project(use_gpu):
+    def setup(n):
+        from NiftyPy.NiftyRec import SPECT_project_parallelholes
+        activity, cameras, attenuation = _volume(n), _cameras(n), _volume(n)
+        return lambda: SPECT_project_parallelholes(activity, cameras, attenuation, None, use_gpu=use_gpu)
+    return setup
+
+def _SPECT_backproject(use_gpu):
+    def setup(n):
+        from NiftyPy.NiftyRec import SPECT_backproject_parallelholes
+        cameras, attenuation = _cameras(n), _volume(n)
+        projection = numpy.asfortranarray(numpy.random.rand(n,n,cameras.shape[0]), dtype=float32)
+        return lambda: SPECT_backproject_parallelholes(projection, cameras, attenuation, None, use_gpu=use_gpu)
+    return setup
+
+def _PET_project(use_gpu):
+    def setup(n):
+        from NiftyPy.NiftyRec import PET_project_compressed
+        activity, parameters = _volume(n), _PET_parameters(n)
+        return lambda: PET_project_compressed(activity, use_gpu=use_gpu, truncate_negative_values=0, **parameters)
+    return setup
+
+def _PET_backproject(use_gpu):
+    def setup(n):
+        from NiftyPy.NiftyRec import PET_backproject_compressed
+        parameters = _PET_parameters(n)
+        projection = numpy.random.rand(parameters['locations'].shape[1]).astype(float32)
+        return lambda: PET_backproject_compressed(projection, N_activity_x=n, N_activity_y=n, N_activity_z=n, use_gpu=use_gpu, **parameters)
+    return setup
+
+def _PET_compress(n):
+    from NiftyPy.NiftyRec import PET_compress_projection
+    parameters = _PET_parameters(n)
+    data = numpy.random.rand(parameters['N_axial']*parameters['N_azimuthal']*n*n).astype(float32)
+    return lambda: PET_compress_projection(parameters['offsets'], data, parameters['locations'], n, n)
+
+def _PET_uncompress(n):
+    from NiftyPy.NiftyRec import PET_uncompress_projection
+    parameters = _PET_parameters(n)
+    data = numpy.random.rand(parameters['locations'].shape[1]).astype(float32)
+    return lambda: PET_uncompress_projection(parameters['offsets'], data, parameters['locations'], n, n)
+
+def _PET_initialize(n):
+    from NiftyPy.NiftyRec import PET_initialize_compression_structure
+    return lambda: PET_initialize_compression_structure(2, max(n//4,1), n, n)
+
+def _PET_initialize_uncached(n):
+    from NiftyPy.NiftyRec.NiftyRec import _initialize_compression_structure
+    return lambda: _initialize_compression_structure(2, max(n//4,1), n, n)
+
+def _CT(function, conebeam, backproject):
+    def setup(n):
+        from NiftyPy import NiftyRec
+        f = getattr(NiftyRec, function)
+        cameras = _cameras(n)
+        if conebeam:
+            angles = cameras[:,0]
+            source = numpy.stack([2*n*numpy.cos(angles), 2*n*numpy.sin(angles), 0*angles], 1).astype(float32)
+            camera = -source
+            if backproject:
+                projection = NiftyRec.CT_project_conebeam(_volume(n), camera, source, use_gpu=0, detector_shape=(n,n))
+                return lambda: f(projection, camera, source, use_gpu=0, shape=(n,n,n))
+            volume = _volume(n)
+            return lambda: f(volume, camera, source, use_gpu=0, detector_shape=(n,n))
+        if backproject:
+            projection = numpy.asfortranarray(numpy.random.rand(n,n,cameras.shape[0]), dtype=float32)
+            return lambda: f(projection, cameras, use_gpu=0)
+        volume = _volume(n)
+        return lambda: f(volume, cameras, use_gpu=0)
+    return setup
+
+def _phantom(function):
+    def setup(n):
+        from NiftyPy import NiftyRec
+        f = getattr(NiftyRec, function)
+        if function == 'ET_spherical_phantom':
+            return lambda: f((n,n,n), (n,n,n), (n/2.0,n/2.0,n/2.0), n/4.0, 1.0, 0.0)
+        if function == 'ET_cylindrical_phantom':
+            return lambda: f((n,n,n), (n,n,n), (n/2.0,n/2.0,n/2.0), n/4.0, n/2.0, 0, 1.0, 0.0)
+        return lambda: f((n,n,n), (n,n,n), (n/2.0,n/2.0,n/2.0), n/3.0, n/16.0, n/8.0)
+    return setup
+
+def _TR(function):
+    def setup(n):
+        from NiftyPy.NiftyRec import TR_grid_from_box_and_affine, TR_resample_grid, TR_transform_grid
+        image = _volume(n)
+        grid = numpy.asfortranarray(numpy.random.rand(n,n,n,3)*n, dtype=float32)
+        affine = numpy.eye(4, dtype=float32)
+        if function == 'TR_grid_from_box_and_affine':
+            return lambda: TR_grid_from_box_and_affine((0,0,0), (n,n,n), (n,n,n), affine)
+        if function == 'TR_resample_grid':
+            return lambda: TR_resample_grid(image, grid, affine, use_gpu=1)
+        return lambda: TR_transform_grid(grid, affine, use_gpu=1)
+    return setup
+
+def _rigid(function):
+    def setup(n):
+        from NiftyPy import NiftyReg
+        f = getattr(NiftyReg, function)
+        image = _volume(n)
+        translation = numpy.zeros(3, dtype=float32)
+        rotation = numpy.zeros(3, dtype=float32)
+        center = numpy.asarray([n/2.0]*3, dtype=float32)
+        return lambda: f(image, translation, rotation, center, use_gpu=0)
+    return setup
+
+def _constant(function):
+    def setup(n):
+        from NiftyPy import NiftyRec, NiftyReg
+        f = getattr(NiftyRec, function, None) or getattr(NiftyReg, function)
+        return f
+    return setup
+
+def _gpu_list(n):
+    from NiftyPy.NiftyRec import gpu_list
+    return lambda: gpu_list(refresh=True)
+
+# TR_resample_box, TR_gradient_grid, TR_gradient_box, PET_project and PET_backproject are not implemented by the
+# wrappers and are not benchmarked.
+BENCHMARKS = [
+    ('test_library_niftyrec_c',          'wrapper', _constant('test_library_niftyrec_c')),
+    ('test_library_niftyreg_c',          'wrapper', _constant('test_library_niftyreg_c')),
+    ('gpu_list',                         'wrapper', _gpu_list),
+    ('SPECT_project_parallelholes',      'wrapper', _SPECT_project(1)),
+    ('SPECT_backproject_parallelholes',  'wrapper', _SPECT_backproject(1)),
+    ('PET_project_compressed',           'wrapper', _PET_project(1)),
+    ('PET_backproject_compressed',       'wrapper', _PET_backproject(1)),
+    ('PET_initialize_compression_structure', 'wrapper', _PET_initialize),
+    ('PET_initialize_compression_structure(uncached)', 'wrapper', _PET_initialize_uncached),
+    ('PET_compress_projection',          'wrapper', _PET_compress),
+    ('PET_uncompress_projection',        'wrapper', _PET_uncompress),
+    ('ET_spherical_phantom',             'wrapper', _phantom('ET_spherical_phantom')),
+    ('ET_cylindrical_phantom',           'wrapper', _phantom('ET_cylindrical_phantom')),
+    ('ET_spheres_ring_phantom',          'wrapper', _phantom('ET_spheres_ring_phantom')),
+    ('TR_grid_from_box_and_affine',      'wrapper', _TR('TR_grid_from_box_and_affine')),
+    ('TR_resample_grid',                 'wrapper', _TR('TR_resample_grid')),
+    ('TR_transform_grid',                'wrapper', _TR('TR_transform_grid')),
+    ('resample_image_rigid',             'wrapper', _rigid('resample_image_rigid')),
+    ('deriv_intensity_wrt_space_rigid',  'wrapper', _rigid('deriv_intensity_wrt_space_rigid')),
+    ('deriv_intensity_wrt_transformation_rigid', 'wrapper', _rigid('deriv_intensity_wrt_transformation_rigid')),
+    ('SPECT_project_parallelholes',      'compute', _SPECT_project(0)),
+    ('SPECT_backproject_parallelholes',  'compute', _SPECT_backproject(0)),
+    ('PET_project_compressed',           'compute', _PET_project(0)),
+    ('PET_backproject_compressed',       'compute', _PET_backproject(0)),
+    ('PET_initialize_compression_structure(uncached)', 'compute', _PET_initialize_uncached),
+    ('PET_compress_projection',          'compute', _PET_compress),
+    ('PET_uncompress_projection',        'compute', _PET_uncompress),
+    ('CT_project_parallelbeam',          'compute', _CT('CT_project_parallelbeam', False, False)),
+    ('CT_backproject_parallelbeam',      'compute', _CT('CT_backproject_parallelbeam', False, True)),
+    ('CT_project_conebeam',              'compute', _CT('CT_project_conebeam', True, False)),
+    ('CT_backproject_conebeam',          'compute', _CT('CT_backproject_conebeam', True, True)),
+]
+
+
+#### Measurement: ####
+
+def _measure(function, min_time=MIN_TIME, max_repeat=MAX_REPEAT):
+    # Times of the calls of 'function' (at least 3 calls, until min_time seconds or max_repeat calls).
+    function()   # warm up (first call: lookup of the C functions, caches)
+    times = []
+    start = clock()
+    while len(times) < 3 or (clock()-start < min_time and len(times) < max_repeat):
+        t0 = clock()
+        function()
+        times.append(clock()-t0)
+    return times
+
+def _benchmark(name, kind, setup, n, min_time):
+    from NiftyPy import NiftyRec, Profiler
+    engine = NiftyRec.NiftyRec.cpu_engine
+    NiftyRec.set_cpu_engine(NiftyRec.NiftyRec.CPU_ENGINE_NUMPY if kind == 'compute' else NiftyRec.NiftyRec.CPU_ENGINE_C)
+    try:
+        numpy.random.seed(0)
+        function = setup(n)
+        times = _measure(function, min_time)
+        result = {'time':float(numpy.median(times)), 'min':float(numpy.min(times)), 'repeat':len(times)}
+        if kind == 'wrapper':
+            # a second pass with the profiler: time of the marshalling and of the C calls, per call of the wrapper
+            profiler = Profiler()
+            with profiler:
+                for i in range(len(times)):
+                    function()
+            stats = profiler.stats().values()
+            result['marshal'] = sum([s['marshal']+s['unmarshal'] for s in stats]) / len(times)
+            result['c_call'] = sum([s['c_call'] for s in stats]) / len(times)
+            result['c_calls'] = sum([s['calls'] for s in stats]) // len(times)
+            result['bytes_copied'] = sum([s['bytes_copied'] for s in stats]) // len(times)
+    finally:
+        NiftyRec.set_cpu_engine(engine)
+    return result
+
+def run(sizes=('small','medium','large'), kinds=('wrapper','compute'), select=None, min_time=MIN_TIME, verbose=True):
+    """Run the benchmarks; 'select' (optional) is a substring of the names of the benchmarks to run.
+    Returns the results: {'meta':.., 'results':{'kind/name/size':{'time':..,..}}}. """
+    results = {}
+    for size in sizes:
+        n = SIZES[size]
+        for name, kind, setup in BENCHMARKS:
+            if kind not in kinds or (select is not None and select not in name):
+                continue
+            key = "%s/%s/%s"%(kind, name, size)
+            try:
+                results[key] = _benchmark(name, kind, setup, n, min_time)
+            except Exception as e:
+                results[key] = {'error':"%s: %s"%(type(e).__name__, str(e))}
+            if verbose:
+                r = results[key]
+                if 'error' in r:
+                    print "%-75s %s"%(key, r['error'])
+                else:
+                    print "%-75s %12.6f s"%(key, r['time']) + ("   marshal %10.6f s"%r['marshal'] if 'marshal' in r else "")
+    meta = {'time':time.strftime('%Y-%m-%d %H:%M:%S'), 'python':platform.python_version(), 'numpy':numpy.__version__,
+            'platform':platform.platform(), 'sizes':dict([(s,SIZES[s]) for s in sizes])}
+    return {'meta':meta, 'results':results}
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Benchmarks slower than the baseline by more than 'threshold' (relative): list of (key, time, baseline time). """
+    regressions = []
+    for key, r in sorted(results['results'].items()):
+        b = baseline['results'].get(key)
+        if b is None or 'time' not in b or 'time' not in r:
+            continue
+        if r['time'] > b['time'] * (1+threshold):
+            regressions.append((key, r['time'], b['time']))
+    return regressions
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmarks of the NiftyPy wrappers (stand-in C library and NumPy engines). ")
+    parser.add_argument('--sizes', default='small,medium,large', help="comma separated, of: %s"%", ".join(sorted(SIZES)))
+    parser.add_argument('--kinds', default='wrapper,compute', help="comma separated, of: wrapper, compute")
+    parser.add_argument('--select', default=None, help="run the benchmarks whose name contains this string")
+    parser.add_argument('--min-time', type=float, default=MIN_TIME, help="seconds of measurements per benchmark")
+    parser.add_argument('--save', default=None, help="store the results (JSON) in this file")
+    parser.add_argument('--baseline', default=None, help="compare with the results (JSON) in this file")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help="relative slowdown reported as a regression")
+    parser.add_argument('--no-standin', action='store_true', help="use the installed C libraries")
+    args = parser.parse_args(argv)
+    if not args.no_standin:
+        use_standin()
+    results = run(args.sizes.split(','), args.kinds.split(','), args.select, args.min_time)
+    if args.save is not None:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        for key, t, b in regressions:
+            print "REGRESSION %-64s %12.6f s (baseline %12.6f s, %+.0f%%)"%(key, t, b, 100*(t/b-1))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
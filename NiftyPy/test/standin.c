@@ -0,0 +1,69 @@
+/*
+ NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+ Stefano Pedemonte
+ Centre for Medical Image Computing (CMIC), University College London (UCL)
+ Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+
+ Stand-in for the NiftyRec (_et_array_interface) and NiftyReg (_reg_array_interface) libraries, used by the
+ benchmarks (Benchmarks.py) on hosts without the libraries or without a GPU. It exports the entry points called
+ by the wrappers with the same return codes; the functions do not compute (they return immediately), so that
+ the time of a wrapper with the stand-in is the overhead of the wrapper (marshalling, allocation, checks).
+ The only functions that write their outputs are those whose outputs are read back by the wrappers
+ (enumeration of the GPUs, echo, compression structure).
+*/
+
+#define SUCCESS             0
+#define IO_ERROR            1
+#define INITIALISATION_ERROR 2
+#define PARAMETER_ERROR     3
+#define UNHANDLED_ERROR     4
+
+int status_success(unsigned int *r)              { *r = SUCCESS; return 0; }
+int status_io_error(unsigned int *r)             { *r = IO_ERROR; return 0; }
+int status_initialisation_error(unsigned int *r) { *r = INITIALISATION_ERROR; return 0; }
+int status_parameter_error(unsigned int *r)      { *r = PARAMETER_ERROR; return 0; }
+int status_unhandled_error(unsigned int *r)      { *r = UNHANDLED_ERROR; return 0; }
+
+int echo(int *input, int *output) { *output = *input; return SUCCESS; }
+
+/* NiftyRec: no GPUs */
+int et_array_list_gpus(int *N, int *info)  { *N = 0; return SUCCESS; }
+int et_array_set_gpu_pointer(int *id)      { return PARAMETER_ERROR; }
+int et_array_reset_gpu(void)               { return SUCCESS; }
+
+int PET_initialize_compression_structure(unsigned int *N_axial, unsigned int *N_azimuthal, unsigned int *N_u, unsigned int *N_v,
+                                         int *offsets, unsigned short *locations)
+{
+    unsigned int k = 0, axial, azimuthal, u, v;
+    for (axial = 0; axial < *N_axial; axial++)
+        for (azimuthal = 0; azimuthal < *N_azimuthal; azimuthal++) {
+            offsets[azimuthal + *N_azimuthal * axial] = k;
+            for (u = 0; u < *N_u; u++)
+                for (v = 0; v < *N_v; v++) {
+                    locations[3*k] = u; locations[3*k+1] = v; locations[3*k+2] = 0;
+                    k++;
+                }
+        }
+    return SUCCESS;
+}
+
+int PET_project(void)                      { return SUCCESS; }
+int PET_backproject(void)                  { return SUCCESS; }
+int PET_project_compressed(void)           { return SUCCESS; }
+int PET_project_compressed_test(void)      { return SUCCESS; }
+int PET_backproject_compressed(void)       { return SUCCESS; }
+int PET_compress_projection(void)          { return SUCCESS; }
+int PET_uncompress_projection(void)        { return SUCCESS; }
+int ET_spherical_phantom(void)             { return SUCCESS; }
+int ET_cylindrical_phantom(void)           { return SUCCESS; }
+int ET_spheres_ring_phantom(void)          { return SUCCESS; }
+int SPECT_project_parallelholes(void)      { return SUCCESS; }
+int SPECT_backproject_parallelholes(void)  { return SUCCESS; }
+int TR_grid_from_box_and_affine(void)      { return SUCCESS; }
+int TR_resample_grid(void)                 { return SUCCESS; }
+int TR_transform_grid(void)                { return SUCCESS; }
+
+/* NiftyReg */
+int REG_array_resample_image_rigid(void)               { return SUCCESS; }
+int REG_array_d_intensity_d_space_rigid(void)          { return SUCCESS; }
+int REG_array_d_intensity_d_transformation_rigid(void) { return SUCCESS; }
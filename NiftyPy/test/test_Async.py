@@ -0,0 +1,78 @@
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# The chunked calls of Async.py with the NumPy engines. The chunks are driven directly (no event loop needed);
+# the awaitable functions are tested only where asyncio or trollius is installed.
+
+import threading
+import unittest
+import numpy
+from numpy import float32
+
+from NiftyPy import Async
+from NiftyPy.NiftyRec import NiftyRec
+
+try:
+    Async._asyncio()
+    HAVE_ASYNCIO = True
+except ImportError:
+    HAVE_ASYNCIO = False
+
+
+class TestAsync(unittest.TestCase):
+    def setUp(self):
+        self.engine = NiftyRec.cpu_engine
+        NiftyRec.set_cpu_engine('numpy')
+        self.activity = numpy.asfortranarray(numpy.random.rand(8,8,8,2), dtype=float32)
+        self.cameras = numpy.asfortranarray(numpy.linspace(0, numpy.pi, 5).reshape(-1,1), dtype=float32)
+
+    def tearDown(self):
+        NiftyRec.set_cpu_engine(self.engine)
+
+    def test_SPECT_project_chunks(self):
+        for activity in (self.activity, numpy.asfortranarray(self.activity[:,:,:,0])):
+            expected = NiftyRec.SPECT_project_parallelholes(activity, self.cameras, use_gpu=0)
+            steps = Async._SPECT_project(activity, self.cameras, None, None, 0.0, 0.0, 0, 0, None, 2)
+            result = Async._drive(steps, threading.Event())
+            self.assertTrue(numpy.allclose(result, expected, atol=1e-5))
+
+    def test_SPECT_backproject_chunks(self):
+        projection = NiftyRec.SPECT_project_parallelholes(self.activity[:,:,:,0], self.cameras, use_gpu=0)
+        expected = NiftyRec.SPECT_backproject_parallelholes(projection, self.cameras, use_gpu=0)
+        steps = Async._SPECT_backproject(projection, self.cameras, None, None, 0.0, 0.0, 0, 0, None, 2)
+        self.assertTrue(numpy.allclose(Async._drive(steps, threading.Event()), expected, rtol=1e-4, atol=1e-4))
+
+    def test_cancelled_between_chunks(self):
+        cancelled = threading.Event()
+        calls = []
+        def steps():
+            for k in range(3):
+                calls.append(k)
+                if k == 0:
+                    cancelled.set()
+                yield None
+            yield 'done'
+        self.assertRaises(Async.Cancelled, Async._drive, steps(), cancelled)
+        self.assertEqual(calls, [0])
+
+    @unittest.skipUnless(HAVE_ASYNCIO, "asyncio or trollius is not installed")
+    def test_awaitable(self):
+        asyncio = Async._asyncio()
+        loop = asyncio.new_event_loop()
+        try:
+            future = Async.SPECT_project_parallelholes_async(self.activity, self.cameras, use_gpu=0, chunk_size=2, loop=loop)
+            result = loop.run_until_complete(future)
+        finally:
+            loop.close()
+        expected = NiftyRec.SPECT_project_parallelholes(self.activity, self.cameras, use_gpu=0)
+        self.assertTrue(numpy.allclose(result, expected, atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
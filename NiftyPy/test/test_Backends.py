@@ -0,0 +1,101 @@
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# Every operation of the backend registry is called with the same arguments on each of its backends. When the
+# NiftyRec and NiftyReg libraries are not installed the C backends run on the stand-in library (Benchmarks.py),
+# which checks the calling convention but not the values.
+#
+#   python -m unittest discover -s NiftyPy/test
+
+import os
+import unittest
+import subprocess
+import numpy
+from numpy import float32
+
+from NiftyPy.Backends import call_backend, list_backends, select_backend, backends, NoBackendAvailable
+from NiftyPy.NiftyRec import NiftyRec
+from NiftyPy.NiftyReg import NiftyReg
+from NiftyPy.test.Benchmarks import use_standin, _PET_parameters
+
+N = 8
+
+
+def setUpModule():
+    if not (NiftyRec.niftyrec_c.available() and NiftyReg.niftyreg_c.available()):
+        try:
+            use_standin()
+        except (OSError, subprocess.CalledProcessError):
+            pass    # no C compiler: the C backends are not available
+
+
+def _calls():
+    # operation -> (args, kwargs) of a call, the same for every backend
+    volume = numpy.asfortranarray(numpy.random.rand(N,N,N), dtype=float32)
+    cameras = numpy.asfortranarray([[0.0],[numpy.pi/2]], dtype=float32)
+    projection = numpy.asfortranarray(numpy.random.rand(N,N,2), dtype=float32)
+    grid = numpy.zeros((N,N,N,3), dtype=float32, order='F')
+    grid[...,0], grid[...,1], grid[...,2] = numpy.mgrid[0:N,0:N,0:N]
+    PET = _PET_parameters(N)
+    PET_projection = numpy.random.rand(PET['locations'].shape[1]).astype(float32)
+    return {
+        # positional arguments past the position of use_gpu in the wrappers (truncate_negative_values, interpolation_mode)
+        'SPECT_project_parallelholes':     ((volume, cameras, None, None, 0.0, 0.0, 1), {}),
+        'SPECT_backproject_parallelholes': ((projection, cameras, None, None, 0.0, 0.0, 0), {}),
+        'TR_resample_grid':                ((volume, grid, numpy.eye(4, dtype=float32), 0.0, 1), {}),
+        'PET_project_compressed':          ((volume,), dict(PET, truncate_negative_values=0)),
+        'PET_backproject_compressed':      ((PET_projection,), dict(PET, N_activity_x=N, N_activity_y=N, N_activity_z=N)),
+        'resample_image_rigid':            ((volume, numpy.zeros(3, dtype=float32), numpy.zeros(3, dtype=float32),
+                                             numpy.asarray([N/2.0]*3, dtype=float32)), {}), }
+
+
+class TestBackends(unittest.TestCase):
+    def test_same_call_on_every_backend(self):
+        calls = _calls()
+        self.assertEqual(sorted(calls.keys()), backends.operations())
+        for operation, (args, kwargs) in calls.items():
+            shapes = {}
+            for backend in backends.backends(operation):
+                if not backend.available():
+                    self.assertRaises(NoBackendAvailable, call_backend, operation, *args, backend=backend.name, **kwargs)
+                    continue
+                result = call_backend(operation, *args, backend=backend.name, **kwargs)
+                shapes[backend.name] = numpy.shape(result)
+            self.assertTrue(len(set(shapes.values())) <= 1, "%s: %s"%(operation, shapes))
+
+    def test_arguments(self):
+        volume, cameras = _calls()['SPECT_project_parallelholes'][0][0:2]
+        self.assertRaises(TypeError, call_backend, 'SPECT_project_parallelholes', volume, cameras, activity=volume, backend='numpy')
+        self.assertRaises(TypeError, call_backend, 'SPECT_project_parallelholes', *((volume, cameras)+(None,)*8), backend='numpy')
+
+    def test_selection(self):
+        self.assertEqual(select_backend('TR_resample_grid', N**3, backend='numpy').name, 'numpy')
+        self.assertRaises(NoBackendAvailable, select_backend, 'TR_resample_grid', N**3, 'cuda')
+        if select_backend('TR_resample_grid', 128**3).name != 'gpu':
+            self.assertRaises(NoBackendAvailable, select_backend, 'TR_resample_grid', N**3, 'gpu')
+        self.assertEqual(list_backends('resample_image_rigid'), ['gpu','c'])
+
+    def test_environment(self):
+        os.environ['NIFTYPY_BACKEND_TR_RESAMPLE_GRID'] = 'numpy'
+        try:
+            self.assertEqual(select_backend('TR_resample_grid', 128**3).name, 'numpy')
+        finally:
+            del os.environ['NIFTYPY_BACKEND_TR_RESAMPLE_GRID']
+        os.environ['NIFTYPY_BACKEND'] = 'numpy'
+        try:
+            # operations without a 'numpy' backend are not affected
+            if NiftyReg.niftyreg_c.available():
+                self.assertNotEqual(select_backend('resample_image_rigid', N**3).name, 'numpy')
+            self.assertEqual(select_backend('SPECT_project_parallelholes', 128**3).name, 'numpy')
+        finally:
+            del os.environ['NIFTYPY_BACKEND']
+
+
+if __name__ == '__main__':
+    unittest.main()
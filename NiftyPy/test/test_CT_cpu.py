@@ -0,0 +1,89 @@
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+import unittest
+import numpy
+from numpy import float32
+
+from NiftyPy.NiftyRec.CT_cpu import CT_project_parallelbeam_cpu, CT_backproject_parallelbeam_cpu, CT_project_conebeam_cpu, CT_backproject_conebeam_cpu
+
+N = 8
+
+
+def inner(a, b):
+    return float(numpy.vdot(numpy.asarray(a, dtype=numpy.float64), numpy.asarray(b, dtype=numpy.float64)))
+
+
+class TestCT_parallelbeam(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.attenuation = numpy.asfortranarray(rng.rand(N,N,N), dtype=float32)
+        self.cameras = numpy.asfortranarray([[0.0],[0.4],[numpy.pi/2],[2.0]], dtype=float32)
+        self.projection = numpy.asfortranarray(rng.rand(N,N,4), dtype=float32)
+
+    def test_adjoint(self):
+        a = inner(CT_project_parallelbeam_cpu(self.attenuation, self.cameras), self.projection)
+        b = inner(self.attenuation, CT_backproject_parallelbeam_cpu(self.projection, self.cameras, shape=(N,N,N)))
+        self.assertAlmostEqual(a/b, 1.0, places=4)
+
+    def test_batch_invariance(self):
+        # one camera per batch, and slabs of 2 planes
+        for batch_voxels in (N**3, 2*N*N):
+            self.assertTrue(numpy.allclose(CT_project_parallelbeam_cpu(self.attenuation, self.cameras),
+                                           CT_project_parallelbeam_cpu(self.attenuation, self.cameras, batch_voxels=batch_voxels), rtol=1e-5, atol=1e-5))
+            self.assertTrue(numpy.allclose(CT_backproject_parallelbeam_cpu(self.projection, self.cameras),
+                                           CT_backproject_parallelbeam_cpu(self.projection, self.cameras, batch_voxels=batch_voxels), rtol=1e-5, atol=1e-5))
+
+    def test_uniform_cube(self):
+        projection = CT_project_parallelbeam_cpu(numpy.ones((N,N,N), dtype=float32, order="F"), self.cameras[0:1])
+        self.assertTrue(numpy.allclose(projection, N))
+
+    def test_accumulate(self):
+        out = numpy.ones((N,N,N), dtype=float32, order="F")
+        CT_backproject_parallelbeam_cpu(self.projection, self.cameras, out=out)
+        self.assertTrue(numpy.allclose(out, 1 + CT_backproject_parallelbeam_cpu(self.projection, self.cameras), atol=1e-5))
+
+
+class TestCT_conebeam(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.attenuation = numpy.asfortranarray(rng.rand(N,N,N), dtype=float32)
+        angles = numpy.asarray([0.0, 0.7, numpy.pi/2, 2.5])
+        self.sources = numpy.asarray([2*N*numpy.cos(angles), 2*N*numpy.sin(angles), 0*angles]).T
+        self.cameras = -self.sources
+        self.projection = numpy.asfortranarray(rng.rand(N,N,4), dtype=float32)
+
+    def project(self, **kwargs):
+        return CT_project_conebeam_cpu(self.attenuation, self.cameras, self.sources, detector_shape=(N,N), **kwargs)
+
+    def backproject(self, **kwargs):
+        return CT_backproject_conebeam_cpu(self.projection, self.cameras, self.sources, shape=(N,N,N), **kwargs)
+
+    def test_adjoint(self):
+        a, b = inner(self.project(), self.projection), inner(self.attenuation, self.backproject())
+        self.assertAlmostEqual(a/b, 1.0, places=4)
+
+    def test_ray_batch_invariance(self):
+        self.assertTrue(numpy.allclose(self.project(), self.project(ray_batch=5), rtol=1e-5, atol=1e-5))
+        self.assertTrue(numpy.allclose(self.backproject(), self.backproject(ray_batch=5), rtol=1e-5, atol=1e-5))
+
+    def test_central_ray(self):
+        # the ray through the center of the volume crosses N voxels of a uniform cube (N even: between two pixels)
+        projection = CT_project_conebeam_cpu(numpy.ones((N,N,N), dtype=float32, order="F"), self.cameras[0:1], self.sources[0:1], detector_shape=(N+1,N+1))
+        self.assertAlmostEqual(float(projection[N//2,N//2,0]), N, places=4)
+
+    def test_accumulate_views(self):
+        out = numpy.zeros((N,N,N), dtype=float32, order="F")
+        for n in range(4):
+            CT_backproject_conebeam_cpu(self.projection[:,:,n], self.cameras[n:n+1], self.sources[n:n+1], out=out)
+        self.assertTrue(numpy.allclose(out, self.backproject(), rtol=1e-5, atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
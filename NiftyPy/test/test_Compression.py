@@ -0,0 +1,99 @@
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# Compression of PET projection data against a dense reference, on a structure whose angle pairs are stored
+# out of order and hold a random subset of the bins of their sinogram.
+
+import unittest
+import numpy
+from numpy import float32
+
+from NiftyPy.NiftyRec.Compression import (CompressionIndex, PET_compress_projection_cpu, PET_uncompress_projection_cpu,
+    PET_compressed_to_sparse, PET_sparse_to_compressed, PET_uncompress_blocks, PET_uncompress_sinograms, location_chunks)
+
+N_axial, N_azimuthal, N_u, N_v = 2, 3, 5, 4
+
+
+def shuffled_structure(rng):
+    # offsets, locations and data of a structure, and the dense projection (N_axial,N_azimuthal,N_u,N_v) it encodes
+    offsets = numpy.zeros((N_azimuthal,N_axial), dtype=numpy.int32, order="F")
+    locations, data = [], []
+    dense = numpy.zeros((N_axial,N_azimuthal,N_u,N_v), dtype=float32)
+    start = 0
+    for pair in rng.permutation(N_axial*N_azimuthal):
+        azimuthal, axial = pair % N_azimuthal, pair // N_azimuthal
+        bins = numpy.sort(rng.permutation(N_u*N_v)[0:rng.randint(1, N_u*N_v+1)])
+        values = rng.rand(len(bins)).astype(float32)
+        offsets[azimuthal,axial] = start
+        locations.append([bins // N_v, bins % N_v, numpy.zeros(len(bins), dtype=int)])
+        data.append(values)
+        dense[axial,azimuthal].reshape(-1)[bins] = values
+        start += len(bins)
+    locations = numpy.asfortranarray(numpy.concatenate(locations, axis=1), dtype=numpy.uint16)
+    return offsets, locations, numpy.concatenate(data), dense
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.offsets, self.locations, self.data, self.dense = shuffled_structure(numpy.random.RandomState(0))
+
+    def test_index(self):
+        index = CompressionIndex(self.offsets, self.locations, N_u, N_v)
+        self.assertEqual(index.flat.dtype, numpy.int32)
+        self.assertFalse(index.flat.flags.writeable)
+        self.assertTrue(numpy.array_equal(self.dense.reshape(-1)[index.flat], self.data))
+        rows, columns = index.rows_columns()
+        self.assertTrue(numpy.array_equal(self.dense.reshape((N_axial*N_azimuthal,N_u*N_v))[rows,columns], self.data))
+
+    def test_round_trip(self):
+        uncompressed = PET_uncompress_projection_cpu(self.offsets, self.data, self.locations, N_u, N_v)
+        self.assertTrue(numpy.array_equal(uncompressed, self.dense.reshape(-1)))
+        self.assertTrue(numpy.array_equal(PET_compress_projection_cpu(self.offsets, uncompressed, self.locations, N_u, N_v), self.data))
+
+    def test_out(self):
+        out = numpy.ones(self.dense.shape, dtype=float32)
+        self.assertTrue(PET_uncompress_projection_cpu(self.offsets, self.data, self.locations, N_u, N_v, out=out) is out)
+        self.assertTrue(numpy.array_equal(out, self.dense))
+        for out in (numpy.zeros(self.dense.size+1, dtype=float32), numpy.zeros(self.dense.size, dtype=numpy.float64),
+                    numpy.zeros(self.dense.shape, dtype=float32, order="F")):
+            self.assertRaises(ValueError, PET_uncompress_projection_cpu, self.offsets, self.data, self.locations, N_u, N_v, out=out)
+
+    def test_blocks(self):
+        sinograms = self.dense.reshape((N_axial*N_azimuthal,N_u,N_v))
+        for block_size in (1, 4, N_axial*N_azimuthal):
+            for reuse in (False, True):
+                blocks = [(first, block.copy()) for first, block in PET_uncompress_blocks(self.offsets, self.data, self.locations, N_u, N_v, block_size, reuse=reuse)]
+                self.assertTrue(numpy.array_equal(numpy.concatenate([block for first, block in blocks]), sinograms))
+                self.assertEqual([first for first, block in blocks], list(range(0, N_axial*N_azimuthal, block_size)))
+        for azimuthal, axial, sinogram in PET_uncompress_sinograms(self.offsets, self.data, self.locations, N_u, N_v):
+            self.assertTrue(numpy.array_equal(sinogram, self.dense[axial,azimuthal]))
+        self.assertRaises(ValueError, lambda: list(PET_uncompress_blocks(self.offsets, self.data, self.locations, N_u, N_v, start=1, stop=0)))
+
+    def test_location_chunks(self):
+        chunks = list(location_chunks(self.offsets, self.locations.shape[1], 7))
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], self.locations.shape[1])
+        boundaries = set(self.offsets.reshape(-1).tolist() + [self.locations.shape[1]])
+        for start, stop in chunks:
+            self.assertTrue(start in boundaries and stop in boundaries and stop > start)
+
+    def test_sparse(self):
+        try:
+            import scipy.sparse
+        except ImportError:
+            self.skipTest("scipy is not installed")
+        matrix = PET_compressed_to_sparse(self.offsets, self.data, self.locations, N_u, N_v)
+        self.assertTrue(numpy.array_equal(matrix.toarray(), self.dense.reshape((N_axial*N_azimuthal,N_u*N_v))))
+        self.assertEqual(PET_compressed_to_sparse(self.offsets, self.data, self.locations, N_u, N_v, format='coo').nnz, len(self.data))
+        self.assertTrue(numpy.array_equal(PET_sparse_to_compressed(matrix, self.offsets, self.locations, N_u, N_v), self.data))
+        self.assertRaises(ValueError, PET_compressed_to_sparse, self.offsets, self.data, self.locations, N_u, N_v, format='dok')
+
+
+if __name__ == '__main__':
+    unittest.main()
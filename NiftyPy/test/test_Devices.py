@@ -0,0 +1,60 @@
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# DeviceManager with a fake library of two GPUs.
+
+import threading
+import unittest
+
+from NiftyPy.NiftyRec.Devices import DeviceManager
+
+
+class TestDeviceManager(unittest.TestCase):
+    def setUp(self):
+        self.selected = []
+        self.enumerated = []
+        def enumerate():
+            self.enumerated.append(1)
+            return [{'id':0}, {'id':1}]
+        self.devices = DeviceManager(enumerate, self.selected.append, lambda: None)
+
+    def test_use_restores_the_default(self):
+        with self.devices.use(1):
+            self.assertEqual(self.devices.current(), 1)
+        self.assertEqual(self.devices.current(), 0)
+        self.assertEqual(self.selected, [1, 0])
+
+    def test_use_restores_on_error(self):
+        self.devices.select(1)
+        try:
+            with self.devices.use(0):
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertEqual(self.devices.current(), 1)
+
+    def test_select_is_cached_and_checked(self):
+        self.devices.select(1)
+        self.devices.select(1)
+        self.assertEqual(self.selected, [1])
+        self.assertRaises(ValueError, self.devices.select, 2)
+        self.assertEqual(len(self.enumerated), 1)
+
+    def test_selection_per_thread(self):
+        self.devices.bind(1)
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append((self.devices.current(), self.devices.bound())))
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [(None, None)])
+        self.assertEqual(self.devices.bound(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from NiftyPy.DiskCache import DiskCache
+
+
+class TestDiskCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='niftypy_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_put_get(self):
+        cache = DiskCache(self.directory)
+        key = cache.key(numpy.arange(3), 'psf', 1.0)
+        self.assertEqual(key, cache.key(numpy.arange(3), 'psf', 1.0))
+        self.assertNotEqual(key, cache.key(numpy.arange(3), 'psf', 2.0))
+        self.assertTrue(cache.get(key) is None)
+        stored = cache.put(key, numpy.arange(10, dtype=numpy.float32))
+        self.assertFalse(stored.flags.writeable)
+        self.assertTrue((cache.get(key) == numpy.arange(10)).all())
+
+    def test_eviction_keeps_the_new_entry(self):
+        cache = DiskCache(self.directory, max_bytes=1000)
+        cache.put('a', numpy.ones(100, dtype=numpy.float32))
+        stored = cache.put('b', numpy.ones(100, dtype=numpy.float32))
+        self.assertTrue((stored == 1).all())
+        self.assertTrue(cache.get('a') is None)
+        self.assertTrue(cache.get('b') is not None)
+        # the file of an entry (header included) can exceed max_bytes: it is still returned
+        cache.max_bytes = 450
+        self.assertTrue((cache.put('c', numpy.ones(100, dtype=numpy.float32)) == 1).all())
+
+    def test_entry_larger_than_the_cache(self):
+        cache = DiskCache(self.directory, max_bytes=1000)
+        cache.put('a', numpy.ones(10, dtype=numpy.float32))
+        array = cache.put('big', numpy.ones(1000, dtype=numpy.float32))
+        self.assertTrue((array == 1).all())
+        self.assertFalse(array.flags.writeable)
+        self.assertTrue(cache.get('big') is None)
+        self.assertTrue(cache.get('a') is not None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# List-mode events against a dense histogram of the fully sampled projection, on the structure of test_Compression.
+
+import os
+import tempfile
+import unittest
+import numpy
+from numpy import float32
+
+from NiftyPy.NiftyRec import ListMode
+from NiftyPy.NiftyRec.ListMode import ListModeIngester, LISTMODE_BINNED
+from NiftyPy.NiftyRec.Compression import CompressionIndex
+from NiftyPy.test.test_Compression import shuffled_structure, N_axial, N_azimuthal, N_u, N_v
+
+N_EVENTS = 5000
+
+
+class TestListMode(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.offsets, self.locations = shuffled_structure(rng)[0:2]
+        self.events = numpy.zeros(N_EVENTS, dtype=LISTMODE_BINNED)
+        # some events out of the scanner (v == N_v)
+        for field, N in (('azimuthal',N_azimuthal), ('axial',N_axial), ('u',N_u), ('v',N_v+1)):
+            self.events[field] = rng.randint(0, N, N_EVENTS)
+        self.weights = rng.rand(N_EVENTS)
+        valid = self.events['v'] < N_v
+        flat = ((self.events['axial'].astype(int)*N_azimuthal + self.events['azimuthal'])*N_u + self.events['u'])*N_v + self.events['v']
+        self.histogram = numpy.zeros(N_axial*N_azimuthal*N_u*N_v)
+        numpy.add.at(self.histogram, flat[valid], 1)
+        self.weighted = numpy.zeros(N_axial*N_azimuthal*N_u*N_v)
+        numpy.add.at(self.weighted, flat[valid], self.weights[valid])
+        self.index = CompressionIndex(self.offsets, self.locations, N_u, N_v)
+
+    def ingesters(self):
+        # the structure lists about half of the bins: lookup table
+        ingester = ListModeIngester(self.offsets, self.locations, N_u, N_v)
+        self.assertTrue(ingester._lookup is not None)
+        yield ingester
+        # binary search
+        previous = ListMode.LOOKUP_MAX_RATIO
+        ListMode.LOOKUP_MAX_RATIO = 0
+        try:
+            ingester = ListModeIngester(self.offsets, self.locations, N_u, N_v)
+        finally:
+            ListMode.LOOKUP_MAX_RATIO = previous
+        self.assertTrue(ingester._lookup is None)
+        yield ingester
+
+    def test_histogram(self):
+        expected = self.histogram[self.index.flat]
+        for ingester in self.ingesters():
+            out = numpy.zeros(self.index.N_locations, dtype=float32)
+            for start in range(0, N_EVENTS, 1000):
+                ingester.add(self.events[start:start+1000], out)
+            self.assertTrue(numpy.array_equal(out, expected))
+            self.assertEqual(ingester.events, N_EVENTS)
+            self.assertEqual(ingester.dropped, N_EVENTS - int(expected.sum()))
+
+    def test_weights(self):
+        for ingester in self.ingesters():
+            out = numpy.zeros(self.index.N_locations, dtype=float32)
+            ingester.add(self.events, out, weights=self.weights)
+            self.assertTrue(numpy.allclose(out, self.weighted[self.index.flat], rtol=1e-5))
+
+    def test_sparse_structure(self):
+        # one bin per angle pair: no table of the size of the fully sampled projection
+        offsets = numpy.asfortranarray(numpy.arange(N_azimuthal*N_axial).reshape((N_azimuthal,N_axial), order="F"), dtype=numpy.int32)
+        locations = numpy.zeros((3,N_azimuthal*N_axial), dtype=numpy.uint16, order="F")
+        ingester = ListModeIngester(offsets, locations, N_u, N_v)
+        self.assertTrue(ingester._lookup is None)
+        out = numpy.zeros(N_azimuthal*N_axial, dtype=float32)
+        ingester.add(self.events, out)
+        # location k is the bin (0,0) of the angle pair k
+        self.assertTrue(numpy.array_equal(out, self.histogram.reshape((N_axial*N_azimuthal,N_u*N_v))[:,0]))
+
+    def test_ingest(self):
+        f, filename = tempfile.mkstemp(suffix='.lm')
+        try:
+            os.write(f, self.events.tostring())
+            os.close(f)
+            ingester = ListModeIngester(self.offsets, self.locations, N_u, N_v, chunk_events=333)
+            self.assertTrue(numpy.array_equal(ingester.ingest(filename), self.histogram[self.index.flat]))
+            # a range of the events, accumulated on the previous counts
+            out = numpy.ones(self.index.N_locations, dtype=float32)
+            reference = numpy.zeros(self.index.N_locations, dtype=float32)
+            ListModeIngester(self.offsets, self.locations, N_u, N_v).add(self.events[1000:3500], reference)
+            ingester.ingest(filename, out=out, start=1000, count=2500)
+            self.assertTrue(numpy.array_equal(out, 1 + reference))
+            self.assertEqual(ingester.events, N_EVENTS + 2500)
+        finally:
+            os.remove(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+import unittest
+import numpy
+from numpy import float32, int32
+
+from NiftyPy.NiftyRec.PET_cpu import PET_project_compressed_cpu, PET_backproject_compressed_cpu, CompressedGeometry
+from NiftyPy.NiftyRec.Compression import PET_initialize_compression_structure_cpu
+
+N = 8
+
+
+def PET_parameters(n, attenuation=None):
+    """Keyword arguments of the compressed PET projectors (without the activity and use_gpu) for an n^3 volume. """
+    N_axial, N_azimuthal = 2, 4
+    offsets, locations = PET_initialize_compression_structure_cpu(N_axial, N_azimuthal, n, n)
+    size = 0.0 if attenuation is None else float(n)
+    return dict(attenuation=attenuation, offsets=offsets, locations=locations, active=numpy.ones((N_azimuthal,N_axial), dtype=int32, order="F"),
+                N_axial=N_axial, N_azimuthal=N_azimuthal, angles_axial=numpy.asarray([0.0,0.2], dtype=float32),
+                angles_azimuthal=numpy.asarray(numpy.linspace(0, numpy.pi, N_azimuthal, endpoint=False), dtype=float32),
+                N_u=n, N_v=n, size_u=float(n), size_v=float(n), activity_size_x=float(n), activity_size_y=float(n), activity_size_z=float(n),
+                attenuation_size_x=size, attenuation_size_y=size, attenuation_size_z=size,
+                T_activity_x=0.0, T_activity_y=0.0, T_activity_z=0.0, R_activity_x=0.0, R_activity_y=0.0, R_activity_z=0.0,
+                T_attenuation_x=0.0, T_attenuation_y=0.0, T_attenuation_z=0.0, R_attenuation_x=0.0, R_attenuation_y=0.0, R_attenuation_z=0.0,
+                N_samples=2*n, sample_step=0.75, background=0.0, background_attenuation=0.0, direction=0, block_size=0)
+
+
+def inner(a, b):
+    return float(numpy.vdot(numpy.asarray(a, dtype=numpy.float64), numpy.asarray(b, dtype=numpy.float64)))
+
+
+class TestPET_cpu(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.activity = numpy.asfortranarray(rng.rand(N,N,N), dtype=float32)
+        self.attenuation = numpy.asfortranarray(0.05*rng.rand(N,N,N), dtype=float32)
+        self.N_locations = 2*4*N*N
+        self.projection = rng.rand(self.N_locations).astype(float32)
+
+    def project(self, parameters, **kwargs):
+        return PET_project_compressed_cpu(self.activity, use_gpu=0, truncate_negative_values=0, **dict(parameters, **kwargs))
+
+    def backproject(self, parameters, **kwargs):
+        return PET_backproject_compressed_cpu(self.projection, use_gpu=0, N_activity_x=N, N_activity_y=N, N_activity_z=N, **dict(parameters, **kwargs))
+
+    def test_adjoint(self):
+        for attenuation in (None, self.attenuation):
+            parameters = PET_parameters(N, attenuation)
+            a, b = inner(self.project(parameters), self.projection), inner(self.activity, self.backproject(parameters))
+            self.assertAlmostEqual(a/b, 1.0, places=4)
+
+    def test_chunk_invariance(self):
+        parameters = PET_parameters(N, self.attenuation)
+        self.assertTrue(numpy.allclose(self.project(parameters), self.project(parameters, chunk_size=7), rtol=1e-5, atol=1e-6))
+        self.assertTrue(numpy.allclose(self.backproject(parameters), self.backproject(parameters, chunk_size=7), rtol=1e-5, atol=1e-5))
+
+    def test_inactive_angles(self):
+        parameters = PET_parameters(N)
+        parameters['active'][1,:] = 0
+        projection = self.project(parameters).reshape((2,4,N*N))
+        self.assertFalse(numpy.any(projection[:,1]))
+        self.assertTrue(numpy.all(numpy.any(projection[:,0], axis=1)))
+
+    def test_geometry_memory(self):
+        # a structure of 2**30 locations (a view of a single location, 6 bytes): the geometry stores only the tables
+        # of the angle pairs and the samples of a chunk scale with the size of the chunk
+        parameters = PET_parameters(N)
+        N_locations = 2**30
+        locations = numpy.lib.stride_tricks.as_strided(numpy.zeros(3, dtype=numpy.uint16), shape=(3,N_locations), strides=(2,0))
+        offsets = numpy.asfortranarray(numpy.arange(8).reshape((4,2), order='F') * (N_locations//8), dtype=int32)
+        geometry = CompressedGeometry(offsets, locations, None, parameters['angles_axial'], parameters['angles_azimuthal'],
+                                      N, N, N, N, 2*N, 0.75)
+        stored = sum([value.nbytes for value in vars(geometry).values() if isinstance(value, numpy.ndarray) and value is not locations])
+        self.assertTrue(stored < 4096)
+        for chunk_size in (10, 1000):
+            start = N_locations - chunk_size
+            points = geometry.points(start, N_locations)
+            self.assertEqual(sum([p.nbytes for p in points]), 3*chunk_size*2*N*8)
+            self.assertTrue(numpy.all(geometry.pairs(start, N_locations) == 7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# SPECT projections through a ProcessPool of two workers, with the NumPy engine (the workers are forked after
+# the engine is selected), against the serial call.
+
+import os
+import unittest
+import numpy
+from numpy import float32
+
+from NiftyPy.NiftyRec import NiftyRec
+from NiftyPy.ProcessPool import ProcessPool, SharedArray
+
+N = 8
+
+
+class TestProcessPool(unittest.TestCase):
+    def setUp(self):
+        self.engine = NiftyRec.cpu_engine
+        NiftyRec.set_cpu_engine('numpy')
+        self.activity = numpy.asfortranarray(numpy.random.RandomState(0).rand(N,N,N), dtype=float32)
+        self.cameras = numpy.asfortranarray(numpy.linspace(0, numpy.pi, 6).reshape(-1,1), dtype=float32)
+        self.expected = NiftyRec.SPECT_project_parallelholes(self.activity, self.cameras, use_gpu=0)
+        self.pool = ProcessPool(2)
+
+    def tearDown(self):
+        self.pool.close()
+        NiftyRec.set_cpu_engine(self.engine)
+
+    def test_SPECT_project(self):
+        activity = self.pool.share(self.activity)
+        halves = [self.pool.share(self.cameras[0:3]), self.pool.share(self.cameras[3:6])]
+        # 'out': the wrapper writes in the shared block, whose handle is returned
+        outs = [self.pool.empty((N,N,3)) for c in halves]
+        results = self.pool.map(NiftyRec.SPECT_project_parallelholes,
+                                [((activity, cameras), dict(use_gpu=0, out=out)) for cameras, out in zip(halves, outs)])
+        self.assertEqual([r.filename for r in results], [o.filename for o in outs])
+        self.assertTrue(numpy.allclose(numpy.concatenate([o.array for o in outs], axis=2), self.expected, atol=1e-6))
+        # 'into': the result of the wrapper is copied in the shared block
+        into = self.pool.empty((N,N,6))
+        self.assertTrue(isinstance(self.pool.apply(NiftyRec.SPECT_project_parallelholes, activity, self.pool.share(self.cameras),
+                                                   use_gpu=0, into=into), SharedArray))
+        self.assertTrue(numpy.allclose(into.array, self.expected, atol=1e-6))
+
+    def test_close_removes_the_blocks(self):
+        blocks = [self.pool.share(self.activity), self.pool.empty((N,N,6)), self.pool.share(self.cameras)]
+        if self.pool.directory is not None:
+            self.assertTrue(all([os.path.dirname(b.filename) == self.pool.directory for b in blocks]))
+        self.pool.apply(NiftyRec.SPECT_project_parallelholes, blocks[0], blocks[2], use_gpu=0, out=blocks[1])
+        released = self.pool.share(self.cameras)
+        self.pool.release(released)
+        self.assertFalse(os.path.exists(released.filename))
+        self.assertTrue(all([os.path.exists(b.filename) for b in blocks]))
+        self.pool.close()
+        self.assertFalse(any([os.path.exists(b.filename) for b in blocks]))
+
+
+if __name__ == '__main__':
+    unittest.main()
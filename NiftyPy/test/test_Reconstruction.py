@@ -0,0 +1,81 @@
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# MLEM / OSEM with the NumPy SPECT engine, on a small phantom and noiseless data.
+
+import unittest
+import numpy
+from numpy import float32
+
+from NiftyPy.NiftyRec import NiftyRec
+from NiftyPy.NiftyRec.Subsets import SPECT_subsets
+from NiftyPy.NiftyRec.Reconstruction import OSEM_reconstruction
+from NiftyPy.NiftyRec.SPECT_cpu import SPECT_project_parallelholes_cpu, SPECT_backproject_parallelholes_cpu
+
+N = 8
+
+
+class TestReconstruction(unittest.TestCase):
+    def setUp(self):
+        self.engine = NiftyRec.cpu_engine
+        NiftyRec.set_cpu_engine('numpy')
+        self.phantom = numpy.zeros((N,N,N), dtype=float32, order="F")
+        self.phantom[2:6,2:6,2:6] = 1
+        self.phantom[3:5,3:5,3:5] = 4
+        self.cameras = numpy.asfortranarray(numpy.linspace(0, numpy.pi, 12, endpoint=False).reshape(-1,1), dtype=float32)
+        self.measurement = SPECT_project_parallelholes_cpu(self.phantom, self.cameras)
+
+    def tearDown(self):
+        NiftyRec.set_cpu_engine(self.engine)
+
+    def reconstruction(self, N_subsets):
+        return OSEM_reconstruction(SPECT_subsets(self.cameras, N_subsets, use_gpu=0), self.measurement, shape=(N,N,N))
+
+    def residual(self, activity):
+        projection = SPECT_project_parallelholes_cpu(activity, self.cameras)
+        return numpy.sqrt(((projection - self.measurement)**2).sum() / (self.measurement**2).sum())
+
+    def test_MLEM_converges(self):
+        mlem = self.reconstruction(1)
+        residuals = []
+        for i in range(4):
+            residuals.append(self.residual(mlem.iterate(10)))
+        self.assertTrue(numpy.all(numpy.diff(residuals) < 0), residuals)
+        self.assertTrue(residuals[-1] < 0.1 * self.residual(numpy.ones((N,N,N), dtype=float32)), residuals)
+        self.assertEqual(mlem.iteration, 40)
+
+    def test_one_subset_is_MLEM(self):
+        # x <- x * B(y / P x) / B(1), with the serial NumPy projectors
+        expected = numpy.ones((N,N,N), dtype=float32, order="F")
+        sensitivity = SPECT_backproject_parallelholes_cpu(numpy.ones(self.measurement.shape, dtype=float32), self.cameras, shape=(N,N,N))
+        for i in range(5):
+            ratio = self.measurement / numpy.maximum(SPECT_project_parallelholes_cpu(expected, self.cameras), 1e-9)
+            expected *= SPECT_backproject_parallelholes_cpu(ratio, self.cameras, shape=(N,N,N))
+            expected[sensitivity > 1e-9] /= sensitivity[sensitivity > 1e-9]
+        initial = numpy.ones((N,N,N), dtype=float32, order="F")
+        osem = OSEM_reconstruction(SPECT_subsets(self.cameras, 1, use_gpu=0), self.measurement, activity=initial)
+        self.assertTrue(osem.iterate(5) is initial)
+        self.assertTrue(numpy.allclose(initial, expected, rtol=1e-4, atol=1e-5))
+        # more subsets: different path, same fixed point
+        self.assertTrue(self.residual(self.reconstruction(4).iterate(10)) < self.residual(expected))
+
+    def test_early_stopping(self):
+        records = []
+        osem = self.reconstruction(3)
+        osem.iterate(200, tolerance=1e-2, callback=lambda reconstruction, record: records.append(record))
+        self.assertTrue(osem.iteration < 200)
+        self.assertEqual(records, osem.history)
+        self.assertEqual(len(osem.history), osem.iteration)
+        self.assertTrue(osem.history[-1]['change'] < 1e-2)
+        self.assertTrue(all([record['change'] >= 1e-2 for record in osem.history[:-1]]))
+        self.assertEqual(osem.history[-1]['subsets'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
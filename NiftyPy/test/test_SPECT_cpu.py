@@ -0,0 +1,94 @@
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+import unittest
+import numpy
+from numpy import float32
+
+from NiftyPy.NiftyRec import NiftyRec
+from NiftyPy.NiftyRec.SPECT_cpu import SPECT_project_parallelholes_cpu, SPECT_backproject_parallelholes_cpu
+
+N = 8
+
+
+def inner(a, b):
+    return float(numpy.vdot(numpy.asarray(a, dtype=numpy.float64), numpy.asarray(b, dtype=numpy.float64)))
+
+
+class TestSPECT_cpu(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.RandomState(0)
+        self.activity = numpy.asfortranarray(rng.rand(N,N,N), dtype=float32)
+        self.cameras = numpy.asfortranarray(numpy.linspace(0, numpy.pi, 5).reshape(-1,1), dtype=float32)
+        self.attenuation = numpy.asfortranarray(0.05*rng.rand(N,N,N), dtype=float32)
+        self.psf = numpy.asfortranarray(rng.rand(3,3,N), dtype=float32)
+        self.projection = numpy.asfortranarray(rng.rand(N,N,5), dtype=float32)
+
+    def test_adjoint(self):
+        for attenuation, psf in ((None, None), (self.attenuation, self.psf)):
+            projection = SPECT_project_parallelholes_cpu(self.activity, self.cameras, attenuation, psf)
+            backprojection = SPECT_backproject_parallelholes_cpu(self.projection, self.cameras, attenuation, psf, shape=(N,N,N))
+            a, b = inner(projection, self.projection), inner(self.activity, backprojection)
+            self.assertAlmostEqual(a/b, 1.0, places=4)
+
+    def test_uniform_volume(self):
+        # camera at angle 0: the projection of a uniform volume is its depth
+        projection = SPECT_project_parallelholes_cpu(numpy.ones((N,N,N), dtype=float32, order="F"), self.cameras[0:1])
+        self.assertTrue(numpy.allclose(projection[1:-1,1:-1,0], N, rtol=1e-5))
+
+    def test_batch_invariance(self):
+        arguments = (self.activity, self.cameras, self.attenuation, self.psf)
+        self.assertTrue(numpy.allclose(SPECT_project_parallelholes_cpu(*arguments),
+                                       SPECT_project_parallelholes_cpu(*arguments, batch_voxels=N**3), rtol=1e-5, atol=1e-6))
+        arguments = (self.projection, self.cameras, self.attenuation, self.psf)
+        self.assertTrue(numpy.allclose(SPECT_backproject_parallelholes_cpu(*arguments),
+                                       SPECT_backproject_parallelholes_cpu(*arguments, batch_voxels=N**3), rtol=1e-5, atol=1e-6))
+
+    def test_stack_of_frames(self):
+        stack = numpy.asfortranarray(numpy.concatenate([self.activity[...,None], 2*self.activity[...,None]], axis=3))
+        projection = SPECT_project_parallelholes_cpu(stack, self.cameras, self.attenuation)
+        single = SPECT_project_parallelholes_cpu(self.activity, self.cameras, self.attenuation)
+        self.assertEqual(projection.shape, (N,N,5,2))
+        self.assertTrue(numpy.allclose(projection[...,0], single, rtol=1e-5))
+        self.assertTrue(numpy.allclose(projection[...,1], 2*single, rtol=1e-5))
+
+
+class _Library(object):
+    def __init__(self, available):
+        self._available = available
+    def available(self):
+        return self._available
+
+
+class TestEngineSelection(unittest.TestCase):
+    def setUp(self):
+        self.library, self.engine = NiftyRec.niftyrec_c, NiftyRec.cpu_engine
+
+    def tearDown(self):
+        NiftyRec.niftyrec_c = self.library
+        NiftyRec.set_cpu_engine(self.engine)
+
+    def test_no_library(self):
+        # use_gpu=0 runs on the NumPy engine; use_gpu=1 calls the C library (LibraryNotFound), never the CPU silently
+        NiftyRec.niftyrec_c = _Library(False)
+        NiftyRec.set_cpu_engine(NiftyRec.CPU_ENGINE_C)
+        self.assertTrue(NiftyRec._use_numpy_engine(0))
+        self.assertFalse(NiftyRec._use_numpy_engine(1))
+
+    def test_cpu_engine(self):
+        NiftyRec.niftyrec_c = _Library(True)
+        NiftyRec.set_cpu_engine(NiftyRec.CPU_ENGINE_C)
+        self.assertFalse(NiftyRec._use_numpy_engine(0))
+        NiftyRec.set_cpu_engine(NiftyRec.CPU_ENGINE_NUMPY)
+        self.assertTrue(NiftyRec._use_numpy_engine(0))
+        self.assertFalse(NiftyRec._use_numpy_engine(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# NiftyPy - Python interface to NiftyRec, NiftyReg, NiftySeg
+# Stefano Pedemonte
+# Centre for Medical Image Computing (CMIC), University College London (UCL)
+# 2009 - 2012, London
+# Aalto University, School of Science, Helsinki
+# Summer 2013, Helsinki
+# Martinos Center for Biomedical Imaging, Harvard University/MGH, Boston
+# Jan. 2015, Boston
+
+# Sharded projections of a CPU Scheduler against the serial calls, with the NumPy engines.
+
+import unittest
+import numpy
+from numpy import float32
+
+from NiftyPy.NiftyRec import NiftyRec
+from NiftyPy.NiftyRec.Scheduler import Scheduler
+from NiftyPy.test.test_PET_cpu import PET_parameters
+
+N = 8
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.engine = NiftyRec.cpu_engine
+        NiftyRec.set_cpu_engine('numpy')
+        rng = numpy.random.RandomState(0)
+        self.activity = numpy.asfortranarray(rng.rand(N,N,N), dtype=float32)
+        self.cameras = numpy.asfortranarray(numpy.linspace(0, numpy.pi, 7).reshape(-1,1), dtype=float32)
+        self.scheduler = Scheduler(N_workers=2, shard_size=2)
+
+    def tearDown(self):
+        self.scheduler.close()
+        NiftyRec.set_cpu_engine(self.engine)
+
+    def test_SPECT(self):
+        for activity in (self.activity, numpy.asfortranarray(numpy.concatenate([self.activity[...,None]]*2, axis=3))):
+            expected = NiftyRec.SPECT_project_parallelholes(activity, self.cameras, use_gpu=0)
+            projection = self.scheduler.SPECT_project_parallelholes(activity, self.cameras)
+            self.assertTrue(numpy.allclose(projection, expected, atol=1e-5))
+        projection = projection[...,0].copy(order="F")
+        expected = NiftyRec.SPECT_backproject_parallelholes(projection, self.cameras, use_gpu=0)
+        for N_shards in (None, 1, 7):
+            backprojection = self.scheduler.SPECT_backproject_parallelholes(projection, self.cameras, N_shards=N_shards)
+            self.assertTrue(numpy.allclose(backprojection, expected, rtol=1e-4, atol=1e-4))
+
+    def test_PET(self):
+        parameters = PET_parameters(N)
+        expected = NiftyRec.PET_project_compressed(self.activity, use_gpu=0, truncate_negative_values=0, **parameters)
+        projection = self.scheduler.PET_project_compressed(self.activity, truncate_negative_values=0, N_shards=3, **dict(parameters))
+        self.assertTrue(numpy.allclose(projection, expected, atol=1e-5))
+        kwargs = dict(parameters, N_activity_x=N, N_activity_y=N, N_activity_z=N)
+        expected = NiftyRec.PET_backproject_compressed(projection, use_gpu=0, **kwargs)
+        out = numpy.ones((N,N,N), dtype=float32, order="F")
+        backprojection = self.scheduler.PET_backproject_compressed(projection, out=out, N_shards=5, **dict(kwargs))
+        self.assertTrue(backprojection is out)
+        self.assertTrue(numpy.allclose(backprojection, expected, rtol=1e-4, atol=1e-4))
+
+    def test_errors(self):
+        def fail(worker):
+            raise ValueError("shard")
+        self.assertRaises(ValueError, self.scheduler.map, fail, [()])
+        self.assertEqual(self.scheduler.map(lambda worker, x: 2*x, [(1,),(2,),(3,)]), [2, 4, 6])
+        self.scheduler.close()
+        self.assertRaises(RuntimeError, self.scheduler.map, fail, [()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -53,6 +53,9 @@ setup(
         "simplewrap >= 0.3.0", 
         "DisplayNode >= 0.3.0", 
     ], 
+    extras_require={
+        "async": ["trollius"], 
+    }, 
 ) 
 
 